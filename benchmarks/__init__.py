@@ -0,0 +1 @@
+"""Benchmarks for the recommender. Run each module directly, e.g. python -m benchmarks.train_step_benchmark"""
@@ -0,0 +1,116 @@
+"""
+Measures the batch and exists queries against a large database before and after migrate_database adds the
+indexes. The database is seeded with the tables as they were before the indexes were declared, so the first
+round of queries shows the cost of scanning and the second the cost with the indexes.
+"""
+import argparse
+import logging
+import os
+import time
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+from recommender.collector import SCHEMA_BASE, migrate_database
+from recommender.collector.batch_manager import DatabaseBatchManager
+from recommender.collector.music import Track, Category, Genre, sample_key, \
+    TRACK_CATEGORY_ASSOCIATION, TRACK_GENRE_ASSOCIATION
+from recommender.collector.music_manager import RelationalDatabase
+import recommender.collector.observation as obs
+
+
+def seed(engine, tracks: int, observations: int, chunk_size: int = 10000) -> None:
+    """
+    Create the unindexed tables and fill them with tracks, their labels and a session of observations.
+    Args:
+        engine: the engine of the database to seed
+        tracks (int): the number of tracks to insert
+        observations (int): the number of training observations in the session "benchmark"
+        chunk_size (int): the number of rows per insert
+    """
+    with engine.begin() as connection:
+        for table in SCHEMA_BASE.metadata.sorted_tables:
+            connection.execute(CreateTable(table))
+        connection.execute(Category.__table__.insert(), [
+            {"cid": f"c{i}", "category_id": f"category{i}", "category": f"category {i}"} for i in range(20)])
+        connection.execute(Genre.__table__.insert(), [
+            {"gid": f"g{i}", "genre_id": f"genre{i}", "genre": f"genre {i}"} for i in range(50)])
+        connection.execute(obs.BatchSessions.__table__.insert(), {"batch_id": "benchmark", "count": observations})
+
+    for start in range(0, tracks, chunk_size):
+        ids = [f"track{i:08}" for i in range(start, min(start + chunk_size, tracks))]
+        with engine.begin() as connection:
+            connection.execute(Track.__table__.insert(), [
+                {"internal_id": f"internal{tid}", "track_id": tid, "sample_key": sample_key(tid),
+                 "url": f"https://example.com/{tid}", "title": tid, "artist": "artist"} for tid in ids])
+            connection.execute(TRACK_CATEGORY_ASSOCIATION.insert(), [
+                {"track_id": tid, "category_id": f"c{i % 20}"} for i, tid in enumerate(ids)])
+            connection.execute(TRACK_GENRE_ASSOCIATION.insert(), [
+                {"track_id": tid, "genre_id": f"g{i % 50}"} for i, tid in enumerate(ids)])
+            if start < observations:
+                connection.execute(obs.TrainingObservation.__table__.insert(), [
+                    {"id": f"benchmark:{tid}", "track_id": tid, "session": "benchmark"}
+                    for tid in ids[:observations - start]])
+
+
+def measure(session, tracks: int, observations: int, repeats: int) -> None:
+    """Print the mean latency of a page deep into the session, of a session summary and of track lookups."""
+    batches = DatabaseBatchManager(session, logging.getLogger("benchmark"), summary_ttl=0)
+    database = RelationalDatabase(session, logging.getLogger("benchmark"))
+    rng = np.random.RandomState(0)
+
+    def timed(name, query):
+        latencies = []
+        for _ in range(repeats):
+            session.expunge_all()
+            start = time.perf_counter()
+            query()
+            latencies.append(time.perf_counter() - start)
+        print(f"{name:<24} mean {np.mean(latencies) * 1000:10.3f}ms")
+
+    after = f"benchmark:track{observations // 2:08}"
+    timed("batch page", lambda: batches.get_training_batches("benchmark", 100, after=after))
+    timed("session summary", lambda: batches.get_session_summary("benchmark"))
+    timed("exists track", lambda: database.exists_track(f"track{rng.randint(tracks):08}"))
+    timed("missing track", lambda: database.exists_track("missing"))
+    timed("get genre", lambda: database.fetch_genre("g7"))
+
+
+def benchmark(url: str, tracks: int, observations: int, repeats: int) -> None:
+    """
+    Seed the database, measure the queries, add the indexes and measure them again.
+    Args:
+        url (str): the url of an empty database
+        tracks (int): the number of tracks to insert
+        observations (int): the number of observations in the benchmarked session
+        repeats (int): the number of times each query is run
+    """
+    engine = create_engine(url)
+    start = time.perf_counter()
+    seed(engine, tracks, observations)
+    print(f"seeded {tracks} tracks in {time.perf_counter() - start:.1f}s")
+    session = sessionmaker(bind=engine)()
+
+    print("before migration:")
+    measure(session, tracks, observations, repeats)
+
+    start = time.perf_counter()
+    created = migrate_database(engine, logging.getLogger("benchmark"))
+    print(f"created {len(created)} indexes in {time.perf_counter() - start:.1f}s")
+
+    print("after migration:")
+    measure(session, tracks, observations, repeats)
+    session.close()
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument("--url", default="sqlite:///benchmark.db",
+                        help="the url of an empty SQLite or Postgres database")
+    PARSER.add_argument("--tracks", default=1000000, type=int)
+    PARSER.add_argument("--observations", default=100000, type=int)
+    PARSER.add_argument("--repeats", default=10, type=int)
+    FLAGS = PARSER.parse_args()
+    if FLAGS.url.startswith("sqlite:///") and os.path.exists(FLAGS.url[len("sqlite:///"):]):
+        PARSER.error("the database already exists, remove it or pass another --url")
+    benchmark(FLAGS.url, FLAGS.tracks, FLAGS.observations, FLAGS.repeats)
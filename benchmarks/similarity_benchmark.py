@@ -0,0 +1,59 @@
+"""
+Compares the latency of the LSH index to the exact search over clustered result vectors and measures the recall
+of the index against the exact search.
+"""
+import argparse
+import logging
+import time
+import numpy as np
+from recommender.similarity.exact import ExactSearch, recall
+from recommender.similarity.lsh import LSHIndex
+
+
+def benchmark(tracks: int, dim: int, queries: int, k: int, bits: int, tables: int) -> None:
+    """
+    Build both engines over random clustered vectors and query the same tracks with each.
+    Args:
+        tracks (int): the number of tracks in the catalog
+        dim (int): the length of the vectors
+        queries (int): the number of tracks queried
+        k (int): the number of similar tracks per query
+        bits (int): the number of bits of every table of the index
+        tables (int): the number of tables of the index
+    """
+    random = np.random.RandomState(0)
+    centers = random.standard_normal((max(tracks // 200, 1), dim)).astype(np.float32)
+    vectors = centers[random.randint(0, len(centers), tracks)] + \
+        0.3 * random.standard_normal((tracks, dim)).astype(np.float32)
+    ids = [f"track{i}" for i in range(tracks)]
+    queried = [ids[i] for i in random.choice(tracks, queries, replace=False)]
+
+    exact = ExactSearch(ids, vectors, logging.getLogger("benchmark"))
+    start = time.perf_counter()
+    exact.query_many(queried, k)
+    print(f"exact: {(time.perf_counter() - start) / queries * 1000:.2f}ms per query in a batch of {queries}")
+    start = time.perf_counter()
+    exact.query(queried[0], k)
+    print(f"exact: {(time.perf_counter() - start) * 1000:.2f}ms for a single query")
+
+    index = LSHIndex(dim, logging.getLogger("benchmark"), bits=bits, tables=tables, seed=0)
+    start = time.perf_counter()
+    index.build(ids, vectors)
+    print(f"lsh: built in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    for track_id in queried:
+        index.query(track_id, k)
+    print(f"lsh: {(time.perf_counter() - start) / queries * 1000:.2f}ms per query")
+    print(f"lsh: recall@{k} {recall(index, exact, queried, k):.3f}")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument("--tracks", default=1000000, type=int)
+    PARSER.add_argument("--dim", default=64, type=int)
+    PARSER.add_argument("--queries", default=200, type=int)
+    PARSER.add_argument("-k", default=10, type=int)
+    PARSER.add_argument("--bits", default=16, type=int)
+    PARSER.add_argument("--tables", default=8, type=int)
+    FLAGS = PARSER.parse_args()
+    benchmark(FLAGS.tracks, FLAGS.dim, FLAGS.queries, FLAGS.k, FLAGS.bits, FLAGS.tables)
@@ -0,0 +1,56 @@
+"""
+Measures the latency of LearnerModel.train over a long session. The training operation is built once
+with the graph, so the latency of the last steps should match the latency of the first steps and the
+number of operations in the graph should not grow.
+"""
+import argparse
+import logging
+import time
+import numpy as np
+import tensorflow as tf
+from recommender.learner.model import LearnerModel
+
+
+def benchmark(steps: int, window: int, batch_size: int, categories: int) -> None:
+    """
+    Train the model over zero batches and print the mean step latency of every window of steps.
+    Args:
+        steps (int): the total number of training steps
+        window (int): the number of steps averaged for each report
+        batch_size (int): the number of observations in each batch
+        categories (int): the number of target categories
+    """
+    model = LearnerModel(categories=categories, logger=logging.getLogger("benchmark"))
+    model.build_graph()
+    model.initialize()
+
+    batch = np.zeros([batch_size, 2048, 32], dtype=np.float32)
+    y = np.zeros([batch_size, categories], dtype=np.float32)
+
+    # warm up the session before timing
+    model.train(batch, y)
+    operations = len(tf.get_default_graph().get_operations())
+
+    latencies = []
+    for step in range(steps):
+        start = time.perf_counter()
+        model.train(batch, y)
+        latencies.append(time.perf_counter() - start)
+        if (step + 1) % window == 0:
+            print(f"steps {step + 1 - window:>6}-{step + 1:<6} mean {np.mean(latencies[-window:]) * 1000:.3f}ms")
+
+    first = np.mean(latencies[:window])
+    last = np.mean(latencies[-window:])
+    print(f"graph operations: {operations} -> {len(tf.get_default_graph().get_operations())}")
+    print(f"latency ratio last/first window: {last / first:.3f}")
+    model.close()
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument("--steps", default=10000, type=int)
+    PARSER.add_argument("--window", default=1000, type=int)
+    PARSER.add_argument("--batch-size", default=1, type=int)
+    PARSER.add_argument("--categories", default=10, type=int)
+    FLAGS = PARSER.parse_args()
+    benchmark(FLAGS.steps, FLAGS.window, FLAGS.batch_size, FLAGS.categories)
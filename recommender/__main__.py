@@ -3,7 +3,7 @@ import argparse
 import configparser
 import os
 from recommender.train_ops import train
-from recommender.download_ops import download
+from recommender.download_ops import download, migrate
 from recommender.configuration.logging import configure as configure_logging
 
 PARSER = argparse.ArgumentParser()
@@ -41,6 +41,11 @@ def configure() -> argparse.Namespace:
     download_parser = learner_parser.add_parser("download")
     download_parser.set_defaults(group="database", method="download")
     download_parser.add_argument("--size", action="store", type=int, default=100)
+    download_parser.add_argument("--restart", action="store_true",
+                                 help="crawl every playlist from the start instead of resuming")
+
+    migrate_parser = learner_parser.add_parser("migrate")
+    migrate_parser.set_defaults(group="database", method="migrate")
 
     namespace = PARSER.parse_args()
 
@@ -67,6 +72,10 @@ def database(flags: argparse.Namespace, configuration: configparser.ConfigParser
         print("Starting to download based on configuration...")
         download(flags, configuration)
 
+    if flags.method == "migrate":
+        print("Migrating the database...")
+        migrate(flags, configuration)
+
 
 def main(flags: argparse.Namespace):
     """
@@ -13,12 +13,16 @@ class BatchConfiguration:
                  training_count: int = 0,
                  test_count: int = 0,
                  cross_test_count: int = 0,
-                 session_file: str = ""):
+                 session_file: str = "",
+                 seed: int = None,
+                 stratify: str = None):
         self.training_count = training_count
         self.test_count = test_count
         self.cross_test_count = cross_test_count
         self.session = session
         self.session_file = session_file
+        self.seed = seed
+        self.stratify = stratify
 
 
 class BatchOperator:
@@ -35,7 +39,8 @@ class BatchOperator:
 
     def create_batch(self):
         manager = DatabaseBatchManager(self.config.session, logging.getLogger("manager"))
-        bid = manager.create_batches(self.config.training_count, self.config.test_count, self.config.cross_test_count)
+        bid = manager.create_batches(self.config.training_count, self.config.test_count, self.config.cross_test_count,
+                                     seed=self.config.seed, stratify=self.config.stratify)
         self.file_config.set("session", "id", bid)
         self.file_config.set("session", "training_count", self.config.training_count)
         self.file_config.set("session", "test_count", self.config.test_count)
@@ -79,6 +84,7 @@ class BatchOperator:
                 return
             try:
                 training_count, test_count, cross_test_count = manager.get_session(batch_id)
+                incomplete = False
             except ValueError:
                 print("Enter a valid id.")
 
@@ -107,10 +113,13 @@ def create_batch(args: argparse.Namespace, config: configparser.ConfigParser):
     session.configure(bind=engine)
     sess = session()
 
+    seed = config.get("init", "seed", fallback="")
     config = BatchConfiguration(sess,
                                 config.getint("init", "training_count"),
                                 config.getint("init", "test_count"),
-                                config.getint("init", "cross_test_count"))
+                                config.getint("init", "cross_test_count"),
+                                seed=int(seed) if seed else None,
+                                stratify=config.get("init", "stratify", fallback="") or None)
 
     operator = BatchOperator(config, operation_logger)
     operator.create_batch()
@@ -1,5 +1,9 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import inspect, select, func, and_
+from typing import List
+import logging
 
 
 class BASE:
@@ -14,7 +18,7 @@ class BASE:
 
 SCHEMA_BASE = declarative_base(cls=BASE)
 
-from . import music, observation
+from . import music, observation, checkpoint, result
 
 
 def initialize_database(engine) -> None:
@@ -23,4 +27,72 @@ def initialize_database(engine) -> None:
     SCHEMA_BASE.metadata.create_all(engine)
 
 
+def migrate_database(engine, logger: logging.Logger = None) -> List[str]:
+    """
+    Bring an existing database up to the current schema. Missing tables are created, columns declared since a table
+    was created are added to it and the sample keys of the tracks saved before them are filled. The indexes declared
+    by the models are then added to tables created before them. Duplicate rows of key-less tables such as the associations are merged
+    before their unique indexes are created. Running the migration again does nothing.
+    Args:
+        engine: the engine of the database to migrate
+        logger (logging.Logger): the logger to track the migration
+
+    Returns:
+        List[str]: the names of the indexes created
+    """
+    logger = logger or logging.getLogger("migration")
+    SCHEMA_BASE.metadata.create_all(engine)
+    inspector = inspect(engine)
+
+    # create_all leaves the tables that exist untouched, so the columns added to their models are added here
+    compiler = engine.dialect.ddl_compiler(engine.dialect, None)
+    preparer = engine.dialect.identifier_preparer
+    for table in SCHEMA_BASE.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            with engine.begin() as connection:
+                connection.execute(f"ALTER TABLE {preparer.format_table(table)} "
+                                   f"ADD COLUMN {compiler.get_column_specification(column)}")
+            logger.info(f"added column {column.name} to {table.name}")
+
+    from recommender.collector.music_manager import RelationalDatabase
+    sess = sessionmaker(bind=engine)()
+    try:
+        RelationalDatabase(sess, logger).fill_sample_keys()
+    finally:
+        sess.close()
+
+    inspector = inspect(engine)
+    created = []
+    for table in SCHEMA_BASE.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+            if index.unique and len(table.primary_key.columns) == 0 and len(index.columns) == len(table.columns):
+                __merge_duplicates__(engine, table, list(index.columns), logger)
+            try:
+                index.create(engine)
+            except IntegrityError as e:
+                logger.error(f"unable to create {index.name}, {table.name} has duplicate rows: {e}")
+                continue
+            logger.info(f"created index {index.name} on {table.name}")
+            created.append(index.name)
+    return created
+
+
+def __merge_duplicates__(engine, table, columns, logger: logging.Logger) -> None:
+    """Replace the rows of a table repeating the same values in the columns with a single row."""
+    with engine.begin() as connection:
+        duplicates = connection.execute(select(columns).group_by(*columns).having(func.count() > 1)).fetchall()
+        for row in duplicates:
+            values = dict(zip([column.name for column in columns], row))
+            connection.execute(table.delete().where(and_(*[column == values[column.name] for column in columns])))
+            connection.execute(table.insert().values(**values))
+    if duplicates:
+        logger.info(f"merged {len(duplicates)} duplicate rows of {table.name}")
+
+
 __all__ = ["music", "learner"]
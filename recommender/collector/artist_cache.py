@@ -0,0 +1,126 @@
+"""A module for caching the genres of artists so each artist is only requested once."""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import threading
+import logging
+import json
+import os
+
+# the most artists the Web API returns for a single request
+ARTISTS_PER_REQUEST = 50
+
+
+class ArtistGenreCache:
+    """
+    A least recently used map from artist ids to their genres. Artists missing from the cache are requested in
+    batches of up to 50 ids. If a file is given, the cache is loaded from it and written back by save, so later
+    crawls start warm. The cache can be shared by several threads.
+    """
+
+    def __init__(self, logger: logging.Logger, max_size: int = 100000, file_name: str = None) -> None:
+        """
+        Create a cache, loading the artists saved in the file if it exists.
+        Args:
+            logger (logging.Logger): the logger to track the requests
+            max_size (int): the maximum number of artists kept
+            file_name (str): the JSON file to persist the cache to. If None, the cache is only kept in memory
+        """
+        self.__logger__ = logger
+        self.__max_size__ = max_size
+        self.__file_name__ = file_name
+        self.__lock__ = threading.Lock()
+        self.__genres__: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if file_name and os.path.exists(file_name):
+            with open(file_name, "r") as file:
+                # the artists are saved from the least to the most recently used
+                self.__genres__.update(json.load(file))
+            while len(self.__genres__) > self.__max_size__:
+                self.__genres__.popitem(last=False)
+
+    def get(self, artist_id: str) -> Optional[List[str]]:
+        """
+        Get the genres of an artist if they are cached.
+        Args:
+            artist_id (str): the remote id of the artist
+
+        Returns:
+            List[str]: the genres of the artist or None if the artist is not cached
+        """
+        with self.__lock__:
+            genres = self.__genres__.get(artist_id)
+            if genres is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__genres__.move_to_end(artist_id)
+            return genres
+
+    def put(self, artist_id: str, genres: List[str]) -> None:
+        """
+        Store the genres of an artist, evicting the least recently used artist if the cache is full.
+        Args:
+            artist_id (str): the remote id of the artist
+            genres (List[str]): the genres of the artist
+        """
+        with self.__lock__:
+            self.__genres__[artist_id] = list(genres)
+            self.__genres__.move_to_end(artist_id)
+            if len(self.__genres__) > self.__max_size__:
+                self.__genres__.popitem(last=False)
+
+    def resolve(self, ids: Iterable[str], fetch: Callable[[List[str]], List[Dict[str, Any]]]) \
+            -> Dict[str, List[str]]:
+        """
+        Get the genres of many artists. Artists that are not cached are fetched together in batches.
+        Args:
+            ids (Iterable[str]): the remote ids of the artists
+            fetch (Callable[[List[str]], List[Dict[str, Any]]]): a function requesting at most 50 artists and
+                returning the artist objects of the Web API, such as SpotifyApi.artists
+
+        Returns:
+            Dict[str, List[str]]: the genres of every artist. Artists that were not found have no genres
+        """
+        genres = {}
+        unknown = []
+        for artist_id in dict.fromkeys(ids):
+            cached = self.get(artist_id)
+            if cached is None:
+                unknown.append(artist_id)
+            else:
+                genres[artist_id] = cached
+
+        for start in range(0, len(unknown), ARTISTS_PER_REQUEST):
+            requested = unknown[start:start + ARTISTS_PER_REQUEST]
+            for artist in fetch(requested):
+                if artist is not None:
+                    self.put(artist["id"], artist["genres"])
+                    genres[artist["id"]] = artist["genres"]
+            # artists the Web API does not know are cached without genres, so they are not requested again
+            for artist_id in requested:
+                if artist_id not in genres:
+                    self.put(artist_id, [])
+                    genres[artist_id] = []
+        if unknown:
+            self.__logger__.debug(f"requested {len(unknown)} artists")
+        return genres
+
+    def save(self) -> None:
+        """Write the cache to its file, if it has one. The file is replaced atomically."""
+        if not self.__file_name__:
+            return
+        with self.__lock__:
+            genres = dict(self.__genres__)
+        directory = os.path.dirname(self.__file_name__)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        temp = f"{self.__file_name__}.{threading.get_ident()}.tmp"
+        with open(temp, "w") as file:
+            json.dump(genres, file)
+        os.replace(temp, self.__file_name__)
+        self.__logger__.info(f"saved the genres of {len(genres)} artists")
+
+    def __len__(self) -> int:
+        return len(self.__genres__)
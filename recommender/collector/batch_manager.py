@@ -1,27 +1,69 @@
 """A module for managing batches of sessions"""
 import uuid
+import time
+import random
 import logging
+import datetime
 import recommender.collector.observation as obs
 from sqlalchemy.orm.session import Session
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy import select, exists, and_, true, func, literal, cast, null, union_all, \
+    BigInteger, Float, String, DateTime
 from . import music
-from typing import List, Tuple
+from typing import Dict, Iterator, List, Tuple
+
+
+class SessionSummary:
+    """The sizes, label distribution and training progress of a batch session"""
+
+    def __init__(self,
+                 batch_id: str,
+                 training_count: int,
+                 test_count: int,
+                 cross_test_count: int,
+                 labels: Dict[str, int],
+                 last_trained: datetime.datetime = None):
+        self.batch_id = batch_id
+        self.training_count = training_count
+        self.test_count = test_count
+        self.cross_test_count = cross_test_count
+        # the number of observations of the session with each category or genre
+        self.labels = labels
+        # the last time a track of the session was trained
+        self.last_trained = last_trained
+
+    def __str__(self):
+        return f"{self.batch_id}: {self.training_count} training, {self.test_count} test, " \
+               f"{self.cross_test_count} cross test"
 
 
 class BatchManager:
-    def get_training_batches(self, batch_id: str, count: int = 10, skip: int = 0) \
+    def get_training_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
             -> List[Tuple[music.Track, List[str]]]:
         pass
 
-    def get_test_batches(self, batch_id: str, count: int = 10, skip: int = 0) \
+    def get_test_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
             -> List[Tuple[music.Track, List[str]]]:
         pass
 
-    def get_cross_test_batches(self, batch_id: str, count: int = 10, skip: int = 0) \
+    def get_cross_test_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
             -> List[Tuple[music.Track, List[str]]]:
         pass
 
+    def iterate_training_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        pass
+
+    def iterate_test_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        pass
+
+    def iterate_cross_test_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        pass
+
     def create_batches(self, training_count: int, test_count: int,
-                       cross_test_count: int, skip: int = 0):
+                       cross_test_count: int, skip: int = 0, seed: int = None, stratify: str = None):
         pass
 
     def extend_batches(self, batch_id: str, training_count: int,
@@ -34,209 +76,304 @@ class BatchManager:
     def get_session(self, batch_id: str) -> Tuple[int, int, int]:
         pass
 
+    def get_session_summary(self, batch_id: str) -> SessionSummary:
+        pass
+
 
 class DatabaseBatchManager(BatchManager):
-    def __init__(self, sess: Session, logger: logging.Logger) -> None:
+    def __init__(self, sess: Session, logger: logging.Logger, summary_ttl: float = 5.0) -> None:
         self.__sess__ = sess
         self.__logging__ = logger
         self.__generated__ = False
+        self.__summary_ttl__ = summary_ttl
+        self.__summaries__: Dict[str, Tuple[float, SessionSummary]] = {}
 
-    def get_training_batches(self, batch_id: str, count: int = 10, skip: int = 0) -> List[Tuple[music.Track, List[str]]]:
+    def __observations__(self, observation, batch_id: str, count: int, skip: int = 0, after: str = None) -> list:
+        """
+        Get a page of observations of a session ordered by their id. If after is given, the page starts right
+        after the observation with that id so the database seeks to the page instead of scanning the skipped rows.
+        The tracks and their targets are loaded eagerly, so a page always takes three statements.
+        """
+        query = self.__sess__.query(observation) \
+            .options(joinedload(observation.track).subqueryload(music.Track.categories),
+                     joinedload(observation.track).subqueryload(music.Track.genres)) \
+            .filter(observation.session == batch_id)
+        if after is not None:
+            query = query.filter(observation.id > after)
+        query = query.order_by(observation.id)
+        if skip:
+            query = query.offset(skip)
+        return query.limit(count).all()
+
+    @staticmethod
+    def __pairs__(observations: list) -> List[Tuple[music.Track, List[str]]]:
+        """Convert observations into pairs of the track and its targets."""
+        queries = []
+        for t in observations:
+            categories = [item.category for item in t.track.categories]
+            categories.extend([item.genre for item in t.track.genres])
+            queries.append((t.track, categories))
+        return queries
+
+    def __iterate__(self, observation, batch_id: str, count: int) -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        """Stream every observation of a session in pages, resuming each page from the last id seen."""
+        if batch_id is None:
+            return
+        after = None
+        while True:
+            observations = self.__observations__(observation, batch_id, count, after=after)
+            if not observations:
+                return
+            after = observations[-1].id
+            yield self.__pairs__(observations)
+
+    def get_training_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
+            -> List[Tuple[music.Track, List[str]]]:
         """
         Uses the specified database connection to get a list of training batches of the specified size.
         In addition, the number of songs to skip over should be kept track of externally. The result is a
         list of Track, List[str] pairs where Track is the track object as stored in the database. List[str] is
         the list of targets for the given track. If the session id is not specified, then this will return empty.
+        Prefer after or iterate_training_batches over skip for large sessions.
         Args:
             batch_id: the id of the batch
             count: the number of batch-pairs to fetch from the database. If there are not enough remaining
                 then only the remaining will be returned
             skip: the number of tracks to skip. Use this value to present the number of tracks to skip over
                 after training them
+            after: the id of the last observation fetched. The page starts after this observation
 
         Returns:
             List[(music.Track, List[str])]: the list of batch-pairs retrieved from the database.
         """
         if batch_id is None:
             return []
+        return self.__pairs__(self.__observations__(obs.TrainingObservation, batch_id, count, skip, after))
 
-        queries = []
-        tracks = self.__sess__.query(obs.TrainingObservation) \
-            .filter(obs.TrainingObservation.session == batch_id) \
-            .order_by(obs.TrainingObservation.id) \
-            .skip(skip) \
-            .limit(count) \
-            .all()
-
-        for t in tracks:
-            categories = [item.category for item in t.track.categories]
-            categories.extend([item.genre for item in t.track.genres])
-            queries.append((t.track, categories))
-        return queries
-
-    def get_test_batches(self, batch_id: str, count: int = 10, skip: int = 0) -> List[Tuple[music.Track, List[str]]]:
+    def get_test_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
+            -> List[Tuple[music.Track, List[str]]]:
         """
         Uses the specified database connection to get a list of test batches of the specified size.
         In addition, the number of songs to skip over should be kept track of externally. The result is a
         list of Track, List[str] pairs where Track is the track object as stored in the database. List[str] is
         the list of targets for the given track. If the session id is not specified, then this will return empty.
+        Prefer after or iterate_test_batches over skip for large sessions.
         Args:
             batch_id: the id of the batch
             count: the number of batch-pairs to fetch from the database. If there are not enough remaining
                 then only the remaining will be returned
             skip: the number of tracks to skip. Use this value to present the number of tracks to skip over
                 after training them
+            after: the id of the last observation fetched. The page starts after this observation
 
         Returns:
             List[(music.Track, List[str])]: the list of batch-pairs retrieved from the database.
         """
         if batch_id is None:
             return []
-        queries = []
-        tracks = self.__sess__.query(obs.TestObservation) \
-            .filter(obs.TestObservation.session == batch_id) \
-            .order_by(obs.TestObservation.id) \
-            .skip(skip) \
-            .limit(count) \
-            .all()
-        for t in tracks:
-            queries.append((t.track, [item.category for item in t.track.categories].extend(
-                [item.genre for item in t.track.genres])))
-        return queries
+        return self.__pairs__(self.__observations__(obs.TestObservation, batch_id, count, skip, after))
 
-    def get_cross_test_batches(self, batch_id: str, count: int = 10, skip: int = 0) -> List[Tuple[music.Track, List[str]]]:
+    def get_cross_test_batches(self, batch_id: str, count: int = 10, skip: int = 0, after: str = None) \
+            -> List[Tuple[music.Track, List[str]]]:
         """
         Uses the specified database connection to get a list of cross-test batches of the specified size.
         In addition, the number of songs to skip over should be kept track of externally. The result is a
         list of Track, List[str] pairs where Track is the track object as stored in the database. List[str] is
         the list of targets for the given track. If the session id is not specified, then this will return empty.
+        Prefer after or iterate_cross_test_batches over skip for large sessions.
         Args:
             batch_id (str): the id of the batch
             count (int): the number of batch-pairs to fetch from the database. If there are not enough remaining
                 then only the remaining will be returned
             skip (int): the number of tracks to skip. Use this value to present the number of tracks to skip over
                 after training them
+            after (str): the id of the last observation fetched. The page starts after this observation
 
         Returns:
             List[(music.Track, List[str])]: the list of batch-pairs retrieved from the database.
         """
         if batch_id is None:
             return []
-        queries = []
-        tracks = self.__sess__.query(obs.CrossTestObservation) \
-            .filter(obs.CrossTestObservation.session == batch_id) \
-            .order_by(obs.CrossTestObservation.id) \
-            .skip(skip) \
-            .limit(count) \
-            .all()
-        for t in tracks:
-            queries.append((t.track, [item.category for item in t.track.categories].extend(
-                [item.genre for item in t.track.genres])))
-        return queries
+        return self.__pairs__(self.__observations__(obs.CrossTestObservation, batch_id, count, skip, after))
+
+    def iterate_training_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        """
+        Stream the training batches of a session. Each page is fetched by seeking past the last observation
+        of the previous page, so every page takes the same time regardless of how far into the session it is.
+        Args:
+            batch_id (str): the id of the batch
+            count (int): the number of batch-pairs in each page
+
+        Returns:
+            Iterator[List[(music.Track, List[str])]]: the pages of batch-pairs in the session
+        """
+        return self.__iterate__(obs.TrainingObservation, batch_id, count)
 
-    def create_batches(self, training_count: int, test_count: int, cross_test_count: int, skip: int = 0) -> str:
+    def iterate_test_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        """
+        Stream the test batches of a session. See iterate_training_batches.
+        Args:
+            batch_id (str): the id of the batch
+            count (int): the number of batch-pairs in each page
+
+        Returns:
+            Iterator[List[(music.Track, List[str])]]: the pages of batch-pairs in the session
+        """
+        return self.__iterate__(obs.TestObservation, batch_id, count)
+
+    def iterate_cross_test_batches(self, batch_id: str, count: int = 10) \
+            -> Iterator[List[Tuple[music.Track, List[str]]]]:
+        """
+        Stream the cross-test batches of a session. See iterate_training_batches.
+        Args:
+            batch_id (str): the id of the batch
+            count (int): the number of batch-pairs in each page
+
+        Returns:
+            Iterator[List[(music.Track, List[str])]]: the pages of batch-pairs in the session
+        """
+        return self.__iterate__(obs.CrossTestObservation, batch_id, count)
+
+    @staticmethod
+    def __unassigned__(batch_id: str):
+        """Build a condition that holds for the tracks without an observation in any split of the session."""
+        return and_(*[~exists().where(and_(observation.__table__.c.session == batch_id,
+                                           observation.__table__.c.track_id == music.Track.track_id))
+                      for observation in (obs.TrainingObservation, obs.TestObservation, obs.CrossTestObservation)])
+
+    @staticmethod
+    def __ordered_tracks__(seed: int = None, stratify: str = None, batch_id: str = None):
+        """
+        Build a query of the track ids in the order they are assigned to a session. Without a seed the tracks are
+        ordered by id. With a seed, the sample key of each track is permuted by an affine map modulo a prime, which
+        shuffles the tracks without pulling them to the client; the same seed always gives the same order. When
+        stratified by "category" or "genre", the tracks are ordered by their relative rank within their first label,
+        so every prefix of the order, and so every split, keeps the proportions of the labels. If batch_id is given,
+        the tracks already assigned to the session are left out of the order.
+        """
+        unassigned = DatabaseBatchManager.__unassigned__(batch_id) if batch_id is not None else true()
+        if seed is None:
+            return select([music.Track.track_id]).where(unassigned).order_by(music.Track.track_id)
+
+        generator = random.Random(seed)
+        multiplier = generator.randrange(1, music.SAMPLE_KEY_MODULUS)
+        increment = generator.randrange(0, music.SAMPLE_KEY_MODULUS)
+        # the product of two keys takes up to 62 bits, so the map is computed in 64 bit integers
+        key = ((cast(music.Track.sample_key, BigInteger) * literal(multiplier, BigInteger) +
+                literal(increment, BigInteger)) % literal(music.SAMPLE_KEY_MODULUS, BigInteger)).label("key")
+
+        if stratify is None:
+            return select([music.Track.track_id]).where(unassigned).order_by(key, music.Track.track_id)
+
+        if stratify == "category":
+            association, label = music.TRACK_CATEGORY_ASSOCIATION, music.TRACK_CATEGORY_ASSOCIATION.c.category_id
+        elif stratify == "genre":
+            association, label = music.TRACK_GENRE_ASSOCIATION, music.TRACK_GENRE_ASSOCIATION.c.genre_id
+        else:
+            raise ValueError(f"cannot stratify by {stratify}")
+
+        strata = select([association.c.track_id, func.min(label).label("stratum")]) \
+            .group_by(association.c.track_id).alias("strata")
+        keyed = select([music.Track.track_id, key, strata.c.stratum]) \
+            .select_from(music.Track.__table__.outerjoin(strata, strata.c.track_id == music.Track.track_id)) \
+            .where(unassigned) \
+            .alias("keyed")
+        position = (cast(func.row_number().over(partition_by=keyed.c.stratum, order_by=keyed.c.key), Float) /
+                    cast(func.count().over(partition_by=keyed.c.stratum), Float)).label("position")
+        ranked = select([keyed.c.track_id, keyed.c.key, position]).alias("ranked")
+        return select([ranked.c.track_id]).order_by(ranked.c.position, ranked.c.key, ranked.c.track_id)
+
+    def __insert_batches__(self, batch_id: str, training_count: int, test_count: int, cross_test_count: int,
+                           skip: int, seed: int = None, stratify: str = None) -> bool:
+        """
+        Split the tracks after skip into the observations of a session. The tracks never leave the database: each
+        split is written with a single INSERT ... SELECT. The id of an observation is the session id followed by
+        the track id. Only the tracks without an observation in the session are candidates, so a track added to the
+        database after the session was created never moves the order onto tracks the session already has. Each
+        split is selected after the previous one was inserted, so it starts skip tracks into the remaining order.
+        Returns:
+            bool: False if there are not enough tracks, in which case nothing is inserted
+        """
+        total = training_count + test_count + cross_test_count
+        ordered = self.__ordered_tracks__(seed, stratify, batch_id)
+
+        available = ordered.offset(skip).limit(total).alias("available")
+        if self.__sess__.execute(select([func.count()]).select_from(available)).scalar() < total:
+            return False
+
+        for observation, count in ((obs.TrainingObservation, training_count),
+                                   (obs.TestObservation, test_count),
+                                   (obs.CrossTestObservation, cross_test_count)):
+            if count > 0:
+                tracks = ordered.offset(skip).limit(count).alias("tracks")
+                self.__sess__.execute(observation.__table__.insert().from_select(
+                    ["id", "track_id", "session"],
+                    select([literal(f"{batch_id}:") + tracks.c.track_id, tracks.c.track_id, literal(batch_id)])
+                ))
+        return True
+
+    def create_batches(self, training_count: int, test_count: int, cross_test_count: int, skip: int = 0,
+                       seed: int = None, stratify: str = None) -> str:
         """
         Create a set of batches of the given sizes. Can be used to initialize a batch and the __id__ will be
-        automatically set to the new session id. If the request is unable to be fulfilled, an empty string is returned \
+        automatically set to the new session id. If the request is unable to be fulfilled, a BufferError is raised \
         and the transaction is not committed.
         Args:
             training_count (int): the number of training examples to use
             test_count (int): the number of test examples to use
             cross_test_count (int): the number of cross test examples to use
             skip (int): the number of tracks to skip
+            seed (int): the seed to sample the tracks randomly with. If None, the tracks are taken in order of id
+            stratify (str): either "category" or "genre" to keep the proportions of the labels in every split.
+                Requires a seed
 
         Returns:
             str: the new session id for the batch
         """
-        tracks = self.__sess__.query(music.Track) \
-            .order_by(music.Track.track_id) \
-            .skip(skip) \
-            .limit(training_count + test_count + cross_test_count) \
-            .all()
-
-        if len(tracks) < training_count + test_count + cross_test_count:
-            raise BufferError()
         batch_id = uuid.uuid4().hex
 
-        self.__sess__.add(obs.BatchSessions(id=batch_id,
-                                            count=training_count + test_count + cross_test_count))
-
-        self.__sess__.bulk_save_objects([
-            obs.TrainingObservation(id=uuid.uuid4(
-            ).hex, track_id=tracks[i].track_id, track=tracks[i], session=batch_id)
-            for i in range(0, min(len(tracks), training_count))
-        ])
-
-        self.__sess__.bulk_save_objects([
-            obs.TestObservation(id=uuid.uuid4(
-            ).hex, track_id=tracks[i].track_id, track=tracks[i], session=batch_id)
-            for i in range(training_count, min(len(tracks), training_count + test_count))
-        ])
-
-        self.__sess__.bulk_save_objects([
-            obs.CrossTestObservation(id=uuid.uuid4().hex, track_id=tracks[i].track_id, track=tracks[i],
-                                     session=batch_id)
-            for i in
-            range(training_count + test_count, min(len(tracks),
-                                                   training_count + test_count + cross_test_count))
-        ])
+        if not self.__insert_batches__(batch_id, training_count, test_count, cross_test_count, skip,
+                                       seed, stratify):
+            self.__sess__.rollback()
+            raise BufferError()
 
+        self.__sess__.add(obs.BatchSessions(batch_id=batch_id,
+                                            count=training_count + test_count + cross_test_count,
+                                            seed=seed,
+                                            stratify=stratify))
         self.__sess__.commit()
         return batch_id
 
     def extend_batches(self, batch_id: str, training_count: int, test_count: int, cross_test_count: int,
                        skip: int = 0) -> None:
         """
-        Extend the batches to include more training, tests, and cross tests
+        Extend the batches to include more training, tests, and cross tests. The tracks are taken from the same
+        order as the session was created with, leaving out the tracks the session already has.
         Args:
             batch_id (str): the id of the batch
             training_count (int): the number of training examples to add
             test_count (int): the number of test examples to add
             cross_test_count (int): the number of cross tests examples to add
-            skip (int): the number of tracks to skip
+            skip (int): the number of tracks without an observation in the session to skip
         """
         if batch_id is None:
             raise ValueError("batch_id was not supplied")
         batch: obs.BatchSessions = self.__sess__.query(obs.BatchSessions).filter(
-            obs.BatchSessions == batch_id).one_or_none()
+            obs.BatchSessions.batch_id == batch_id).one_or_none()
 
         if batch is None:
             raise ValueError("batch_id was not created")
 
-        tracks = self.__sess__.query(music.Track) \
-            .order_by(music.Track.track_id) \
-            .skip(batch.count + skip) \
-            .limit(training_count + test_count + cross_test_count) \
-            .all()
-        if len(tracks) < training_count + test_count + cross_test_count:
+        if not self.__insert_batches__(batch_id, training_count, test_count, cross_test_count, skip,
+                                       batch.seed, batch.stratify):
+            self.__sess__.rollback()
             raise BufferError()
 
-        self.__sess__.add(obs.BatchSessions(id=batch_id,
-                                            skip=0,
-                                            count=training_count + test_count + cross_test_count))
-
-        self.__sess__.bulk_save_objects([
-            obs.TrainingObservation(id=uuid.uuid4(
-            ).hex, track_id=tracks[i].track_id, track=tracks[i], session=batch_id)
-            for i in range(0, min(len(tracks), training_count))
-        ])
-
-        self.__sess__.bulk_save_objects([
-            obs.TestObservation(id=uuid.uuid4(
-            ).hex, track_id=tracks[i].track_id, track=tracks[i], session=batch_id)
-            for i in range(training_count, min(len(tracks), training_count + test_count))
-        ])
-
-        self.__sess__.bulk_save_objects([
-            obs.CrossTestObservation(id=uuid.uuid4().hex, track_id=tracks[i].track_id, track=tracks[i],
-                                     session=batch_id)
-            for i in
-            range(training_count + test_count, min(len(tracks),
-                                                   training_count + test_count + cross_test_count))
-        ])
-
         batch.count += training_count + test_count + cross_test_count
         self.__sess__.commit()
+        self.__summaries__.pop(batch_id, None)
 
     def list_sessions(self) -> List[str]:
         """
@@ -244,31 +381,82 @@ class DatabaseBatchManager(BatchManager):
         Returns:
             a list of the available sessions
         """
-        return [sess.id for sess in self.__sess__.query(obs.BatchSessions).all()]
+        return [batch_id for batch_id, in self.__sess__.query(obs.BatchSessions.batch_id).all()]
 
-    def get_session(self, batch_id: str) -> (int, int, int):
+    def get_session_summary(self, batch_id: str) -> SessionSummary:
         """
-        Get the properties of a session
+        Get the counts of every split, the distribution of the labels and the last time a track of the session was
+        trained in a single grouped query. Summaries are cached for summary_ttl seconds so they can be polled.
         Args:
             batch_id (str): the id of the batch
 
         Returns:
-            (int, int, int) -> a tuple of training_count, test_count, and cross_test_count
+            SessionSummary: the summary of the session
         """
-
         if batch_id is None:
             raise ValueError("batch_id was not supplied")
-        batch: obs.BatchSessions = self.__sess__.query(obs.BatchSessions).filter(
-            obs.BatchSessions == batch_id).one_or_none()
 
-        if batch is None:
+        cached = self.__summaries__.get(batch_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        no_label = cast(null(), String)
+        no_date = cast(null(), DateTime)
+        parts = [select([literal("session").label("kind"), no_label.label("label"),
+                         obs.BatchSessions.batch_id.label("track_id"), no_date.label("last_trained")])
+                 .where(obs.BatchSessions.batch_id == batch_id)]
+        for split, observation in (("training", obs.TrainingObservation),
+                                   ("test", obs.TestObservation),
+                                   ("cross_test", obs.CrossTestObservation)):
+            table = observation.__table__
+            tracks = table.join(music.Track.__table__, music.Track.track_id == table.c.track_id)
+            parts.append(select([literal(split), no_label, table.c.track_id, music.Track.last_trained])
+                         .select_from(tracks).where(table.c.session == batch_id))
+            category = table.join(music.TRACK_CATEGORY_ASSOCIATION,
+                                  music.TRACK_CATEGORY_ASSOCIATION.c.track_id == table.c.track_id) \
+                .join(music.Category.__table__, music.Category.cid == music.TRACK_CATEGORY_ASSOCIATION.c.category_id)
+            genre = table.join(music.TRACK_GENRE_ASSOCIATION,
+                               music.TRACK_GENRE_ASSOCIATION.c.track_id == table.c.track_id) \
+                .join(music.Genre.__table__, music.Genre.gid == music.TRACK_GENRE_ASSOCIATION.c.genre_id)
+            for labels, label in ((category, music.Category.category), (genre, music.Genre.genre)):
+                parts.append(select([literal("label"), label, table.c.track_id, no_date])
+                             .select_from(labels).where(table.c.session == batch_id))
+
+        rows = union_all(*parts).alias("summary_rows")
+        grouped = select([rows.c.kind, rows.c.label, func.count(rows.c.track_id), func.max(rows.c.last_trained)]) \
+            .group_by(rows.c.kind, rows.c.label)
+
+        counts = {}
+        labels = {}
+        last_trained = None
+        for row_kind, row_label, count, row_trained in self.__sess__.execute(grouped):
+            if row_kind == "label":
+                labels[row_label] = count
+            else:
+                counts[row_kind] = count
+                if row_trained is not None and (last_trained is None or row_trained > last_trained):
+                    last_trained = row_trained
+
+        if not counts.get("session"):
             raise ValueError("batch_id was not created")
 
-        return (
-            self.__sess__.query(obs.TrainingObservation).filter(
-                obs.TrainingObservation.session == batch_id).count(),
-            self.__sess__.query(obs.TrainingObservation).filter(
-                obs.TestObservation.session == batch_id).count(),
-            self.__sess__.query(obs.CrossTestObservation).filter(
-                obs.CrossTestObservation.session == batch_id).count()
-        )
+        summary = SessionSummary(batch_id,
+                                 counts.get("training", 0),
+                                 counts.get("test", 0),
+                                 counts.get("cross_test", 0),
+                                 labels,
+                                 last_trained)
+        self.__summaries__[batch_id] = (time.monotonic() + self.__summary_ttl__, summary)
+        return summary
+
+    def get_session(self, batch_id: str) -> (int, int, int):
+        """
+        Get the properties of a session
+        Args:
+            batch_id (str): the id of the batch
+
+        Returns:
+            (int, int, int) -> a tuple of training_count, test_count, and cross_test_count
+        """
+        summary = self.get_session_summary(batch_id)
+        return summary.training_count, summary.test_count, summary.cross_test_count
@@ -0,0 +1,24 @@
+"""Declares the progress of crawls so they can be resumed"""
+from sqlalchemy import String, Column, DateTime, Integer
+from recommender.collector import SCHEMA_BASE
+
+
+class CrawlCheckpoint(SCHEMA_BASE):
+    """The progress of crawling a playlist of a category"""
+    __tablename__ = "crawl_checkpoints"
+    category_id = Column(String, primary_key=True)
+    playlist_id = Column(String, primary_key=True)
+
+    # the version of the playlist that was crawled. Spotify changes it whenever the playlist changes
+    snapshot_id = Column(String)
+    # the offset of the first track that was not crawled yet and the number of tracks in the playlist
+    offset = Column(Integer)
+    total = Column(Integer)
+    updated = Column(DateTime)
+
+    @property
+    def complete(self) -> bool:
+        return self.offset >= self.total
+
+    def __str__(self):
+        return f"{self.category_id}/{self.playlist_id}: {self.offset} of {self.total}"
@@ -0,0 +1,75 @@
+"""A module for keeping track of the progress of crawls."""
+from recommender.collector.checkpoint import CrawlCheckpoint
+from sqlalchemy.orm.session import Session
+from typing import Dict, Optional, Tuple
+import datetime
+import logging
+
+
+class CheckpointManager:
+    """
+    The checkpoints of the playlists crawled. Every checkpoint is loaded with one query when first needed.
+    Recorded checkpoints are added to the session without committing, so they are committed together with the
+    tracks saved after them and never claim tracks that were not saved.
+    """
+
+    def __init__(self, sess: Session, logger: logging.Logger) -> None:
+        self.__sess__ = sess
+        self.__logger__ = logger
+        self.__checkpoints__: Dict[Tuple[str, str], CrawlCheckpoint] = None
+
+    def __load__(self) -> Dict[Tuple[str, str], CrawlCheckpoint]:
+        if self.__checkpoints__ is None:
+            self.__checkpoints__ = {(checkpoint.category_id, checkpoint.playlist_id): checkpoint
+                                    for checkpoint in self.__sess__.query(CrawlCheckpoint)}
+            self.__logger__.debug(f"loaded {len(self.__checkpoints__)} checkpoints")
+        return self.__checkpoints__
+
+    def get(self, category_id: str, playlist_id: str) -> Optional[CrawlCheckpoint]:
+        """
+        Get the progress of a playlist.
+        Args:
+            category_id (str): the remote id of the category the playlist was crawled for
+            playlist_id (str): the remote id of the playlist
+
+        Returns:
+            CrawlCheckpoint: the checkpoint or None if the playlist was never crawled
+        """
+        return self.__load__().get((category_id, playlist_id))
+
+    def record(self, category_id: str, playlist_id: str, snapshot_id: str, offset: int, total: int) -> None:
+        """
+        Record the progress of a playlist. The checkpoint is committed with the next commit of the session.
+        Args:
+            category_id (str): the remote id of the category the playlist is crawled for
+            playlist_id (str): the remote id of the playlist
+            snapshot_id (str): the version of the playlist crawled
+            offset (int): the offset of the first track not crawled yet
+            total (int): the number of tracks in the playlist
+        """
+        checkpoints = self.__load__()
+        checkpoint = checkpoints.get((category_id, playlist_id))
+        if checkpoint is None:
+            checkpoint = CrawlCheckpoint(category_id=category_id, playlist_id=playlist_id)
+            checkpoints[(category_id, playlist_id)] = checkpoint
+            self.__sess__.add(checkpoint)
+        checkpoint.snapshot_id = snapshot_id
+        checkpoint.offset = offset
+        checkpoint.total = total
+        checkpoint.updated = datetime.datetime.utcnow()
+
+    def reset(self) -> int:
+        """
+        Remove every checkpoint so the next crawl starts over.
+        Returns:
+            int: the number of checkpoints removed
+        """
+        removed = self.__sess__.query(CrawlCheckpoint).delete()
+        self.__sess__.commit()
+        self.__checkpoints__ = None
+        self.__logger__.info(f"removed {removed} checkpoints")
+        return removed
+
+    def commit(self) -> None:
+        """Commit the checkpoints recorded since the last commit."""
+        self.__sess__.commit()
@@ -1,14 +1,12 @@
 """A module representing a collector of training data."""
-from typing import List, Dict, Tuple, Callable, Any, Union
+from typing import List, Dict, FrozenSet, Set, Tuple, Callable, Any, Union
 from recommender.collector.music import Track, Category
+from recommender.collector.downloader import AsyncDownloader
+from recommender.collector.artist_cache import ArtistGenreCache
 import spotipy
 import spotipy.oauth2
-import urllib.request
-import urllib.response
-import http.client
-import mimetypes
-import os
-import urllib.parse
+import threading
+import logging
 
 
 class Collector:
@@ -28,13 +26,14 @@ class Collector:
         """Get a list of possible genres"""
         pass
 
-    def fetch_tracks(self, categories: List[Category], added: Callable[[str], bool], count: int = 100, skip: int = 0) \
-            -> Dict[str, List[Track]]:
+    def fetch_tracks(self, categories: List[Category], added: Callable[[List[str]], Set[str]], count: int = 100,
+                     skip: int = 0) -> Dict[str, List[Track]]:
         """
         Get a list of tracks with the count of the list specified.
         Args:
             categories (List[str]): the list of category ids used by the remote server
-            added (Callable[[str], bool]): a function to determine whether a track has been added based on its id
+            added (Callable[[List[str]], Set[str]]): a function returning which of the given track ids have been
+                added, such as RelationalDatabase.existing_ids
             count (int): the number of tracks to get per category.
                 Use get current_offset to get the offset as tracked by this collector.
                 It is recommended to cache this result for later use.
@@ -74,6 +73,14 @@ class Collector:
         """
         pass
 
+    def fetch_track_data(self, tracks: List[Track]) -> List[Tuple[Track, bytes]]:
+        """
+        Fetch the audio file track sample from the remote resource into memory.
+        Args:
+            tracks (List[Track]): the list of tracks to download
+        """
+        pass
+
     def get_genre_name(self, gen: str) -> str:
         """"""
         pass
@@ -84,12 +91,15 @@ class SpotifyCollector(Collector):
     A class for populating the track database with tracks from Spotify
     """
 
-    def __init__(self, spotify_id: str, spotify_secret: str) -> None:
+    def __init__(self, spotify_id: str, spotify_secret: str, downloader: AsyncDownloader = None,
+                 artists: ArtistGenreCache = None) -> None:
         """
         Create a SpotifyCollector with the parameters
         Args:
             spotify_id (str): the client id. It is obtained from the Spotify Developer Console
             spotify_secret (str): the client secret. It is obtained from the Spotify Developer Console
+            downloader (AsyncDownloader): the downloader used to fetch the track samples
+            artists (ArtistGenreCache): the cache of the genres of artists. Defaults to a cache kept in memory
         """
         self.credential = spotipy.oauth2.SpotifyClientCredentials(
             client_id=spotify_id,
@@ -100,24 +110,42 @@ class SpotifyCollector(Collector):
         )
         self.__categories__: List[Dict[str, Any]] = []
         self.__genres__: List[str] = []
+        self.__genre_set__: FrozenSet[str] = frozenset()
+        self.__downloader__ = downloader
+        # the stages of the pipeline fetch samples from several threads, which must share a single downloader
+        self.__downloader_lock__ = threading.Lock()
+        self.__artists__ = artists or ArtistGenreCache(logging.getLogger("artists"))
+
+    def __fetch_artists__(self, ids: List[str]) -> List[Dict[str, Any]]:
+        return self.spotify.artists(ids)["artists"]
 
-    def __get_genres__(self, track: Dict[str, Any]) -> List[str]:
+    def __get_genres__(self, track: Dict[str, Any], artists: Dict[str, List[str]] = None) -> List[str]:
+        """
+        Match the genres of the artists of a track to the genre seeds.
+        Args:
+            track (Dict[str, Any]): the playlist item of the track
+            artists (Dict[str, List[str]]): the genres of the artists, as resolved for the whole page. Artists
+                missing from it are resolved through the cache
+
+        Returns:
+            List[str]: the genre seeds of the track
+        """
         if not self.__genres__:
             self.get_genre_list()
-        ids = []
-        for artists in track["track"]["artists"]:
-            ids.append(artists["id"])
+        ids = [artist["id"] for artist in track["track"]["artists"]]
+        if artists is None or not all(artist_id in artists for artist_id in ids):
+            artists = self.__artists__.resolve(ids, self.__fetch_artists__)
         genres: List[str] = []
-        artists = self.spotify.artists(ids)["artists"]
-        for artist in artists:
+        for artist_id in ids:
             genres.extend(
-                set([g for genre in artist["genres"] for g in genre.split()]).intersection(set(self.__genres__)))
+                {g for genre in artists.get(artist_id, []) for g in genre.split()}.intersection(self.__genre_set__))
         return genres
 
     def get_genre_list(self) -> List[str]:
         if self.__genres__:
             return self.__genres__
         self.__genres__ = self.spotify.recommendation_genre_seeds()["genres"]
+        self.__genre_set__ = frozenset(self.__genres__)
         return self.__genres__
 
     def get_genre_name(self, gen: str) -> str:
@@ -161,19 +189,37 @@ class SpotifyCollector(Collector):
         return ""
 
     def fetch_playlist(self, user: str, playlist_id: str, category: str,
-                       added: Callable[[str], bool], skip: int = 0, count: int = 0) \
+                       added: Callable[[List[str]], Set[str]], skip: int = 0, count: int = 0) \
             -> Tuple[List[Track], int]:
+        """
+        Fetch the tracks of a playlist that have not been added yet. The tracks of each page are checked with a
+        single call to added.
+        Args:
+            user (str): the id of the owner of the playlist
+            playlist_id (str): the id of the playlist
+            category (str): the remote id of the category the playlist belongs to
+            added (Callable[[List[str]], Set[str]]): a function returning which of the given track ids have been added
+            skip (int): the number of tracks of the playlist to skip over
+            count (int): the number of tracks to fetch. Use a negative to fetch every track
+
+        Returns:
+            (List[Track], int): the tracks fetched and their number
+        """
         if not playlist_id:
             raise NotImplementedError
         download_count = 0
+        offset = skip
         tracks: List[Track] = []
         while download_count < count or count < 0:
-            more_tracks = self.spotify.user_playlist_tracks(user, playlist_id, limit=min(count - download_count, 50),
-                                                            offset=skip + download_count)
-
-            for track in more_tracks["items"]["tracks"]:
-                if not track["track"]["preview_url"] or added(
-                        track["track"]["id"]):
+            limit = 50 if count < 0 else min(count - download_count, 50)
+            more_tracks = self.spotify.user_playlist_tracks(user, playlist_id, limit=limit, offset=offset)
+
+            items = [item for item in more_tracks["items"] if item.get("track") and item["track"]["preview_url"]]
+            known = added([item["track"]["id"] for item in items])
+            artists = self.__artists__.resolve([artist["id"] for item in items if item["track"]["id"] not in known
+                                                for artist in item["track"]["artists"]], self.__fetch_artists__)
+            for track in items:
+                if track["track"]["id"] in known:
                     continue
                 fetched_track = Track(
                     track_id=track["track"]["id"],
@@ -181,25 +227,25 @@ class SpotifyCollector(Collector):
                     url=track["track"]["preview_url"]
                 )
                 fetched_track.genre_list = self.__get_genres__(
-                    track
+                    track, artists
                 )
                 fetched_track.category_list = [category]
                 tracks.append(fetched_track)
                 download_count = download_count + 1
 
-            if download_count + \
-                    skip == int(more_tracks["count"]) or skip > int(more_tracks["count"]):
+            offset += len(more_tracks["items"])
+            if not more_tracks["items"] or offset >= int(more_tracks["total"]):
                 break
 
         return tracks, download_count
 
-    def fetch_tracks(self, categories: List[Category], added: Callable[[
-                     str], bool], count: int = 100, skip: int = 0) -> Dict[str, List[Track]]:
+    def fetch_tracks(self, categories: List[Category], added: Callable[[List[str]], Set[str]], count: int = 100,
+                     skip: int = 0) -> Dict[str, List[Track]]:
         """
         Fetch tracks from Spotify into a map of ids and tracks
         Args:
             categories (List[Category]): the list of category with both the category internal id and id filled
-            added (Callable[[str], bool]): a test for whether a track is added
+            added (Callable[[List[str]], Set[str]]): a function returning which of the given track ids have been added
             count (int): the number of tracks to get per category.
                 Use get current_offset to get the offset as tracked by this collector.
                 It is recommended to cache this result for later use. Use a negative to indicate to download
@@ -215,49 +261,51 @@ class SpotifyCollector(Collector):
 
         for category in categories:
             playlists = self.spotify.category_playlists(
-                category_id=category.category_id)["playlists"]
+                category_id=category.category_id)["playlists"]["items"]
 
             tracks[category.cid] = []
             downloaded = 0
             for playlist in playlists:
-                downloaded_tracks, count = self.fetch_playlist(playlist["owner"]["id"], playlist["id"], category.category_id,
-                                                               added, skip, count - downloaded)
+                downloaded_tracks, fetched = self.fetch_playlist(playlist["owner"]["id"], playlist["id"],
+                                                                 category.category_id, added, skip,
+                                                                 count - downloaded if count > 0 else count)
                 tracks[category.cid].extend(downloaded_tracks)
-                downloaded += count
-                if downloaded >= count and count > 0:
+                downloaded += fetched
+                if downloaded >= count > 0:
                     break
 
         return tracks
 
+    def __get_downloader__(self) -> AsyncDownloader:
+        """Get the downloader, creating it on first use so collectors that never download do not start one."""
+        with self.__downloader_lock__:
+            if self.__downloader__ is None:
+                self.__downloader__ = AsyncDownloader(logging.getLogger("downloader"))
+            return self.__downloader__
+
     def fetch_track_sample(self, directory: str,
                            tracks: List[Track]) -> List[Tuple[Track, str]]:
         """
-        Download track samples for the tracks
+        Download track samples for the tracks concurrently. Tracks that fail to download are left out.
         Args:
             directory (str): the directory to download to
             tracks (List[Track]): a list of tracks to download
 
         Returns:
-            List[str]: a list of strings representing the files downloaded in the order given
+            List[(Track, str)]: the tracks and the files they were downloaded to in the order given
+        """
+        return self.__get_downloader__().fetch(directory, tracks)
+
+    def fetch_track_data(self, tracks: List[Track]) -> List[Tuple[Track, bytes]]:
+        """
+        Download track samples for the tracks into memory. Tracks that fail to download are left out.
+        Args:
+            tracks (List[Track]): a list of tracks to download
+
+        Returns:
+            List[(Track, bytes)]: the tracks and the content of their samples in the order given
         """
-        samples = []
-        chunk_size = 16 * 1024
-
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        for track in tracks:
-            response = urllib.request.urlopen(track.url.decode("ASCII"))
-            ext = mimetypes.guess_extension(response.getheader("content-type"))
-            file_name = f"{os.path.join(directory,track.track_id)}{ext}"
-            with open(file_name, "wb+") as track_file:
-                chunk = response.read(chunk_size)
-                while chunk:
-                    track_file.write(chunk)
-                    chunk = response.read(chunk_size)
-            samples.append((track, file_name))
-
-        return samples
+        return self.__get_downloader__().fetch_bytes(tracks)
 
     def get_category_offset(self, category: str) -> Dict[str, int]:
         pass
@@ -0,0 +1,366 @@
+"""A module for crawling track metadata from the Spotify Web API concurrently."""
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+from recommender.collector.music import Track, Category
+from recommender.collector.artist_cache import ArtistGenreCache
+from recommender.collector.checkpoint_manager import CheckpointManager
+import urllib.request
+import urllib.error
+import urllib.parse
+import threading
+import logging
+import base64
+import json
+import time
+
+
+class SpotifyError(Exception):
+    """An error status returned by the Spotify Web API."""
+
+    def __init__(self, status: int, url: str):
+        super(SpotifyError, self).__init__(f"{status} returned by {url}")
+        self.status = status
+
+
+class TokenBucket:
+    """
+    A rate limiter shared by every thread sending requests. Tokens are refilled at a constant rate up to a burst
+    capacity and every request takes one. When the server asks to back off, the whole bucket is paused so no thread
+    sends requests until the pause is over.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Create a full bucket.
+        Args:
+            rate (float): the number of tokens refilled per second
+            capacity (float): the maximum number of tokens, which is the largest burst of requests
+        """
+        self.__rate__ = rate
+        self.__capacity__ = capacity
+        self.__tokens__ = capacity
+        self.__updated__ = time.monotonic()
+        self.__paused_until__ = 0.0
+        self.__lock__ = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, blocking until one is available and the bucket is not paused."""
+        while True:
+            with self.__lock__:
+                now = time.monotonic()
+                if now < self.__paused_until__:
+                    delay = self.__paused_until__ - now
+                else:
+                    elapsed = max(now - self.__updated__, 0.0)
+                    self.__tokens__ = min(self.__capacity__, self.__tokens__ + elapsed * self.__rate__)
+                    self.__updated__ = now
+                    if self.__tokens__ >= 1:
+                        self.__tokens__ -= 1
+                        return
+                    delay = (1 - self.__tokens__) / self.__rate__
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop handing out tokens for a number of seconds. The bucket is empty once the pause is over.
+        Args:
+            seconds (float): the number of seconds to pause for
+        """
+        with self.__lock__:
+            self.__paused_until__ = max(self.__paused_until__, time.monotonic() + seconds)
+            self.__tokens__ = 0
+            self.__updated__ = self.__paused_until__
+
+
+class SpotifyApi:
+    """
+    A minimal client of the Spotify Web API authenticated with the client credentials flow. It can be shared by
+    several threads. Every request takes a token from the bucket, responses with status 429 pause the bucket for
+    the time given by Retry-After and server errors are retried with exponential backoff.
+    """
+
+    def __init__(self,
+                 client_id: str,
+                 client_secret: str,
+                 logger: logging.Logger,
+                 bucket: TokenBucket = None,
+                 base_url: str = "https://api.spotify.com/v1",
+                 token_url: str = "https://accounts.spotify.com/api/token",
+                 retries: int = 5,
+                 backoff: float = 0.5,
+                 timeout: float = 10.0) -> None:
+        """
+        Create a client.
+        Args:
+            client_id (str): the client id. It is obtained from the Spotify Developer Console
+            client_secret (str): the client secret. It is obtained from the Spotify Developer Console
+            logger (logging.Logger): the logger to track failed requests
+            bucket (TokenBucket): the rate limiter of the requests. Defaults to 10 requests per second
+            base_url (str): the url of the Web API
+            token_url (str): the url to request access tokens from
+            retries (int): the number of times a failed request is retried
+            backoff (float): the number of seconds to wait before the first retry. It doubles on every retry
+            timeout (float): the number of seconds a single request may take
+        """
+        self.__client_id__ = client_id
+        self.__client_secret__ = client_secret
+        self.__logger__ = logger
+        self.__bucket__ = bucket or TokenBucket(10, 20)
+        self.__base_url__ = base_url.rstrip("/")
+        self.__token_url__ = token_url
+        self.__retries__ = retries
+        self.__backoff__ = backoff
+        self.__timeout__ = timeout
+        self.__token__: str = None
+        self.__expires__ = 0.0
+        self.__token_lock__ = threading.Lock()
+
+    def __access_token__(self) -> str:
+        """Get a valid access token, requesting a new one if it expired."""
+        with self.__token_lock__:
+            if self.__token__ is None or time.monotonic() >= self.__expires__:
+                credentials = base64.b64encode(f"{self.__client_id__}:{self.__client_secret__}".encode("utf-8"))
+                request = urllib.request.Request(
+                    self.__token_url__,
+                    data=urllib.parse.urlencode({"grant_type": "client_credentials"}).encode("ASCII"),
+                    headers={"Authorization": f"Basic {credentials.decode('ASCII')}"})
+                with urllib.request.urlopen(request, timeout=self.__timeout__) as response:
+                    token = json.loads(response.read().decode("utf-8"))
+                self.__token__ = token["access_token"]
+                # renew the token a minute early so it does not expire during a request
+                self.__expires__ = time.monotonic() + max(float(token.get("expires_in", 3600)) - 60, 0)
+            return self.__token__
+
+    def get(self, path: str, **params) -> Dict[str, Any]:
+        """
+        Send a GET request to the Web API.
+        Args:
+            path (str): the path of the endpoint relative to the base url
+            **params: the query parameters
+
+        Returns:
+            Dict[str, Any]: the decoded response
+        """
+        url = f"{self.__base_url__}/{path.lstrip('/')}"
+        if params:
+            url = f"{url}?{urllib.parse.urlencode(params)}"
+
+        for attempt in range(self.__retries__ + 1):
+            self.__bucket__.acquire()
+            request = urllib.request.Request(url, headers={"Authorization": f"Bearer {self.__access_token__()}"})
+            try:
+                with urllib.request.urlopen(request, timeout=self.__timeout__) as response:
+                    return json.loads(response.read().decode("utf-8"))
+            except urllib.error.HTTPError as e:
+                error = e
+                if e.code == 429:
+                    delay = float(e.headers.get("Retry-After", 1))
+                    self.__logger__.warning(f"rate limited for {delay}s by {path}")
+                    self.__bucket__.pause(delay)
+                    continue
+                if e.code == 401:
+                    with self.__token_lock__:
+                        self.__token__ = None
+                    continue
+                if e.code < 500:
+                    raise SpotifyError(e.code, url)
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+            if attempt < self.__retries__:
+                time.sleep(self.__backoff__ * 2 ** attempt)
+        self.__logger__.error(f"failed to get {url} after {self.__retries__ + 1} tries: {error}")
+        raise SpotifyError(getattr(error, "code", 0), url)
+
+    def category_playlists(self, category_id: str, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        return self.get(f"browse/categories/{category_id}/playlists", limit=limit, offset=offset)["playlists"]
+
+    def playlist_tracks(self, playlist_id: str, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+        return self.get(f"playlists/{playlist_id}/tracks", limit=limit, offset=offset)
+
+    def artists(self, ids: List[str]) -> List[Dict[str, Any]]:
+        return self.get("artists", ids=",".join(ids))["artists"]
+
+    def genre_seeds(self) -> List[str]:
+        return self.get("recommendations/available-genre-seeds")["genres"]
+
+
+class PlaylistProgress:
+    """The pages of a playlist crawled so far in a crawl"""
+
+    def __init__(self, snapshot_id: str, start: int) -> None:
+        self.snapshot_id = snapshot_id
+        self.start = start
+        # the offset of the first page that was not crawled and the offsets of the pages crawled after it
+        self.next = start
+        self.done: Set[int] = set()
+
+
+class SpotifyCrawler:
+    """
+    Crawls the tracks of the playlists of categories. The playlists of every category and the pages of every
+    playlist are fetched by a pool of threads, with at most concurrency requests in flight, and the tracks are
+    returned as the pages arrive so they can be saved while the crawl goes on.
+    """
+
+    def __init__(self,
+                 api: SpotifyApi,
+                 logger: logging.Logger,
+                 concurrency: int = 8,
+                 playlist_page_size: int = 50,
+                 track_page_size: int = 100,
+                 artists: ArtistGenreCache = None) -> None:
+        """
+        Create a crawler.
+        Args:
+            api (SpotifyApi): the client of the Web API
+            logger (logging.Logger): the logger to track the crawl
+            concurrency (int): the maximum number of pages fetched at once
+            playlist_page_size (int): the number of playlists per page, at most 50
+            track_page_size (int): the number of tracks per page, at most 100
+            artists (ArtistGenreCache): the cache of the genres of artists. Defaults to a cache kept in memory
+        """
+        self.__api__ = api
+        self.__logger__ = logger
+        self.__concurrency__ = max(concurrency, 1)
+        self.__playlist_page_size__ = playlist_page_size
+        self.__track_page_size__ = track_page_size
+        self.__artists__ = artists or ArtistGenreCache(logger)
+        self.__seeds__: Set[str] = None
+
+    def __playlists_page__(self, category: Category, offset: int) -> Dict[str, Any]:
+        return self.__api__.category_playlists(category.category_id, self.__playlist_page_size__, offset)
+
+    def __tracks_page__(self, playlist_id: str, offset: int) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+        """Fetch a page of a playlist and the genres of the artists on it. Only uncached artists are requested."""
+        page = self.__api__.playlist_tracks(playlist_id, self.__track_page_size__, offset)
+        artist_ids = [artist["id"] for item in page["items"] if item.get("track")
+                      for artist in item["track"]["artists"] if artist.get("id")]
+        return page, self.__artists__.resolve(artist_ids, self.__api__.artists)
+
+    def __genres__(self, item: Dict[str, Any], genres: Dict[str, List[str]]) -> List[str]:
+        """Match the genres of the artists of a track to the genre seeds."""
+        words = {word for artist in item["track"]["artists"]
+                 for genre in genres.get(artist.get("id"), []) for word in genre.split()}
+        return sorted(words & self.__seeds__)
+
+    def crawl(self, categories: List[Category], added: Callable[[List[str]], Set[str]], count: int = -1,
+              skip: int = 0, checkpoints: CheckpointManager = None) -> Iterator[Track]:
+        """
+        Crawl the tracks of the playlists of the categories. Tracks without a preview, tracks already added and
+        tracks already returned by this crawl are left out.
+
+        With checkpoints, the progress of every playlist is recorded once the tracks of its pages were returned.
+        A playlist that was crawled completely is skipped while its snapshot id is unchanged, a playlist crawled
+        in part resumes from its checkpoint and a playlist that changed is crawled again from the start.
+        Args:
+            categories (List[Category]): the categories with their remote id filled
+            added (Callable[[List[str]], Set[str]]): a function returning which of the given track ids have been
+                added, such as RelationalDatabase.existing_ids. It is only called from the thread iterating
+            count (int): the maximum number of tracks to crawl per category. Use a negative to crawl every track
+            skip (int): the number of tracks to skip over at the start of every playlist without a checkpoint
+            checkpoints (CheckpointManager): the checkpoints to resume from and record the progress in. They are
+                only accessed from the thread iterating
+
+        Returns:
+            Iterator[Track]: the tracks crawled with their category_list and genre_list filled
+        """
+        if self.__seeds__ is None:
+            self.__seeds__ = frozenset(self.__api__.genre_seeds())
+
+        crawled = {category.category_id: 0 for category in categories}
+        seen: Set[str] = set()
+        progress: Dict[Tuple[str, str], PlaylistProgress] = {}
+        unchanged = 0
+        jobs = deque(("playlists", category, None, 0) for category in categories)
+        pending: Dict[Future, tuple] = {}
+        pool = ThreadPoolExecutor(max_workers=self.__concurrency__, thread_name_prefix="crawler")
+
+        def full(category: Category) -> bool:
+            return 0 <= count <= crawled[category.category_id]
+
+        try:
+            while jobs or pending:
+                while jobs and len(pending) < self.__concurrency__:
+                    job = jobs.popleft()
+                    kind, category, playlist, offset = job
+                    if full(category):
+                        continue
+                    if kind == "playlists":
+                        pending[pool.submit(self.__playlists_page__, category, offset)] = job
+                    else:
+                        pending[pool.submit(self.__tracks_page__, playlist, offset)] = job
+                if not pending:
+                    continue
+
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, category, playlist, offset = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except SpotifyError as e:
+                        self.__logger__.error(f"skipping {kind} of {playlist or category.category_id}: {e}")
+                        continue
+
+                    if kind == "playlists":
+                        if offset == 0:
+                            for more in range(self.__playlist_page_size__, int(result["total"]),
+                                              self.__playlist_page_size__):
+                                jobs.append(("playlists", category, None, more))
+                        # the pages of playlists are fetched before more playlists are listed
+                        for item in reversed(result["items"]):
+                            if item is None or (category.category_id, item["id"]) in progress:
+                                continue
+                            start = skip
+                            checkpoint = checkpoints.get(category.category_id, item["id"]) if checkpoints else None
+                            if checkpoint is not None and checkpoint.snapshot_id == item.get("snapshot_id"):
+                                if checkpoint.complete:
+                                    unchanged += 1
+                                    continue
+                                start = checkpoint.offset
+                            elif checkpoint is not None:
+                                start = 0
+                            progress[(category.category_id, item["id"])] = PlaylistProgress(item.get("snapshot_id"),
+                                                                                            start)
+                            jobs.appendleft(("tracks", category, item["id"], start))
+                        continue
+
+                    page, genres = result
+                    state = progress[(category.category_id, playlist)]
+                    if offset == state.start:
+                        for more in reversed(range(state.start + self.__track_page_size__, int(page["total"]),
+                                                   self.__track_page_size__)):
+                            jobs.appendleft(("tracks", category, playlist, more))
+                    items = [item for item in page["items"]
+                             if item.get("track") and item["track"].get("id") and item["track"].get("preview_url")
+                             and item["track"]["id"] not in seen]
+                    known = added([item["track"]["id"] for item in items])
+                    truncated = False
+                    for item in items:
+                        track_id = item["track"]["id"]
+                        if track_id in known or track_id in seen:
+                            continue
+                        if full(category):
+                            truncated = True
+                            continue
+                        seen.add(track_id)
+                        crawled[category.category_id] += 1
+                        track = Track(track_id=track_id,
+                                      title=item["track"]["name"],
+                                      url=item["track"]["preview_url"],
+                                      artist=", ".join(artist.get("name") or "" for artist in item["track"]["artists"]))
+                        track.genre_list = self.__genres__(item, genres)
+                        track.category_list = [category.category_id]
+                        yield track
+
+                    if checkpoints is not None and not truncated:
+                        state.done.add(offset)
+                        while state.next in state.done:
+                            state.next += self.__track_page_size__
+                        checkpoints.record(category.category_id, playlist, state.snapshot_id,
+                                           min(state.next, int(page["total"])), int(page["total"]))
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+        self.__logger__.info(f"crawled {len(seen)} tracks, skipped {unchanged} unchanged playlists")
@@ -0,0 +1,254 @@
+"""A module for downloading track samples concurrently over reused connections."""
+from collections import deque
+from typing import Dict, List, Tuple
+from recommender.collector.music import Track
+import email.utils
+import urllib.parse
+import threading
+import mimetypes
+import asyncio
+import logging
+import time
+import ssl
+import os
+
+
+class HttpError(Exception):
+    """An error status returned by the remote server."""
+
+    def __init__(self, status: int, url: str, retry_after: float = None):
+        super(HttpError, self).__init__(f"{status} returned by {url}")
+        self.status = status
+        # the number of seconds the server asked to wait before retrying
+        self.retry_after = retry_after
+
+
+class Response:
+    """The status, headers and body of a response."""
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class AsyncDownloader:
+    """
+    Downloads track samples with an asyncio event loop running in a background thread. Connections are kept
+    alive and pooled per host, so consecutive downloads from the same host reuse them. The downloader can be
+    shared by several threads.
+    """
+
+    def __init__(self,
+                 logger: logging.Logger,
+                 concurrency: int = 16,
+                 connections_per_host: int = 4,
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 timeout: float = 10.0) -> None:
+        """
+        Create a downloader and start its event loop.
+        Args:
+            logger (logging.Logger): the logger to track failed downloads
+            concurrency (int): the maximum number of requests in flight
+            connections_per_host (int): the maximum number of open connections to a single host
+            retries (int): the number of times a failed request is retried
+            backoff (float): the number of seconds to wait before the first retry. It doubles on every retry
+            timeout (float): the number of seconds a single request may take
+        """
+        self.__logger__ = logger
+        self.__concurrency__ = concurrency
+        self.__connections_per_host__ = connections_per_host
+        self.__retries__ = retries
+        self.__backoff__ = backoff
+        self.__timeout__ = timeout
+
+        self.__idle__: Dict[Tuple[str, str, int], deque] = {}
+        self.__host_limits__: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self.__limit__: asyncio.Semaphore = None
+        # creating a context loads the certificates of the system, so it is created once for every connection
+        self.__ssl__ = ssl.create_default_context()
+
+        self.__loop__ = asyncio.new_event_loop()
+        self.__thread__ = threading.Thread(target=self.__loop__.run_forever, name="downloader", daemon=True)
+        self.__thread__.start()
+
+    def fetch(self, directory: str, tracks: List[Track]) -> List[Tuple[Track, str]]:
+        """
+        Download track samples into a directory. Tracks that fail to download after every retry are logged
+        and left out of the result.
+        Args:
+            directory (str): the directory to download to
+            tracks (List[Track]): a list of tracks to download
+
+        Returns:
+            List[(Track, str)]: the tracks and the files they were downloaded to in the order given
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        return asyncio.run_coroutine_threadsafe(self.__fetch_all__(directory, tracks), self.__loop__).result()
+
+    def fetch_bytes(self, tracks: List[Track]) -> List[Tuple[Track, bytes]]:
+        """
+        Download track samples into memory without writing them to disk. Tracks that fail to download after every
+        retry are logged and left out of the result.
+        Args:
+            tracks (List[Track]): a list of tracks to download
+
+        Returns:
+            List[(Track, bytes)]: the tracks and the content of their samples in the order given
+        """
+        return asyncio.run_coroutine_threadsafe(self.__fetch_all_bytes__(tracks), self.__loop__).result()
+
+    async def __fetch_all_bytes__(self, tracks: List[Track]) -> List[Tuple[Track, bytes]]:
+        responses = await asyncio.gather(*[self.__download__(track) for track in tracks])
+        return [(track, response.body) for track, response in zip(tracks, responses) if response is not None]
+
+    async def __fetch_all__(self, directory: str, tracks: List[Track]) -> List[Tuple[Track, str]]:
+        results = await asyncio.gather(*[self.__fetch_track__(directory, track) for track in tracks])
+        return [result for result in results if result is not None]
+
+    async def __fetch_track__(self, directory: str, track: Track) -> Tuple[Track, str]:
+        response = await self.__download__(track)
+        if response is None:
+            return None
+        content_type = response.headers.get("content-type", "").split(";")[0].strip()
+        ext = mimetypes.guess_extension(content_type) or ""
+        file_name = f"{os.path.join(directory, track.track_id)}{ext}"
+        with open(file_name, "wb+") as track_file:
+            track_file.write(response.body)
+        return track, file_name
+
+    async def __download__(self, track: Track) -> Response:
+        """
+        Download the sample of a track with retries. The slot of the request is released while waiting to retry,
+        so the retries of one track do not hold up the others. Returns None if every attempt failed.
+        """
+        url = track.url.decode("ASCII") if isinstance(track.url, bytes) else track.url
+        if self.__limit__ is None:
+            self.__limit__ = asyncio.Semaphore(self.__concurrency__)
+
+        for attempt in range(self.__retries__ + 1):
+            async with self.__limit__:
+                try:
+                    return await asyncio.wait_for(self.__get__(url), self.__timeout__)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpError, ValueError) as e:
+                    error = e
+            if isinstance(error, HttpError) and error.status < 500 and error.status != 429:
+                self.__logger__.error(f"failed to download {track.track_id}: {error}")
+                return None
+            if attempt == self.__retries__:
+                self.__logger__.error(f"failed to download {track.track_id} after {attempt + 1} tries: {error}")
+                return None
+            delay = self.__backoff__ * 2 ** attempt
+            if isinstance(error, HttpError) and error.retry_after is not None:
+                delay = max(delay, error.retry_after)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def __retry_after__(headers: Dict[str, str]) -> float:
+        """Get the seconds to wait from a Retry-After header, given either in seconds or as a date."""
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    async def __get__(self, url: str, redirects: int = 5) -> Response:
+        """Send a GET request over a pooled connection, following redirects."""
+        parsed = urllib.parse.urlsplit(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+
+        if key not in self.__host_limits__:
+            self.__host_limits__[key] = asyncio.Semaphore(self.__connections_per_host__)
+            self.__idle__[key] = deque()
+
+        async with self.__host_limits__[key]:
+            reader, writer = await self.__connect__(key)
+            try:
+                writer.write((f"GET {path} HTTP/1.1\r\n"
+                              f"Host: {parsed.netloc}\r\n"
+                              "Connection: keep-alive\r\n"
+                              "Accept-Encoding: identity\r\n"
+                              "User-Agent: recommender\r\n\r\n").encode("ASCII"))
+                await writer.drain()
+                response, reusable = await self.__read_response__(reader)
+            except BaseException:
+                writer.close()
+                raise
+            if reusable:
+                self.__idle__[key].append((reader, writer))
+            else:
+                writer.close()
+
+        if 300 <= response.status < 400 and "location" in response.headers and redirects > 0:
+            return await self.__get__(urllib.parse.urljoin(url, response.headers["location"]), redirects - 1)
+        if response.status >= 400:
+            raise HttpError(response.status, url, self.__retry_after__(response.headers))
+        return response
+
+    async def __connect__(self, key: Tuple[str, str, int]) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Take an idle connection to the host or open a new one."""
+        idle = self.__idle__[key]
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        scheme, host, port = key
+        return await asyncio.open_connection(host, port, ssl=self.__ssl__ if scheme == "https" else None)
+
+    @staticmethod
+    async def __read_response__(reader: asyncio.StreamReader) -> Tuple[Response, bool]:
+        """Read a response and whether the connection can be reused afterwards."""
+        status_line = await reader.readuntil(b"\r\n")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+        if int(status) in (204, 304) or 100 <= int(status) < 200:
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    # skip the trailers
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            reusable = False
+        return Response(int(status), headers, body), reusable
+
+    def close(self) -> None:
+        """Close the pooled connections and stop the event loop."""
+        async def close_connections():
+            for idle in self.__idle__.values():
+                while idle:
+                    idle.pop()[1].close()
+
+        asyncio.run_coroutine_threadsafe(close_connections(), self.__loop__).result()
+        self.__loop__.call_soon_threadsafe(self.__loop__.stop)
+        self.__thread__.join()
+        self.__loop__.close()
@@ -0,0 +1,163 @@
+"""A module for extracting the features of track samples in parallel."""
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from recommender.collector.feature_cache import FeatureCache
+from recommender.collector.tools import track_features, map_target, fit_features, sample_id, target_indexes, \
+    AudioBuffer
+import multiprocessing
+import numpy as np
+import logging
+import os
+
+# the pool is started from pipeline threads while TensorFlow, the downloader and the database hold locks in other
+# threads. A forked worker could inherit a held lock and deadlock, so the workers are started from a clean process
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def __extract__(file_name: Union[str, AudioBuffer], sample_rate: int, duration: int, n_mfcc: int) -> np.ndarray:
+    """Decode a sample and compute its features. Runs inside a worker process."""
+    return track_features(file_name, sample_rate=sample_rate, duration=duration, n_mfcc=n_mfcc)
+
+
+class FeatureExtractor:
+    """
+    A feature extraction stage backed by a pool of processes. Decoding and computing the MFCC of a sample
+    is CPU bound, so running it in processes keeps every core busy while the model trains.
+    """
+
+    def __init__(self,
+                 mapping: Union[List[str], Dict[str, int]],
+                 logger: logging.Logger,
+                 workers: int = None,
+                 prefetch: int = 2,
+                 cache: FeatureCache = None,
+                 sample_rate: int = 22050,
+                 duration: int = 30,
+                 n_mfcc: int = 32,
+                 frames: int = 2048,
+                 consistent: bool = True,
+                 features: Callable[[Union[str, AudioBuffer], int, int, int], np.ndarray] = __extract__) -> None:
+        """
+        Create an extractor with its own process pool.
+        Args:
+            mapping (Union[List[str], Dict[str, int]]): a mapping of the targets to an index or the indexes of a
+                LabelRegistry
+            logger (logging.Logger): the logger to track the extraction
+            workers (int): the number of processes to use. Defaults to the number of cores
+            prefetch (int): the number of batches to extract ahead of the consumer
+            cache (FeatureCache): a cache of extracted features. It is only accessed by this process
+            sample_rate (int): the sample rate to load the tracks with
+            duration (int): the duration in seconds to load of each track
+            n_mfcc (int): the number of coefficients to extract
+            frames (int): the number of frames of each track. Tracks are cropped or padded to this length
+            consistent (bool): whether the mapping should be sorted prior to mapping
+            features (Callable[[Union[str, AudioBuffer], int, int, int], np.ndarray]): the function computing the
+                features of a sample from the sample, sample rate, duration and number of coefficients. It runs in
+                the worker processes, which do not fork this one, so it must be importable at module level
+        """
+        self.__mapping__ = target_indexes(mapping, consistent)
+        self.__logger__ = logger
+        self.__workers__ = workers or os.cpu_count() or 1
+        self.__prefetch__ = max(prefetch, 1)
+        self.__cache__ = cache
+        self.__sample_rate__ = sample_rate
+        self.__duration__ = duration
+        self.__n_mfcc__ = n_mfcc
+        self.__frames__ = frames
+        self.__features__ = features
+        self.__pool__ = ProcessPoolExecutor(max_workers=self.__workers__,
+                                            mp_context=multiprocessing.get_context(START_METHOD))
+
+    def cached(self, track_id: str) -> bool:
+        """
+        Check whether the features of a track are cached, so its sample does not need to be downloaded.
+        Args:
+            track_id (str): the id of the track
+
+        Returns:
+            bool: True if the features are cached for the parameters of this extractor
+        """
+        return self.__cache__ is not None and self.__cache__.contains(track_id, self.__sample_rate__,
+                                                                      self.__duration__, self.__n_mfcc__)
+
+    def __submit__(self, data: List[Tuple[List[str], Union[str, AudioBuffer]]]) \
+            -> List[Tuple[List[str], Union[str, AudioBuffer], Union[Future, np.ndarray, None]]]:
+        """
+        Start extracting a batch. Cached features are returned directly instead of a future. A buffer without data
+        stands for a track that was not downloaded because its features were cached; if they were evicted since,
+        None is returned for it.
+        """
+        pending = []
+        for targets, file in data:
+            features = None
+            if self.__cache__ is not None:
+                features = self.__cache__.get(sample_id(file), self.__sample_rate__,
+                                              self.__duration__, self.__n_mfcc__)
+            if features is None and not (isinstance(file, AudioBuffer) and file.data is None):
+                features = self.__pool__.submit(self.__features__, file, self.__sample_rate__,
+                                                self.__duration__, self.__n_mfcc__)
+            pending.append((targets, file, features))
+        return pending
+
+    def __collect__(self, pending: List[Tuple[List[str], Union[str, AudioBuffer], Union[Future, np.ndarray, None]]]) \
+            -> (np.ndarray, np.ndarray):
+        """
+        Wait for a batch to be extracted and assemble the input and target arrays. A track that fails to extract,
+        such as a corrupt or truncated sample, is logged and left out of the batch with its target.
+        """
+        track_spectrograms = np.zeros((len(pending), self.__frames__, self.__n_mfcc__), dtype=np.float32)
+        track_targets = np.zeros((len(pending), len(self.__mapping__)), dtype=np.float32)
+        extracted = []
+        for i, (targets, file, features) in enumerate(pending):
+            try:
+                if features is None:
+                    raise LookupError("the features are no longer cached")
+                if isinstance(features, Future):
+                    features = features.result()
+                    if self.__cache__ is not None:
+                        self.__cache__.put(sample_id(file), features, self.__sample_rate__,
+                                           self.__duration__, self.__n_mfcc__)
+                map_target(targets, self.__mapping__, out=track_targets[i])
+                fit_features(features, track_spectrograms[i])
+            except Exception as e:
+                self.__logger__.error(f"failed to extract the features of {sample_id(file)}: {e}")
+                continue
+            extracted.append(i)
+        if len(extracted) < len(pending):
+            return track_spectrograms[extracted], track_targets[extracted]
+        return track_spectrograms, track_targets
+
+    def extract(self, batches: Iterable[List[Tuple[List[str], Union[str, AudioBuffer]]]]) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Extract a stream of batches. At most prefetch batches are extracted ahead of the consumer and the
+        batches are returned in the order given.
+        Args:
+            batches (Iterable[List[Tuple[List[str], Union[str, AudioBuffer]]]]): batches of the targets and the
+                file name or buffer of each track as accepted by create_batch
+
+        Returns:
+            Iterator[(np.ndarray, np.ndarray)]: the input and target arrays of each batch
+        """
+        pending = deque()
+        for data in batches:
+            pending.append(self.__submit__(data))
+            if len(pending) > self.__prefetch__:
+                yield self.__collect__(pending.popleft())
+        while pending:
+            yield self.__collect__(pending.popleft())
+
+    def create_batch(self, data: List[Tuple[List[str], Union[str, AudioBuffer]]]) -> (np.ndarray, np.ndarray):
+        """
+        Extract a single batch, spreading its tracks over the pool. Tracks that fail to extract are left out.
+        Args:
+            data (List[Tuple[List[str], Union[str, AudioBuffer]]]): the targets and file name or buffer of each track
+
+        Returns:
+            (np.ndarray, np.ndarray): the input and target arrays of the batch
+        """
+        return self.__collect__(self.__submit__(data))
+
+    def close(self) -> None:
+        """Shut down the worker processes."""
+        self.__pool__.shutdown(wait=True)
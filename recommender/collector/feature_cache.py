@@ -0,0 +1,149 @@
+"""A module for caching the features extracted from track samples on disk."""
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import threading
+import logging
+import os
+
+
+class FeatureCache:
+    """
+    A persistent store of extracted features with one memory-mapped .npy file per track. Entries are keyed
+    by the track id and the parameters used to extract them, and the least recently used entries are evicted
+    once the store grows past its maximum size.
+    """
+
+    def __init__(self, directory: str, logger: logging.Logger, max_size: int = 1 << 30) -> None:
+        """
+        Create a feature cache in the given directory. Features already in the directory are reused.
+        Args:
+            directory (str): the directory to store the features in
+            logger (logging.Logger): the logger to track evictions
+            max_size (int): the maximum number of bytes to keep on disk
+        """
+        self.__directory__ = directory
+        self.__logger__ = logger
+        self.__max_size__ = max_size
+        self.__lock__ = threading.Lock()
+        self.__entries__: OrderedDict = OrderedDict()
+        self.__size__ = 0
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        files = [entry for entry in os.scandir(directory) if entry.name.endswith(".npy")]
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            size = entry.stat().st_size
+            self.__entries__[entry.name] = size
+            self.__size__ += size
+        self.__evict__()
+
+    @staticmethod
+    def key(track_id: str, sample_rate: int, duration: int, n_mfcc: int) -> str:
+        """
+        Get the name of the file storing the features of a track
+        Args:
+            track_id (str): the id of the track
+            sample_rate (int): the sample rate the track was loaded with
+            duration (int): the duration in seconds the track was loaded with
+            n_mfcc (int): the number of coefficients extracted
+
+        Returns:
+            str: the file name of the entry
+        """
+        return f"{track_id}-{sample_rate}-{duration}-{n_mfcc}.npy"
+
+    def get(self, track_id: str, sample_rate: int = 22050, duration: int = 30,
+            n_mfcc: int = 32) -> Optional[np.ndarray]:
+        """
+        Get the features of a track if they were cached.
+        Args:
+            track_id (str): the id of the track
+            sample_rate (int): the sample rate the track was loaded with
+            duration (int): the duration in seconds the track was loaded with
+            n_mfcc (int): the number of coefficients extracted
+
+        Returns:
+            np.ndarray: a read-only memory-mapped array of shape (frames, channels) or None if it is not cached
+        """
+        name = self.key(track_id, sample_rate, duration, n_mfcc)
+        with self.__lock__:
+            if name not in self.__entries__:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries__.move_to_end(name)
+        path = os.path.join(self.__directory__, name)
+        try:
+            os.utime(path)
+            return np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            with self.__lock__:
+                self.__size__ -= self.__entries__.pop(name, 0)
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def contains(self, track_id: str, sample_rate: int = 22050, duration: int = 30, n_mfcc: int = 32) -> bool:
+        """
+        Check whether the features of a track are cached without reading them or counting a hit or a miss.
+        Args:
+            track_id (str): the id of the track
+            sample_rate (int): the sample rate the track was loaded with
+            duration (int): the duration in seconds the track was loaded with
+            n_mfcc (int): the number of coefficients extracted
+
+        Returns:
+            bool: True if the features are cached
+        """
+        with self.__lock__:
+            return self.key(track_id, sample_rate, duration, n_mfcc) in self.__entries__
+
+    def put(self, track_id: str, features: np.ndarray, sample_rate: int = 22050, duration: int = 30,
+            n_mfcc: int = 32) -> None:
+        """
+        Store the features of a track and evict the least recently used entries if the cache is too large.
+        Args:
+            track_id (str): the id of the track
+            features (np.ndarray): the features of shape (frames, channels)
+            sample_rate (int): the sample rate the track was loaded with
+            duration (int): the duration in seconds the track was loaded with
+            n_mfcc (int): the number of coefficients extracted
+        """
+        name = self.key(track_id, sample_rate, duration, n_mfcc)
+        path = os.path.join(self.__directory__, name)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            np.save(file, np.ascontiguousarray(features, dtype=np.float32))
+        os.replace(temp, path)
+        size = os.path.getsize(path)
+
+        with self.__lock__:
+            self.__size__ += size - self.__entries__.pop(name, 0)
+            self.__entries__[name] = size
+            self.__evict__()
+
+    def __evict__(self) -> None:
+        """Remove the least recently used entries until the cache fits. The lock must be held."""
+        while self.__size__ > self.__max_size__ and self.__entries__:
+            name, size = self.__entries__.popitem(last=False)
+            self.__size__ -= size
+            self.__logger__.debug(f"evicting features: {name}")
+            try:
+                os.remove(os.path.join(self.__directory__, name))
+            except FileNotFoundError:
+                pass
+
+    def size(self) -> int:
+        """
+        Get the number of bytes stored by the cache
+        Returns:
+            int: the number of bytes on disk
+        """
+        return self.__size__
+
+    def __len__(self) -> int:
+        return len(self.__entries__)
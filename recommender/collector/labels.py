@@ -0,0 +1,122 @@
+"""A module for resolving the labels of tracks without querying the database for every label."""
+from recommender.collector.music import Category, Genre
+from sqlalchemy.orm.session import Session
+from typing import Dict, List, Optional
+import threading
+import logging
+
+
+class LabelRegistry:
+    """
+    An in-memory dictionary of every genre and category. The rows are loaded with one query per table the first time
+    a label is resolved, and again after invalidate is called. Labels can be resolved by their remote id or their
+    name. Every label name also has a dense index into the target vectors of the model.
+    """
+
+    def __init__(self, sess: Session, logger: logging.Logger) -> None:
+        """
+        Create a registry reading from the given session.
+        Args:
+            sess (Session): the session to load the labels with
+            logger (logging.Logger): the logger to track reloads
+        """
+        self.__sess__ = sess
+        self.__logger__ = logger
+        self.__lock__ = threading.Lock()
+        self.__loaded__ = False
+        self.__categories__: Dict[str, str] = {}
+        self.__genres__: Dict[str, str] = {}
+        self.__indexes__: Dict[str, int] = {}
+
+    def __load__(self) -> None:
+        """Load every label if the registry was invalidated."""
+        with self.__lock__:
+            if self.__loaded__:
+                return
+            categories = {}
+            names = set()
+            for cid, category_id, category in self.__sess__.query(Category.cid, Category.category_id,
+                                                                  Category.category):
+                categories[category] = cid
+                categories[category_id] = cid
+                names.add(category)
+            genres = {}
+            for gid, genre_id, genre in self.__sess__.query(Genre.gid, Genre.genre_id, Genre.genre):
+                genres[genre] = gid
+                genres[genre_id] = gid
+                names.add(genre)
+            names.discard(None)
+
+            self.__categories__ = categories
+            self.__genres__ = genres
+            self.__indexes__ = {name: index for index, name in enumerate(sorted(names))}
+            self.__loaded__ = True
+            self.__logger__.debug(f"loaded {len(self.__indexes__)} labels")
+
+    def invalidate(self) -> None:
+        """Drop the loaded labels so they are reloaded on the next lookup. Call after labels are added or removed."""
+        with self.__lock__:
+            self.__loaded__ = False
+
+    def category(self, label: str) -> Optional[str]:
+        """
+        Resolve a category.
+        Args:
+            label (str): the remote id or the name of the category
+
+        Returns:
+            str: the internal id of the category or None if there is no such category
+        """
+        self.__load__()
+        return self.__categories__.get(label)
+
+    def genre(self, label: str) -> Optional[str]:
+        """
+        Resolve a genre.
+        Args:
+            label (str): the remote id or the name of the genre
+
+        Returns:
+            str: the internal id of the genre or None if there is no such genre
+        """
+        self.__load__()
+        return self.__genres__.get(label)
+
+    def categories(self) -> Dict[str, str]:
+        """
+        Get the internal id of every category keyed by both its remote id and its name.
+        Returns:
+            Dict[str, str]: the map from the remote ids and names to the internal ids
+        """
+        self.__load__()
+        return self.__categories__
+
+    def genres(self) -> Dict[str, str]:
+        """
+        Get the internal id of every genre keyed by both its remote id and its name.
+        Returns:
+            Dict[str, str]: the map from the remote ids and names to the internal ids
+        """
+        self.__load__()
+        return self.__genres__
+
+    def indexes(self) -> Dict[str, int]:
+        """
+        Get the dense index of every genre and category name. The names are indexed in sorted order, so the
+        indexes match a sorted mapping given to create_batch.
+        Returns:
+            Dict[str, int]: the map from the label names to their index in the target vectors
+        """
+        self.__load__()
+        return self.__indexes__
+
+    def names(self) -> List[str]:
+        """
+        Get the name of every genre and category in the order of their indexes.
+        Returns:
+            List[str]: the sorted label names
+        """
+        return sorted(self.indexes(), key=self.__indexes__.get)
+
+    def __len__(self) -> int:
+        return len(self.indexes())
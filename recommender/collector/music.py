@@ -1,17 +1,45 @@
 """Declares the models of music such as Tracks and Collections"""
-from sqlalchemy import String, Column, Table, ForeignKey, DateTime, Integer
+from sqlalchemy import String, Column, Table, ForeignKey, DateTime, Integer, Index
 from sqlalchemy.orm import relationship
 from recommender.collector import SCHEMA_BASE
 from typing import List
+import zlib
 
+# the modulus of sample keys. It is prime so a split can permute the keys with modular arithmetic
+SAMPLE_KEY_MODULUS = 2147483647
+
+
+def sample_key(track_id: str) -> int:
+    """
+    Compute the stable hash of a track id used to sample tracks in the database.
+    Args:
+        track_id (str): the remote id of the track
+
+    Returns:
+        int: a key in [0, SAMPLE_KEY_MODULUS)
+    """
+    if track_id is None:
+        return None
+    return zlib.crc32(track_id.encode("utf-8")) % SAMPLE_KEY_MODULUS
+
+
+def __default_sample_key__(context) -> int:
+    return sample_key(context.current_parameters.get("track_id"))
+
+# the unique indexes act as the keys of the associations. Unlike a primary key, they can be added to existing tables
 TRACK_CATEGORY_ASSOCIATION = Table("track_category_association", SCHEMA_BASE.metadata,
                                    Column("track_id", String, ForeignKey("tracks.track_id")),
-                                   Column("category_id", String, ForeignKey("categories.cid"))
+                                   Column("category_id", String, ForeignKey("categories.cid")),
+                                   Index("ix_track_category_association_track_category",
+                                         "track_id", "category_id", unique=True),
+                                   Index("ix_track_category_association_category", "category_id")
                                    )
 
 TRACK_GENRE_ASSOCIATION = Table("track_genre_association", SCHEMA_BASE.metadata,
                                 Column("track_id", String, ForeignKey("tracks.track_id")),
-                                Column("genre_id", String, ForeignKey("genres.gid")))
+                                Column("genre_id", String, ForeignKey("genres.gid")),
+                                Index("ix_track_genre_association_track_genre", "track_id", "genre_id", unique=True),
+                                Index("ix_track_genre_association_genre", "genre_id"))
 
 
 class Track(SCHEMA_BASE):
@@ -20,8 +48,10 @@ class Track(SCHEMA_BASE):
     internal_id = Column(String, primary_key=True)
     internal_count = Column(Integer, index=True)
 
-    track_id = Column(String)
-    url = Column(String)
+    track_id = Column(String, unique=True, index=True)
+    # a hash of the track id so the database can draw random samples of tracks
+    sample_key = Column(Integer, default=__default_sample_key__, index=True)
+    url = Column(String, index=True)
     title = Column(String)
     artist = Column(String)
 
@@ -60,8 +90,8 @@ class Category(SCHEMA_BASE):
     """
     The remote id of the category to be used
     """
-    category_id = Column(String)
-    category = Column(String)
+    category_id = Column(String, index=True)
+    category = Column(String, index=True)
     location = Column(String)
     tracks = relationship("Track",
                           secondary=TRACK_CATEGORY_ASSOCIATION,
@@ -73,8 +103,8 @@ class Genre(SCHEMA_BASE):
     __tablename__ = "genres"
     gid = Column(String, primary_key=True)
 
-    genre_id = Column(String)
-    genre = Column(String)
+    genre_id = Column(String, index=True)
+    genre = Column(String, index=True)
     tracks = relationship("Track",
                           secondary=TRACK_GENRE_ASSOCIATION,
                           back_populates="genres")
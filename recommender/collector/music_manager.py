@@ -1,16 +1,26 @@
 """A module for describing how the music tracks are cached and saved."""
-from recommender.collector.music import Track, Category, Genre
+from recommender.collector.music import Track, Category, Genre, sample_key, \
+    TRACK_CATEGORY_ASSOCIATION, TRACK_GENRE_ASSOCIATION
+from recommender.collector.labels import LabelRegistry
 from sqlalchemy.orm.session import Session
-from sqlalchemy import exists, func, and_
-from typing import List
+from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import exists, func, and_, or_, bindparam, select
+from typing import Dict, Iterable, List, Set
+from itertools import islice
 from uuid import uuid4
 import logging
 
+# the most parameters bound to a single statement. Older versions of SQLite refuse statements with more than 999
+MAX_PARAMETERS = 999
+
 
 class Database:
     def save_track(self, track: Track):
         pass
 
+    def save_tracks(self, tracks: Iterable[Track], chunk_size: int = 500) -> int:
+        pass
+
     def remove_track(self, tid: str):
         pass
 
@@ -26,6 +36,9 @@ class Database:
     def exists_track(self, tid: str):
         pass
 
+    def existing_ids(self, ids: Iterable[str]) -> Set[str]:
+        pass
+
     def add_category(self, cid: str, cat: str):
         pass
 
@@ -58,9 +71,12 @@ class Database:
 
 
 class RelationalDatabase(Database):
-    def __init__(self, sess: Session, logger: logging.Logger):
+    def __init__(self, sess: Session, logger: logging.Logger, labels: LabelRegistry = None):
         self.sess = sess
         self.logging = logger
+        self.labels = labels or LabelRegistry(sess, logger)
+        # the ids of every track in the database once warmed. Kept up to date by the tracks saved through this object
+        self.__known_ids__: Set[str] = None
 
     def add_genre(self, gid: str, gen: str):
         """
@@ -70,7 +86,7 @@ class RelationalDatabase(Database):
                 generating a random id is also perfectly valid.
             gen (str): the name of the genre
         """
-        if self.sess.query(exists().where(Genre.genre_id == gid or Genre.genre == gen)).scalar():
+        if self.sess.query(exists().where(or_(Genre.genre_id == gid, Genre.genre == gen))).scalar():
             return
         self.logging.info(f"adding genre: {gen} with id {gid}")
         genre = Genre(gid=uuid4().hex,
@@ -78,6 +94,7 @@ class RelationalDatabase(Database):
                       genre=gen)
         self.sess.add(genre)
         self.sess.commit()
+        self.labels.invalidate()
 
     def remove_genre(self, gid: str):
         """
@@ -88,6 +105,7 @@ class RelationalDatabase(Database):
         self.logging.info(f"removing genre: {gid}")
         self.sess.query(Genre).filter(Genre.genre_id == gid).delete()
         self.sess.commit()
+        self.labels.invalidate()
 
     def fetch_genre(self, gid: str):
         """
@@ -98,8 +116,8 @@ class RelationalDatabase(Database):
         Returns:
             Genre: a genre object
         """
-        self.logging.info(f"fetching genre: {gid}")
-        return self.sess.query(Genre).filter(Genre.gid == gid).one()
+        self.logging.debug(f"fetching genre: {gid}")
+        return self.sess.query(Genre).get(gid)
 
     def get_genre(self, gen: str) -> Genre:
         """
@@ -109,8 +127,11 @@ class RelationalDatabase(Database):
         Returns:
             a genre representing the asked genre.
         """
-        self.logging.log(15, f"getting genre: {gen}")
-        return self.sess.query(Genre).filter(Genre.genre == gen).one()
+        self.logging.debug(f"getting genre: {gen}")
+        gid = self.labels.genre(gen)
+        if gid is None:
+            raise NoResultFound(f"no genre {gen}")
+        return self.sess.query(Genre).get(gid)
 
     def add_category(self, cid: str, cat: str):
         """
@@ -119,30 +140,35 @@ class RelationalDatabase(Database):
             cid: the category id
             cat: the name of the category
         """
-        self.logging.info(f"adding category: {cat} with it {cid}")
-        if self.sess.query(exists().where(Category.category_id == cid or Category.category == cat)).scalar():
+        if self.sess.query(exists().where(or_(Category.category_id == cid, Category.category == cat))).scalar():
             return
-        genre = Genre(cid=uuid4().hex,
-                      categorey_id=cid,
-                      category=cat)
-        self.sess.add(genre)
+        self.logging.info(f"adding category: {cat} with id {cid}")
+        category = Category(cid=uuid4().hex,
+                            category_id=cid,
+                            category=cat)
+        self.sess.add(category)
         self.sess.commit()
+        self.labels.invalidate()
 
     def remove_category(self, cid: str):
         self.logging.info(f"removing category: {cid}")
         self.sess.query(Category).filter(Category.category_id == cid).delete()
         self.sess.commit()
+        self.labels.invalidate()
 
     def fetch_category(self, cid: str):
-        self.logging.info(f"getting category: {cid}")
-        return self.sess.query(Category).filter(Category.cid == cid).one()
+        self.logging.debug(f"fetching category: {cid}")
+        return self.sess.query(Category).get(cid)
 
     def get_category(self, cat: str) -> Category:
-        self.logging.log(15, f"getting category: {cat}")
-        return self.sess.query(Category).filter(Category.category == cat).one()
+        self.logging.debug(f"getting category: {cat}")
+        cid = self.labels.category(cat)
+        if cid is None:
+            raise NoResultFound(f"no category {cat}")
+        return self.sess.query(Category).get(cid)
 
     def get_all_category(self) -> List[Category]:
-        self.logging.info(f"getting all categories")
+        self.logging.debug("getting all categories")
         return self.sess.query(Category).all()
 
     def save_track(self, track: Track):
@@ -169,21 +195,97 @@ class RelationalDatabase(Database):
             self.logging.info(f"added track: {track.title} by {track.artist}")
             if track.category_list is not None:
                 for category in track.category_list:
-                    cat = self.fetch_category(category)
+                    cat = self.fetch_category(self.labels.category(category) or category)
                     track.categories.append(cat)
-                    cat.tracks.append(track)
             if track.genre_list is not None:
                 for genre in track.genre_list:
-                    gen = self.fetch_genre(genre)
+                    gen = self.fetch_genre(self.labels.genre(genre) or genre)
                     track.genres.append(gen)
-                    gen.tracks.append(track)
             track.internal_id = uuid4().hex
             self.sess.add(track)
         self.sess.commit()
+        if self.__known_ids__ is not None and track.track_id is not None:
+            self.__known_ids__.add(track.track_id)
+
+    def save_tracks(self, tracks: Iterable[Track], chunk_size: int = 500) -> int:
+        """
+        Save a stream of tracks in bulk. The labels in category_list and genre_list may be the remote ids or the
+        names of categories and genres already in the database; they are resolved with the label registry. Each
+        chunk of tracks is written with a few multi-row statements and committed on its own, so a crawl can be
+        streamed in without holding it in memory. Tracks that already exist are updated and keep their labels,
+        gaining any new ones.
+        Args:
+            tracks (Iterable[Track]): the tracks to save. They are read but not added to the session
+            chunk_size (int): the number of tracks written per transaction
+
+        Returns:
+            int: the number of tracks saved
+        """
+        categories = self.labels.categories()
+        genres = self.labels.genres()
+
+        saved = 0
+        tracks = iter(tracks)
+        while True:
+            chunk = list(islice(tracks, chunk_size))
+            if not chunk:
+                break
+            saved += self.__save_chunk__(chunk, categories, genres)
+            self.sess.commit()
+            if self.__known_ids__ is not None:
+                self.__known_ids__.update(track.track_id for track in chunk)
+            self.logging.info(f"saved {saved} tracks")
+        return saved
+
+    def __save_chunk__(self, chunk: List[Track], categories: Dict[str, str], genres: Dict[str, str]) -> int:
+        """Upsert a chunk of tracks and their associations without committing."""
+        unique: Dict[str, Track] = {}
+        for track in chunk:
+            unique[track.track_id] = track
+        ids = list(unique.keys())
+
+        existing = self.existing_ids(ids)
+        self.__insert_rows__(Track.__table__, [
+            {"internal_id": uuid4().hex, "track_id": tid, "sample_key": sample_key(tid),
+             "url": track.url, "title": track.title, "artist": track.artist}
+            for tid, track in unique.items() if tid not in existing])
+        if existing:
+            self.sess.execute(Track.__table__.update()
+                              .where(Track.track_id == bindparam("tid"))
+                              .values(url=bindparam("url"), title=bindparam("title"), artist=bindparam("artist")),
+                              [{"tid": tid, "url": unique[tid].url, "title": unique[tid].title,
+                                "artist": unique[tid].artist} for tid in existing])
+
+        for association, column, labels, names in (
+                (TRACK_CATEGORY_ASSOCIATION, "category_id", categories, "category_list"),
+                (TRACK_GENRE_ASSOCIATION, "genre_id", genres, "genre_list")):
+            pairs = set()
+            for tid, track in unique.items():
+                for label in getattr(track, names) or []:
+                    if label in labels:
+                        pairs.add((tid, labels[label]))
+                    else:
+                        self.logging.warning(f"skipping unknown label {label} of track {tid}")
+            if existing:
+                pairs -= set(self.sess.execute(
+                    select([association.c.track_id, association.c[column]])
+                    .where(association.c.track_id.in_(list(existing)))).fetchall())
+            self.__insert_rows__(association, [{"track_id": tid, column: label} for tid, label in sorted(pairs)])
+        return len(unique)
+
+    def __insert_rows__(self, table, rows: List[dict]) -> None:
+        """Insert rows with multi-row statements that each bind at most MAX_PARAMETERS parameters."""
+        if not rows:
+            return
+        per_statement = max(MAX_PARAMETERS // len(rows[0]), 1)
+        for start in range(0, len(rows), per_statement):
+            self.sess.execute(table.insert().values(rows[start:start + per_statement]))
 
     def remove_track(self, tid: str):
         self.logging.info(f"removing track: {tid}")
         self.sess.query(Track).filter(Track.track_id == tid).delete()
+        if self.__known_ids__ is not None:
+            self.__known_ids__.discard(tid)
 
     def update_track(self, tid: str, track: Track):
         self.logging.info(f"update track: {tid}")
@@ -197,8 +299,82 @@ class RelationalDatabase(Database):
         self.logging.info(f"getting track: {tid}")
         return self.sess.query(Track).filter(Track.track_id == tid).one()
 
+    def exists_track(self, tid: str) -> bool:
+        self.logging.debug(f"checking track: {tid}")
+        return tid in self.existing_ids([tid])
+
+    def warm_track_ids(self, chunk_size: int = 100000) -> int:
+        """
+        Load the id of every track into memory so existing_ids no longer queries the database. Only tracks saved
+        through this object are added afterwards, so warm the ids of a database with a single writer.
+        Args:
+            chunk_size (int): the number of ids to fetch per query
+
+        Returns:
+            int: the number of ids loaded
+        """
+        known = set()
+        after = None
+        while True:
+            query = self.sess.query(Track.track_id).filter(Track.track_id.isnot(None))
+            if after is not None:
+                query = query.filter(Track.track_id > after)
+            ids = [tid for tid, in query.order_by(Track.track_id).limit(chunk_size)]
+            if not ids:
+                break
+            known.update(ids)
+            after = ids[-1]
+        self.__known_ids__ = known
+        self.logging.info(f"loaded {len(known)} track ids")
+        return len(known)
+
+    def existing_ids(self, ids: Iterable[str]) -> Set[str]:
+        """
+        Find which of the given tracks are already saved. Once the ids are warmed this is answered from memory,
+        otherwise with a single query per call.
+        Args:
+            ids (Iterable[str]): the remote ids of the tracks to check
+
+        Returns:
+            Set[str]: the ids that are already saved
+        """
+        ids = set(ids)
+        if self.__known_ids__ is not None:
+            return ids & self.__known_ids__
+        existing = set()
+        ordered = sorted(ids)
+        for start in range(0, len(ordered), MAX_PARAMETERS):
+            existing.update(tid for tid, in self.sess.query(Track.track_id)
+                            .filter(Track.track_id.in_(ordered[start:start + MAX_PARAMETERS])))
+        return existing
+
+    def fill_sample_keys(self, chunk_size: int = 10000) -> int:
+        """
+        Compute the sample keys of tracks saved before the keys existed. New tracks get their key when inserted.
+        Args:
+            chunk_size (int): the number of tracks to update per statement
+
+        Returns:
+            int: the number of tracks updated
+        """
+        updated = 0
+        while True:
+            ids = [tid for tid, in self.sess.query(Track.track_id)
+                   .filter(Track.sample_key.is_(None), Track.track_id.isnot(None))
+                   .limit(chunk_size).all()]
+            if not ids:
+                break
+            self.sess.execute(Track.__table__.update()
+                              .where(Track.track_id == bindparam("tid"))
+                              .values(sample_key=bindparam("key")),
+                              [{"tid": tid, "key": sample_key(tid)} for tid in ids])
+            self.sess.commit()
+            updated += len(ids)
+        self.logging.info(f"filled the sample keys of {updated} tracks")
+        return updated
+
     def get_all_genre(self) -> List[Genre]:
-        self.logging.info("getting all genres")
+        self.logging.debug("getting all genres")
         return self.sess.query(Genre).all()
 
     def genre_size(self) -> int:
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Column, ForeignKey, Integer
+from sqlalchemy import String, Column, ForeignKey, Integer, Index
 from sqlalchemy.orm import relationship
 from recommender.collector import SCHEMA_BASE
 
@@ -8,10 +8,12 @@ class TrainingObservation(SCHEMA_BASE):
     An observation for training data with a given session ID.
     """
     __tablename__ = "training_observations"
+    # pages of a session are filtered by session and ordered by id, so they are read straight off this index
+    __table_args__ = (Index("ix_training_observations_session_id", "session", "id"),)
     id = Column(String, primary_key=True)
     session = Column(String)
     track = relationship("Track")
-    track_id = Column(String, ForeignKey("tracks.track_id"))
+    track_id = Column(String, ForeignKey("tracks.track_id"), index=True)
 
 
 class TestObservation(SCHEMA_BASE):
@@ -19,10 +21,11 @@ class TestObservation(SCHEMA_BASE):
     An observation for test data with a given session ID.
     """
     __tablename__ = "test_observations"
+    __table_args__ = (Index("ix_test_observations_session_id", "session", "id"),)
     id = Column(String, primary_key=True)
     session = Column(String)
     track = relationship("Track")
-    track_id = Column(String, ForeignKey("tracks.track_id"))
+    track_id = Column(String, ForeignKey("tracks.track_id"), index=True)
 
 
 class CrossTestObservation(SCHEMA_BASE):
@@ -30,10 +33,11 @@ class CrossTestObservation(SCHEMA_BASE):
     An observation for cross test data with a given session ID.
     """
     __tablename__ = "cross_test_observation"
+    __table_args__ = (Index("ix_cross_test_observation_session_id", "session", "id"),)
     id = Column(String, primary_key=True)
     session = Column(String)
     track = relationship("Track")
-    track_id = Column(String, ForeignKey("tracks.track_id"))
+    track_id = Column(String, ForeignKey("tracks.track_id"), index=True)
 
 
 class BatchSessions(SCHEMA_BASE):
@@ -44,3 +48,6 @@ class BatchSessions(SCHEMA_BASE):
     batch_id = Column(String, primary_key=True)
     # the number of songs from each category
     count = Column(Integer)
+    # the seed and stratification used to split the tracks. A null seed orders the tracks by id
+    seed = Column(Integer)
+    stratify = Column(String)
@@ -0,0 +1,15 @@
+"""Declares the results of the model stored in the database"""
+from sqlalchemy import String, Column, DateTime, Integer, LargeBinary
+from recommender.collector import SCHEMA_BASE
+
+
+class TrackResult(SCHEMA_BASE):
+    """The result of the model for a track, stored as the bytes of a float32 vector"""
+    __tablename__ = "track_results"
+    track_id = Column(String, primary_key=True)
+    width = Column(Integer)
+    result = Column(LargeBinary)
+    updated = Column(DateTime)
+
+    def __str__(self):
+        return f"{self.track_id}: {self.width} values"
@@ -3,7 +3,22 @@ import numpy as np
 import io
 import logging
 import os
-from typing import List, Dict
+import sys
+import glob
+import datetime
+import threading
+from recommender.collector.result import TrackResult
+from sqlalchemy.orm.session import Session
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from typing import BinaryIO, List, Dict, Optional, Tuple
+
+# the most parameters bound by a single statement, the limit of older versions of sqlite
+MAX_PARAMETERS = 999
+# the most parameters the protocols of postgres and mysql can bind to a single statement
+MAX_SERVER_PARAMETERS = 65535
+# the number of results a compaction copies before pointing the index to them. It bounds the memory of a compaction
+# and the time appends wait for it
+COMPACTION_BATCH = 1000
 
 
 class Saver:
@@ -16,87 +31,663 @@ class Saver:
     def condense_file(self):
         pass
 
+    def load_results(self, tids: List[str]) -> np.ndarray:
+        pass
+
+    def track_ids(self) -> List[str]:
+        pass
+
     def close(self):
         pass
 
 
 class FileSaver(Saver):
-    def __init__(self, filename: str, logger: logging.Logger):
+    """
+    Stores the results as lines of text in a log of segments. Results are always appended to the active segment
+    and an index in memory keeps the offset of the latest line of every track, so rewriting a result never rewrites
+    the file. The active segment is sealed once it reaches segment_size. A background thread merges the sealed
+    segments into the file itself once there are max_segments of them or once more than garbage_ratio of their bytes
+    are overwritten lines. Compaction streams the live lines into a new file that atomically replaces the old one,
+    so appends never wait for it. The index is pointed to the copied lines after every COMPACTION_BATCH of them, so a
+    compaction only keeps the offsets of one batch in memory. A compaction that fails points the index back to the
+    sealed segments and removes the new file.
+    """
+
+    def __init__(self, filename: str, logger: logging.Logger, segment_size: int = 1 << 26, max_segments: int = 4,
+                 garbage_ratio: float = 0.5):
+        """
+        Open the results stored in a file and its segments, or create an empty log.
+        Args:
+            filename (str): the compacted file. The segments are stored next to it as filename.1, filename.2, ...
+            logger (logging.Logger): the logger to track the log
+            segment_size (int): the number of bytes after which the active segment is sealed
+            max_segments (int): the number of sealed segments that triggers a compaction
+            garbage_ratio (float): the part of the sealed bytes that may be overwritten lines before a compaction
+        """
         self.__filename__ = filename
         self.__logger__ = logger
+        self.__segment_size__ = segment_size
+        self.__max_segments__ = max_segments
+        self.__garbage_ratio__ = garbage_ratio
+
         dirname = os.path.dirname(filename)
-        if not os.path.exists(filename):
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            self.__f__ = open(filename, "x+")
-        else:
-            self.__f__ = open(filename, "r+")
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.__lock__ = threading.Lock()
+        # the location of the latest line of every track: the segment, the offset and the length of the line
+        self.__index__: Dict[str, Tuple[int, int, int]] = {}
+        # the bytes of every segment and the bytes of the lines of each that are still the latest
+        self.__sizes__: Dict[int, int] = {}
+        self.__live__: Dict[int, int] = {}
+        self.__readers__: Dict[int, BinaryIO] = {}
+        # the compacted file is known by a negative id that changes with every compaction, so readers of a
+        # replaced file keep reading it until the index points to the new one
+        self.__base__ = -1
+        # the file a compaction is writing, until it replaces the compacted file
+        self.__temporary__: Dict[int, str] = {}
+        if os.path.exists(f"{filename}.compact"):
+            # a compaction stopped before replacing the compacted file, which is still complete
+            os.remove(f"{filename}.compact")
+
+        merged = 0
+        if os.path.exists(filename):
+            merged = self.__replay__(self.__base__, filename)
+        segments = []
+        for path in glob.glob(f"{glob.escape(filename)}.*"):
+            suffix = path[len(filename) + 1:]
+            if suffix.isdigit():
+                if int(suffix) <= merged:
+                    # a compaction merged it but stopped before removing it
+                    os.remove(path)
+                else:
+                    segments.append(int(suffix))
+        for segment in sorted(segments):
+            self.__replay__(segment, self.__path__(segment))
+        self.__active__ = max(segments + [merged]) + 1
+        self.__writer__: BinaryIO = None
+
+        self.__condition__ = threading.Condition()
+        self.__requested__ = False
+        self.__running__ = False
+        self.__closed__ = False
+        self.__compactions__ = 0
+        self.__compactor__ = threading.Thread(target=self.__compact_loop__, name="compactor", daemon=True)
+        self.__compactor__.start()
+
+    def __path__(self, segment: int) -> str:
+        if segment in self.__temporary__:
+            return self.__temporary__[segment]
+        return self.__filename__ if segment < 0 else f"{self.__filename__}.{segment}"
+
+    @staticmethod
+    def __key__(line: bytes) -> Optional[str]:
+        tid, separator, _ = line.partition(b":")
+        if not separator or line.startswith(b"#"):
+            return None
+        return tid.decode("utf-8")
+
+    def __replay__(self, segment: int, path: str) -> int:
+        """
+        Index the lines of a segment, replacing the locations of the tracks indexed before.
+        Returns:
+            int: the last segment merged into the file if it is the compacted file, 0 otherwise
+        """
+        merged = 0
+        position = 0
+        self.__sizes__[segment] = 0
+        self.__live__[segment] = 0
+        with open(path, "rb") as file:
+            for line in file:
+                if line.startswith(b"#") and position == 0:
+                    merged = int(line[1:])
+                    self.__live__[segment] += len(line)
+                tid = self.__key__(line)
+                if not line.endswith(b"\n"):
+                    # the last line of a segment is torn when the process stopped while appending it
+                    self.__logger__.warning(f"skipping the incomplete last line of {path}")
+                elif tid is None:
+                    if line.strip() and not line.startswith(b"#"):
+                        self.__logger__.error(f"result file is improperly formatted: {line}")
+                else:
+                    self.__point__(tid, (segment, position, len(line)))
+                position += len(line)
+        self.__sizes__[segment] = position
+        return merged
+
+    def __point__(self, tid: str, location: Tuple[int, int, int]) -> None:
+        """Point a track to a new line, counting the line it pointed to as garbage."""
+        previous = self.__index__.get(tid)
+        if previous is not None:
+            self.__live__[previous[0]] -= previous[2]
+        self.__index__[tid] = location
+        self.__live__[location[0]] += location[2]
+
+    @staticmethod
+    def __line__(tid: str, result: np.ndarray) -> bytes:
+        array = np.array2string(result, max_line_width=sys.maxsize, threshold=sys.maxsize, floatmode="unique")
+        return f"{tid}:{array}\n".encode("utf-8")
 
     def save_results(self, tids: List[str], result: np.ndarray) -> None:
         """
-        Save a result to a file for storage. Highly inefficient.
+        Save the results of tracks, replacing the results already saved for them.
         Args:
-            tids (str): the id of the array
-            result (np.ndarray): the array to be stored
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        self.append_results(tids, result)
+
+    def append_results(self, tids: List[str], result: np.ndarray):
         """
-        m, _ = result.shape
+        Append the results of tracks to the active segment. The results replace any results saved for the tracks.
+        Args:
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        m = result.shape[0]
         assert len(tids) == m
-        self.__f__.seek(0, 0)
+        lines = [self.__line__(tid, row) for tid, row in zip(tids, result.reshape(m, -1))]
+        with self.__lock__:
+            if self.__writer__ is None:
+                self.__writer__ = open(self.__path__(self.__active__), "ab")
+                self.__sizes__[self.__active__] = self.__writer__.tell()
+                self.__live__.setdefault(self.__active__, 0)
+            position = self.__sizes__[self.__active__]
+            self.__writer__.write(b"".join(lines))
+            self.__writer__.flush()
+            for tid, line in zip(tids, lines):
+                self.__point__(tid, (self.__active__, position, len(line)))
+                position += len(line)
+            self.__sizes__[self.__active__] = position
+            if position >= self.__segment_size__:
+                self.__seal__()
+            compact = self.__needs_compaction__()
+        self.__logger__.debug(f"appended {m} results to {self.__path__(self.__active__)}")
+        if compact:
+            self.__request_compaction__()
 
-        arrays = np.split(result, len(tids))
-        d = dict(zip(tids, result))
+    def __seal__(self) -> None:
+        """Seal the active segment so appends go to a new one. Must hold the lock."""
+        if self.__writer__ is not None:
+            self.__writer__.close()
+            self.__writer__ = None
+            self.__active__ += 1
 
-        self.__logger__.info(f"saved {', '.join([i for i in tid])} to file")
+    def __needs_compaction__(self) -> bool:
+        """Must hold the lock."""
+        sealed = [segment for segment in self.__sizes__ if segment != self.__active__]
+        if sum(segment > 0 for segment in sealed) >= self.__max_segments__:
+            return True
+        total = sum(self.__sizes__[segment] for segment in sealed)
+        garbage = total - sum(self.__live__[segment] for segment in sealed)
+        return total >= self.__segment_size__ and garbage > self.__garbage_ratio__ * total
 
-        lines = []
+    def __request_compaction__(self) -> int:
+        """Ask the compactor for a compaction and get the number of compactions to wait for it."""
+        with self.__condition__:
+            target = self.__compactions__ + (2 if self.__running__ else 1)
+            self.__requested__ = True
+            self.__condition__.notify_all()
+            return target
 
-        for line in self.__f__:
-            array = line.split(":")
-            if len(array) != 2:
-                self.__logger__.error(f"result file is improperly formatted: {line}")
-                continue
-            if array[0] in d:
-                arrstr = np.array_str(d[array[0]], max_line_width=1000, precision=24, suppress_small=True)
-                line = f"{array[0]}:{arrstr}\n"
-            lines.append(line)
-        self.__f__.close()
-        os.remove(self.__filename__)
-        self.__f__ = open(self.__filename__, "w+")
-        self.__f__.seek(0, 0)
-        for line in lines:
-            self.__f__.write(line)
-        self.__f__.seek(0, 0)
+    def __compact_loop__(self) -> None:
+        while True:
+            with self.__condition__:
+                while not self.__requested__ and not self.__closed__:
+                    self.__condition__.wait()
+                if not self.__requested__:
+                    return
+                self.__requested__ = False
+                self.__running__ = True
+            try:
+                self.__compact__()
+            except Exception as e:
+                self.__logger__.error(f"failed to compact {self.__filename__}: {e}")
+            with self.__condition__:
+                self.__running__ = False
+                self.__compactions__ += 1
+                self.__condition__.notify_all()
 
-    def append_results(self, tid: List[str], result: np.ndarray):
-        m, _ = result.shape
-        assert len(tid) == m
-        self.__f__.seek(0, io.SEEK_END)
-        arrays = np.split(result, len(tid))
+    def __reader__(self, segment: int) -> BinaryIO:
+        """Must hold the lock."""
+        reader = self.__readers__.get(segment)
+        if reader is None:
+            reader = open(self.__path__(segment), "rb")
+            self.__readers__[segment] = reader
+        return reader
 
-        self.__logger__.info(f"appended {', '.join([i for i in tid])} to file")
+    def __compact__(self) -> None:
+        """
+        Merge the sealed segments and the compacted file into a new compacted file. The new file gets its id before
+        it is written, so the index is pointed to the lines copied after every batch of them.
+        """
+        with self.__lock__:
+            sealed = sorted(segment for segment in self.__sizes__ if segment != self.__active__)
+            if not sealed or sealed == [self.__base__] and self.__live__[self.__base__] == self.__sizes__[sealed[0]]:
+                return
+            if self.__base__ in self.__sizes__:
+                # keep the replaced file readable until the index no longer points to it
+                self.__reader__(self.__base__)
+            merged = max(sealed[-1], 0)
+            header = f"#{merged}\n".encode("utf-8")
+            base = self.__base__ - 1
+            temp = f"{self.__filename__}.compact"
+            self.__temporary__[base] = temp
+            self.__sizes__[base] = len(header)
+            self.__live__[base] = len(header)
+
+        copied = 0
+        try:
+            with open(temp, "wb") as output:
+                output.write(header)
+                offset = len(header)
+                batch: List[Tuple[str, Tuple[int, int, int], int]] = []
+                for segment in sorted(sealed, key=lambda s: (s >= 0, s)):
+                    position = 0
+                    with open(self.__path__(segment), "rb") as file:
+                        for line in file:
+                            tid = self.__key__(line)
+                            location = (segment, position, len(line))
+                            # lines replaced while copying are left behind as garbage of the new file
+                            if tid is not None and self.__index__.get(tid) == location:
+                                output.write(line)
+                                batch.append((tid, location, offset))
+                                offset += len(line)
+                            position += len(line)
+                            if len(batch) >= COMPACTION_BATCH:
+                                copied += self.__repoint__(output, base, batch, offset)
+                                batch = []
+                copied += self.__repoint__(output, base, batch, offset)
+                os.fsync(output.fileno())
+        except Exception:
+            self.__rollback__(base, sealed)
+            raise
 
-        for i in range(0, len(tid)):
-            arrstr = np.array_str(arrays[i], max_line_width=1000, precision=24, suppress_small=True)
-            self.__f__.write(f"{tid[i]}:{arrstr}\n")
-        self.__f__.seek(0, 0)
+        with self.__lock__:
+            os.replace(temp, self.__filename__)
+            del self.__temporary__[base]
+            self.__base__ = base
+            for segment in sealed:
+                reader = self.__readers__.pop(segment, None)
+                if reader is not None:
+                    reader.close()
+                del self.__sizes__[segment]
+                del self.__live__[segment]
+                if segment > 0:
+                    os.remove(self.__path__(segment))
+        self.__logger__.info(f"compacted {len(sealed)} segments into {copied} results")
+
+    def __rollback__(self, base: int, sealed: List[int]) -> None:
+        """
+        Undo a compaction that failed while writing the new file. The tracks already pointed to the new file are
+        pointed back to their latest lines in the sealed segments, which are still complete, and the new file is
+        removed so a later compaction never reads a file it is writing.
+        """
+        with self.__lock__:
+            locations: Dict[str, Tuple[int, int, int]] = {}
+            for segment in sorted(sealed, key=lambda s: (s >= 0, s)):
+                position = 0
+                with open(self.__path__(segment), "rb") as file:
+                    for line in file:
+                        tid = self.__key__(line)
+                        if tid is not None and line.endswith(b"\n") and tid in self.__index__ \
+                                and self.__index__[tid][0] == base:
+                            locations[tid] = (segment, position, len(line))
+                        position += len(line)
+            for tid, location in locations.items():
+                self.__point__(tid, location)
+            reader = self.__readers__.pop(base, None)
+            if reader is not None:
+                reader.close()
+            del self.__sizes__[base]
+            del self.__live__[base]
+            temp = self.__temporary__.pop(base)
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def __repoint__(self, output: BinaryIO, base: int, batch: List[Tuple[str, Tuple[int, int, int], int]],
+                    size: int) -> int:
+        """Point the tracks of a batch of copied lines to the new compacted file, unless they were replaced since."""
+        output.flush()
+        with self.__lock__:
+            self.__sizes__[base] = size
+            for tid, location, position in batch:
+                if self.__index__.get(tid) == location:
+                    self.__point__(tid, (base, position, location[2]))
+        return len(batch)
+
+    def load_results(self, tids: List[str]) -> np.ndarray:
+        """
+        Read the latest results of tracks.
+        Args:
+            tids (List[str]): the ids of the tracks. Every track must be saved
+
+        Returns:
+            np.ndarray: the results with one row per track
+        """
+        lines = []
+        with self.__lock__:
+            for tid in tids:
+                segment, position, length = self.__index__[tid]
+                reader = self.__reader__(segment)
+                reader.seek(position)
+                lines.append(reader.read(length))
+        return np.stack([np.array(line.decode("utf-8").partition(":")[2].replace("[", " ").replace("]", " ")
+                                  .split(), dtype=float) for line in lines])
 
     def condense_file(self):
+        """Seal the active segment and wait for every segment to be merged into the file."""
         self.__logger__.info("condensing result file")
-        lines = {}
-        self.__f__.seek(0, 0)
-        for line in self.__f__:
-            array = line.split(":")
-            if len(array) != 2:
-                self.__logger__.error(f"result file is improperly formatted: {line}")
-                continue
-            lines[array[0]] = array[1]
-        self.__f__.close()
-        os.remove(self.__filename__)
-        self.__f__ = open(self.__filename__, "w+")
-        self.__f__.seek(0, 0)
-        for (key, value) in lines.items():
-            self.__f__.write(f"{key}:{value}")
+        with self.__lock__:
+            self.__seal__()
+        target = self.__request_compaction__()
+        with self.__condition__:
+            while self.__compactions__ < target:
+                self.__condition__.wait()
+
+    def track_ids(self) -> List[str]:
+        """Get the ids of the tracks with saved results."""
+        with self.__lock__:
+            return list(self.__index__)
+
+    def __len__(self) -> int:
+        return len(self.__index__)
 
     def close(self):
-        self.__f__.flush()
-        self.__f__.close()
+        with self.__condition__:
+            self.__closed__ = True
+            self.__condition__.notify_all()
+        self.__compactor__.join()
+        with self.__lock__:
+            if self.__writer__ is not None:
+                self.__writer__.close()
+                self.__writer__ = None
+            for reader in self.__readers__.values():
+                reader.close()
+            self.__readers__ = {}
+
+
+class MemoryMappedSaver(Saver):
+    """
+    Stores the results as fixed-width float32 rows of a memory-mapped file. The id of the track of every row is
+    kept in a sidecar index, whose first line is the width of the rows followed by one id per line in the order of
+    the rows. Results of known tracks are overwritten in place and new tracks are appended, so every write only
+    touches the rows written. The file grows geometrically to keep appends amortized O(1).
+    """
+
+    def __init__(self, filename: str, logger: logging.Logger, width: int = None, capacity: int = 1024):
+        """
+        Open the results stored in a file or create an empty store.
+        Args:
+            filename (str): the file of the rows. The index is stored next to it with the extension .index
+            logger (logging.Logger): the logger to track the store
+            width (int): the length of every result. If None, it is taken from the index or the first write
+            capacity (int): the number of rows to allocate when the file is created
+
+        Raises:
+            ValueError: if the file is not empty but has no index, or stores results of another width
+        """
+        self.__filename__ = filename
+        self.__index_filename__ = f"{filename}.index"
+        self.__logger__ = logger
+        self.__width__ = width
+        self.__capacity__ = 0
+        self.__initial_capacity__ = max(capacity, 1)
+        self.__rows__: Dict[str, int] = {}
+        self.__data__: np.memmap = None
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        if not os.path.exists(self.__index_filename__) and os.path.exists(filename) \
+                and os.path.getsize(filename) > 0:
+            # the rows would be written over the start of the file, which may hold results of another saver
+            raise ValueError(f"{filename} has no index {self.__index_filename__}, so it is not a memory-mapped store")
+
+        if os.path.exists(self.__index_filename__):
+            with open(self.__index_filename__, "r") as index:
+                header = index.readline().strip()
+                if header:
+                    stored = int(header)
+                    if self.__width__ is not None and self.__width__ != stored:
+                        raise ValueError(f"{filename} stores results of width {stored}, not {self.__width__}")
+                    self.__width__ = stored
+                for row, line in enumerate(index):
+                    self.__rows__[line.rstrip("\n")] = row
+        self.__index__ = open(self.__index_filename__, "a")
+
+        if self.__width__ is not None:
+            self.__map__(max(self.__file_rows__(), len(self.__rows__)))
+
+    def __file_rows__(self) -> int:
+        """The number of rows allocated in the file."""
+        if not os.path.exists(self.__filename__) or not self.__width__:
+            return 0
+        return os.path.getsize(self.__filename__) // (self.__width__ * 4)
+
+    def __map__(self, capacity: int) -> None:
+        """Resize the file to hold capacity rows and map it."""
+        capacity = max(capacity, self.__initial_capacity__)
+        if self.__data__ is not None:
+            self.__data__.flush()
+            self.__data__ = None
+        with open(self.__filename__, "ab") as file:
+            file.truncate(capacity * self.__width__ * 4)
+        self.__data__ = np.memmap(self.__filename__, dtype=np.float32, mode="r+",
+                                  shape=(capacity, self.__width__))
+        self.__capacity__ = capacity
+
+    def __store__(self, tids: List[str], result: np.ndarray) -> None:
+        m = result.shape[0]
+        assert len(tids) == m
+        result = result.reshape(m, -1)
+        if self.__width__ is None:
+            self.__width__ = result.shape[1]
+            self.__index__.write(f"{self.__width__}\n")
+            self.__map__(self.__initial_capacity__)
+        if result.shape[1] != self.__width__:
+            raise ValueError(f"expected results of width {self.__width__} but got shape {result.shape}")
+
+        rows = np.empty(m, dtype=np.int64)
+        new = []
+        for i, tid in enumerate(tids):
+            row = self.__rows__.get(tid)
+            if row is None:
+                row = len(self.__rows__)
+                self.__rows__[tid] = row
+                new.append(tid)
+            rows[i] = row
+        if len(self.__rows__) > self.__capacity__:
+            self.__map__(max(self.__capacity__ * 2, len(self.__rows__)))
+
+        self.__data__[rows] = result
+        # the rows are written before their ids, so every id in the index points at a written row
+        if new:
+            self.__data__.flush()
+            self.__index__.write("".join(f"{tid}\n" for tid in new))
+            self.__index__.flush()
+        self.__logger__.debug(f"stored {m} results, {len(new)} new")
+
+    def save_results(self, tids: List[str], result: np.ndarray) -> None:
+        """
+        Store the results of tracks, overwriting the results of tracks already stored.
+        Args:
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        self.__store__(tids, result)
+
+    def append_results(self, tids: List[str], result: np.ndarray):
+        """
+        Store the results of tracks. A track is only stored once, so appending a result for a track that is
+        already stored overwrites it.
+        Args:
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        self.__store__(tids, result)
+
+    def load_results(self, tids: List[str]) -> np.ndarray:
+        """
+        Read the results of tracks.
+        Args:
+            tids (List[str]): the ids of the tracks. Every track must be stored
+
+        Returns:
+            np.ndarray: the results with one row per track
+        """
+        return self.__data__[[self.__rows__[tid] for tid in tids]]
+
+    def row(self, tid: str) -> int:
+        """
+        Get the row of the results of a track.
+        Args:
+            tid (str): the id of the track
+
+        Returns:
+            int: the row in results or None if the track is not stored
+        """
+        return self.__rows__.get(tid)
+
+    def track_ids(self) -> List[str]:
+        """Get the ids of the stored tracks in the order of their rows, so they match the rows of results."""
+        return list(self.__rows__)
+
+    def results(self) -> np.ndarray:
+        """
+        Get every stored result without copying.
+        Returns:
+            np.ndarray: a view of the mapped file with one row per track in the order of their rows. Slices of it
+                are views as well
+        """
+        if self.__data__ is None:
+            return np.zeros((0, self.__width__ or 0), dtype=np.float32)
+        return self.__data__[:len(self.__rows__)]
+
+    def condense_file(self):
+        """Release the space allocated for rows that were not written yet."""
+        if self.__data__ is not None and self.__capacity__ > len(self.__rows__):
+            self.__data__.flush()
+            self.__data__ = None
+            self.__capacity__ = 0
+            with open(self.__filename__, "ab") as file:
+                file.truncate(len(self.__rows__) * self.__width__ * 4)
+            if self.__rows__:
+                self.__map__(len(self.__rows__))
+
+    def __len__(self) -> int:
+        return len(self.__rows__)
+
+    def close(self):
+        if self.__data__ is not None:
+            self.__data__.flush()
+            self.__data__ = None
+        self.__index__.close()
+
+
+class DatabaseSaver(Saver):
+    """
+    Stores the results in the database as the bytes of float32 vectors, one row per track. Every batch of results
+    is written with multi-row upserts and committed at once, so several trainers can write results at the same time
+    without locking a file. Postgres and sqlite replace the rows with INSERT ... ON CONFLICT and mysql with
+    INSERT ... ON DUPLICATE KEY UPDATE. Only sqlite splits a batch to stay under its limit of parameters. Other
+    databases delete the rows of the batch before inserting them in the same transaction, which is not safe for
+    concurrent writers: two trainers inserting the same new track may fail on its key.
+    """
+
+    def __init__(self, sess: Session, logger: logging.Logger):
+        """
+        Create a saver writing to a database.
+        Args:
+            sess (Session): the session of the database. The table of the results is created by initialize_database
+            logger (logging.Logger): the logger to track the results written
+        """
+        self.__sess__ = sess
+        self.__logger__ = logger
+        self.__table__ = TrackResult.__table__
+
+    def __upsert__(self, rows: List[dict], dialect: str):
+        """Build the native multi-row upsert of a dialect, or None if the dialect has none."""
+        if dialect in ("postgresql", "sqlite"):
+            statement = (postgresql if dialect == "postgresql" else sqlite).insert(self.__table__).values(rows)
+            return statement.on_conflict_do_update(
+                index_elements=[self.__table__.c.track_id],
+                set_={"width": statement.excluded.width,
+                      "result": statement.excluded.result,
+                      "updated": statement.excluded.updated})
+        if dialect == "mysql":
+            statement = mysql.insert(self.__table__).values(rows)
+            return statement.on_duplicate_key_update(width=statement.inserted.width,
+                                                     result=statement.inserted.result,
+                                                     updated=statement.inserted.updated)
+        return None
+
+    def __store__(self, tids: List[str], result: np.ndarray) -> None:
+        m = result.shape[0]
+        assert len(tids) == m
+        result = result.reshape(m, -1).astype(np.float32)
+        updated = datetime.datetime.utcnow()
+        # a statement may only touch a row once, so the last result of a track wins
+        rows = list({tid: {"track_id": tid, "width": result.shape[1], "result": row.tobytes(), "updated": updated}
+                     for tid, row in zip(tids, result)}.values())
+        dialect = self.__sess__.bind.dialect.name
+        limit = MAX_PARAMETERS if dialect == "sqlite" else MAX_SERVER_PARAMETERS
+        per_statement = max(limit // len(self.__table__.columns), 1)
+        try:
+            for start in range(0, len(rows), per_statement):
+                chunk = rows[start:start + per_statement]
+                upsert = self.__upsert__(chunk, dialect)
+                if upsert is not None:
+                    self.__sess__.execute(upsert)
+                else:
+                    self.__sess__.execute(self.__table__.delete().where(
+                        self.__table__.c.track_id.in_([row["track_id"] for row in chunk])))
+                    self.__sess__.execute(self.__table__.insert().values(chunk))
+            self.__sess__.commit()
+        except Exception:
+            self.__sess__.rollback()
+            raise
+        self.__logger__.debug(f"stored {len(rows)} results")
+
+    def save_results(self, tids: List[str], result: np.ndarray) -> None:
+        """
+        Store the results of tracks, replacing the results already stored for them.
+        Args:
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        self.__store__(tids, result)
+
+    def append_results(self, tids: List[str], result: np.ndarray):
+        """
+        Store the results of tracks. A track has a single row, so appending a result for a track replaces it.
+        Args:
+            tids (List[str]): the ids of the tracks
+            result (np.ndarray): the results with one row per track
+        """
+        self.__store__(tids, result)
+
+    def load_results(self, tids: List[str]) -> np.ndarray:
+        """
+        Read the results of tracks.
+        Args:
+            tids (List[str]): the ids of the tracks. Every track must be stored
+
+        Returns:
+            np.ndarray: the results with one row per track
+        """
+        stored = {}
+        unique = list(dict.fromkeys(tids))
+        for start in range(0, len(unique), MAX_PARAMETERS):
+            stored.update(self.__sess__.query(TrackResult.track_id, TrackResult.result)
+                          .filter(TrackResult.track_id.in_(unique[start:start + MAX_PARAMETERS])))
+        return np.stack([np.frombuffer(stored[tid], dtype=np.float32) for tid in tids])
+
+    def track_ids(self) -> List[str]:
+        """Get the ids of the tracks with stored results."""
+        return [tid for tid, in self.__sess__.query(TrackResult.track_id).order_by(TrackResult.track_id)]
+
+    def condense_file(self):
+        """Nothing to condense, every track has a single row."""
+        pass
@@ -1,7 +1,36 @@
 """Tools for converting the collected data into useful models"""
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Union
+from recommender.collector.feature_cache import FeatureCache
 import librosa
 import numpy as np
+import io
+import os
+
+
+class AudioBuffer:
+    """
+    A downloaded track sample kept in memory in place of a file. The data is None for a track that was not
+    downloaded because its features were already cached.
+    """
+
+    def __init__(self, track_id: str, data: bytes):
+        self.track_id = track_id
+        self.data = data
+
+
+def sample_id(sample: Union[str, AudioBuffer]) -> str:
+    """
+    Get the track id of a sample. The id of a file is its name without the extension, which is the
+    track id for samples fetched by a Collector.
+    Args:
+        sample (Union[str, AudioBuffer]): the file name or buffer of the sample
+
+    Returns:
+        str: the id of the track
+    """
+    if isinstance(sample, AudioBuffer):
+        return sample.track_id
+    return os.path.splitext(os.path.basename(sample))[0]
 
 
 def mfcc(track: np.array, sr=25200, n_mfcc=32) -> np.ndarray:
@@ -11,67 +40,144 @@ def mfcc(track: np.array, sr=25200, n_mfcc=32) -> np.ndarray:
     return librosa.feature.spectral.mfcc(track, sr=sr, n_mfcc=n_mfcc)
 
 
-def load_track_sample(file_name: str, sample_rate: int = 22050, duration: int = 30) -> (np.array, int):
+def load_track_sample(file_name: Union[str, AudioBuffer], sample_rate: int = 22050,
+                      duration: int = 30) -> (np.array, int):
     """
     Load a track based on a filename into a numpy array of signals.
     Use mfcc to convert the return value into a mel-cepstrum spectrogram.
     Args:
-        file_name (str): the name of the file to load
+        file_name (Union[str, AudioBuffer]): the name of the file to load or a buffer holding the sample
         sample_rate (int): the sample rate of the track
         duration (int): the duration of the track in seconds
 
     Returns:
         np.array: the array of track signals loaded
     """
+    if isinstance(file_name, AudioBuffer):
+        return librosa.load(io.BytesIO(file_name.data), sr=sample_rate, duration=duration)
     return librosa.load(file_name, sr=sample_rate, duration=duration)
 
 
-def map_target(targets: List[str], mapping: Dict[str, int]) -> np.array:
+def track_features(file_name: Union[str, AudioBuffer], sample_rate: int = 22050, duration: int = 30,
+                   n_mfcc: int = 32, cache: FeatureCache = None) -> np.ndarray:
+    """
+    Load a track and convert it into MFCC features. If a cache is given, the features are read from it
+    and only decoded on a miss. The cache is keyed by the id given by sample_id.
+    Args:
+        file_name (Union[str, AudioBuffer]): the name of the file to load or a buffer holding the sample
+        sample_rate (int): the sample rate of the track
+        duration (int): the duration of the track in seconds
+        n_mfcc (int): the number of coefficients to extract
+        cache (FeatureCache): the cache of previously extracted features
+
+    Returns:
+        np.ndarray: the features of shape (frames, channels)
+    """
+    track_id = sample_id(file_name)
+    if cache is not None:
+        features = cache.get(track_id, sample_rate, duration, n_mfcc)
+        if features is not None:
+            return features
+
+    t, sr = load_track_sample(file_name, sample_rate=sample_rate, duration=duration)
+    features = mfcc(t, sr=sr, n_mfcc=n_mfcc).T.astype(np.float32)
+
+    if cache is not None:
+        cache.put(track_id, features, sample_rate, duration, n_mfcc)
+    return features
+
+
+def map_target(targets: List[str], mapping: Dict[str, int], out: np.ndarray = None) -> np.array:
     """
     Convert a list of strings to a sparse np.array based on a mapping
     Args:
         targets: the targets to map
         mapping: the mapping from the targets to the place in the array
+        out (np.ndarray): an array of shape (len(mapping),) to write the targets into
 
     Returns:
         np.array: an array representing the targets as a sparse array to be used
             in the model
     """
-    target = np.zeros((len(mapping)))
+    if out is None:
+        out = np.zeros((len(mapping)), dtype=np.float32)
+    else:
+        out[:] = 0
 
     for value in targets:
-        target[mapping[value]] = 1
+        out[mapping[value]] = 1
+
+    return out
+
 
-    return np.array(target)
+def fit_features(features: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    Write features into a fixed-size array. Tracks longer than the array are cropped to their first frames
+    and shorter tracks are padded with zeros at the end.
+    Args:
+        features (np.ndarray): the features of shape (frames, channels)
+        out (np.ndarray): the array of shape (frames, channels) to write into
+
+    Returns:
+        np.ndarray: the array written to
+    """
+    frames, channels = out.shape
+    if features.ndim != 2 or features.shape[1] != channels:
+        raise ValueError(f"expected features with {channels} channels but got shape {features.shape}")
+    length = min(frames, features.shape[0])
+    out[:length] = features[:length]
+    out[length:] = 0
+    return out
 
 
-def create_batch(data: List[Tuple[List[str], str]], mapping: List[str], consistent=True) -> (
-        np.ndarray, np.ndarray):
+def target_indexes(mapping: Union[List[str], Dict[str, int]], consistent: bool = True) -> Dict[str, int]:
+    """
+    Get the index of every target in the target vectors.
+    Args:
+        mapping (Union[List[str], Dict[str, int]]): the targets or the index of every target, such as the
+            indexes of a LabelRegistry, which are used as they are
+        consistent (bool): whether a list of targets should be sorted prior to mapping
+
+    Returns:
+        Dict[str, int]: the index of every target
+    """
+    if isinstance(mapping, dict):
+        return mapping
+    return {value: key for key, value in enumerate(sorted(mapping) if consistent else mapping)}
+
+
+def create_batch(data: List[Tuple[List[str], Union[str, AudioBuffer]]], mapping: Union[List[str], Dict[str, int]],
+                 consistent=True, cache: FeatureCache = None, frames: int = 2048,
+                 n_mfcc: int = 32) -> (np.ndarray, np.ndarray):
     """
     Convert a list of tuples of lists of strings and a file string to both the input numpy array
     and the target numpy array.
     Args:
         data (List[Tuple[List[str], str]]): a list of tuples of lists of strings denoting the targets and a string
-            denoting the filename. These should already be downloaded and ready to open.
+            denoting the filename. These should already be downloaded and ready to open. An AudioBuffer
+            can be given in place of the filename to decode a sample kept in memory.
             For example:
                 [
                     (["happy", "optimistic", "jovial"], "merry.mp3")
                     (["sad", "unhappy", "pessimistic"], "gloomy.mp3")
                 ]
-        mapping (List[str]): a mapping of the targets to an index
+        mapping (Union[List[str], Dict[str, int]]): a mapping of the targets to an index. The indexes of a
+            LabelRegistry can be given directly
         consistent: a boolean denoting whether the mapping should be sorted prior to mapping
+        cache (FeatureCache): a cache of extracted features so tracks are only decoded once
+        frames (int): the number of frames of each track. Tracks are cropped or padded to this length
+        n_mfcc (int): the number of coefficients of each frame
 
     Returns:
-        (np.ndarray, np.ndarray): a tuple with the first being the ndarray of tracks as mel-cepstrum spectrograms
-            and the second being an ndarray of targets
-    """
-    mapping_ = {value: key
-                for key, value in enumerate(sorted(mapping) if consistent else mapping)}
-    track_spectrograms = []
-    track_targets = []
-    for targets, file in data:
-        track_targets.append(map_target(targets, mapping_))
-        t, sr = load_track_sample(file)
-        track_spectrograms.append(mfcc(t, sr=sr))
-
-    return np.vstack(track_spectrograms), np.vstack(track_targets)
+        (np.ndarray, np.ndarray): a tuple with the first being the float32 ndarray of tracks as mel-cepstrum
+            spectrograms of shape (len(data), frames, n_mfcc) and the second being an ndarray of targets
+            of shape (len(data), len(mapping))
+    """
+    mapping_ = target_indexes(mapping, consistent)
+    track_spectrograms = np.zeros((len(data), frames, n_mfcc), dtype=np.float32)
+    track_targets = np.zeros((len(data), len(mapping_)), dtype=np.float32)
+    for i, (targets, file) in enumerate(data):
+        map_target(targets, mapping_, out=track_targets[i])
+        fit_features(track_features(file, n_mfcc=n_mfcc, cache=cache), track_spectrograms[i])
+
+    return track_spectrograms, track_targets
@@ -1,7 +1,11 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from recommender.collector.music_manager import RelationalDatabase
+from recommender.collector import migrate_database
 from recommender.collector.collector import SpotifyCollector
+from recommender.collector.crawler import SpotifyApi, SpotifyCrawler, TokenBucket
+from recommender.collector.artist_cache import ArtistGenreCache
+from recommender.collector.checkpoint_manager import CheckpointManager
 from sqlalchemy.orm.session import Session
 import configparser
 import logging
@@ -16,13 +20,28 @@ class DownloadConfiguration:
                  spotify_id: str,
                  spotify_secret: str,
                  use_cached: bool = True,
-                 download_all: bool = False) -> None:
+                 download_all: bool = False,
+                 concurrency: int = 8,
+                 requests_per_second: float = 10,
+                 burst: int = 20,
+                 artist_cache_size: int = 100000,
+                 artist_cache_file: str = None,
+                 restart: bool = False) -> None:
         self.count = count
         self.skip = skip
         self.all = download_all
         self.spotify_id = spotify_id
         self.spotify_secret = spotify_secret
         self.use_cached = use_cached
+        # the number of pages crawled at once and the rate limit shared by every request to Spotify
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        # the number of artists whose genres are cached and the file they are kept in between crawls
+        self.artist_cache_size = artist_cache_size
+        self.artist_cache_file = artist_cache_file
+        # forget the checkpoints of previous crawls and crawl every playlist from the start
+        self.restart = restart
 
 
 class DownloadOperator:
@@ -56,10 +75,23 @@ class DownloadOperator:
                 self.logger.info(f"Added genre: {genre}")
                 self.database.add_genre(genre, genre)
         cats = self.database.get_all_category()
-        maps = collector.fetch_tracks(cats, self.database.exists_track, config.count, config.skip, config.all)
-        for cat, tracks in maps:
-            for track in tracks:
-                self.database.save_track(track)
+        self.database.warm_track_ids()
+        api = SpotifyApi(config.spotify_id, config.spotify_secret, logging.getLogger("spotify"),
+                         TokenBucket(config.requests_per_second, config.burst))
+        artists = ArtistGenreCache(logging.getLogger("artists"), config.artist_cache_size, config.artist_cache_file)
+        crawler = SpotifyCrawler(api, logging.getLogger("crawler"), concurrency=config.concurrency, artists=artists)
+        checkpoints = CheckpointManager(self.sess, logging.getLogger("checkpoints"))
+        if config.restart:
+            checkpoints.reset()
+        tracks = crawler.crawl(cats, self.database.existing_ids, -1 if config.all else config.count, config.skip,
+                               checkpoints)
+        try:
+            saved = self.database.save_tracks(tracks)
+            # the checkpoints recorded after the last chunk of tracks
+            checkpoints.commit()
+        finally:
+            artists.save()
+        self.logger.info(f"Saved {saved} tracks.")
 
 
 def download(flags: argparse.Namespace, configuration: configparser.ConfigParser) -> None:
@@ -83,6 +115,25 @@ def download(flags: argparse.Namespace, configuration: configparser.ConfigParser
         configuration.get("spotify", "id"),
         configuration.get("spotify", "secret"),
         configuration.getboolean("download", "use_cached"),
-        download_all=configuration.getboolean("download", "all", fallback=False)
+        download_all=configuration.getboolean("download", "all", fallback=False),
+        concurrency=configuration.getint("download", "concurrency", fallback=8),
+        requests_per_second=configuration.getfloat("download", "requests_per_second", fallback=10),
+        burst=configuration.getint("download", "burst", fallback=20),
+        artist_cache_size=configuration.getint("download", "artist_cache_size", fallback=100000),
+        artist_cache_file=configuration.get("download", "artist_cache_file", fallback="") or None,
+        restart=getattr(flags, "restart", False)
     )
     manager.load_tracks(download_config)
+
+
+def migrate(flags: argparse.Namespace, configuration: configparser.ConfigParser) -> None:
+    driver = configuration.get("rmdb", "engine")
+    host = configuration.get("rmdb", "host")
+    port = configuration.get("rmdb", "port")
+    username = configuration.get("rmdb", "username")
+    password = configuration.get("rmdb", "password")
+    database = configuration.get("rmdb", "database")
+
+    engine = create_engine(f"{driver}://{username}:{password}@{host}:{port}/{database}")
+    created = migrate_database(engine, logging.getLogger("migration"))
+    print(f"Created {len(created)} indexes")
@@ -1,5 +1,5 @@
 """A module for creating training models to train over tracks."""
-from typing import Callable
+from typing import Callable, Iterable, Iterator
 from recommender.learner.tools.tensor_utilities import add_tensors, create_bias, create_weight
 import tensorflow as tf
 import numpy as np
@@ -81,6 +81,10 @@ class LearnerModel:
 
         self.__final_logits__ = None
         self.__final_regularization__ = None
+        self.__loss__ = None
+        self.__optimizer__ = None
+        self.__train_step__ = None
+        self.__prediction__ = None
 
         self.__logger__ = logger
 
@@ -120,38 +124,38 @@ class LearnerModel:
             create_bias([64])
         ])
 
-    def train(self, batch, y):
+    def train(self, batch, y) -> float:
         """
-        Train the model given a batch and a set of y.
+        Train the model given a batch and a set of y. The training operation is compiled once
+        by build_graph so repeated calls do not add nodes to the graph.
         Args:
             batch (np.ndarray): a batch representing the possible input.
                 Should have size [batch_size, frames, channels]
             y (np.ndarray): an representing the target outputs.
                 Should have size [batch_size, categories]
+
+        Returns:
+            float: the loss of the batch computed in the same step as the update
         """
         if not self.__graph_built__:
             self.build_graph()
-        if not self.__use_sigmoid__:
-            error = tf.nn.softmax_cross_entropy_with_logits(
-                labels=self.y, logits=self.__final_logits__
-            )
-        else:
-            error = tf.nn.sigmoid_cross_entropy_with_logits(
-                labels=self.y, logits=self.__final_logits__
-            )
-
-        # Add regularization terms
-        error = error + self.__beta__ * self.__final_regularization__
-
-        cross_entropy = tf.reduce_mean(error)
-        train_step = tf.train.GradientDescentOptimizer(
-            self.__learning_rate__).minimize(cross_entropy)
-        train_step.run(feed_dict={self.input: batch,
-                                  self.y: y}, session=self.sess)
+        _, loss = self.sess.run([self.__train_step__, self.__loss__],
+                                feed_dict={self.input: batch, self.y: y})
+        return loss
 
     def test(self, batch, y) -> float:
-        prediction = self.predict(batch)
-        return tf.nn.l2_loss(batch, y)
+        """
+        Compute the loss of the model over a batch without updating the weights.
+        Args:
+            batch (np.ndarray): a batch of shape [batch_size, frames, channels]
+            y (np.ndarray): the target outputs of shape [batch_size, categories]
+
+        Returns:
+            float: the loss of the batch
+        """
+        if not self.__graph_built__:
+            self.build_graph()
+        return self.sess.run(self.__loss__, feed_dict={self.input: batch, self.y: y})
 
     def load(self, file: str):
         """
@@ -207,8 +211,33 @@ class LearnerModel:
 
         self.__final_regularization__ = tf.nn.l2_loss(final_weight) + add_tensors(
             [tf.nn.l2_loss(w) for w in self.__weights__])
+
+        if not self.__use_sigmoid__:
+            self.__prediction__ = tf.nn.softmax(self.__final_logits__, name="predict_logits_softmax")
+        else:
+            self.__prediction__ = tf.nn.sigmoid(self.__final_logits__, name="predict_logits_sigmoid")
+
+        self.__build_training__()
         self.__graph_built__ = True
 
+    def __build_training__(self) -> None:
+        """Builds the loss and the training operation. Called once by build_graph."""
+        if not self.__use_sigmoid__:
+            error = tf.nn.softmax_cross_entropy_with_logits(
+                labels=self.y, logits=self.__final_logits__
+            )
+        else:
+            error = tf.nn.sigmoid_cross_entropy_with_logits(
+                labels=self.y, logits=self.__final_logits__
+            )
+
+        # Add regularization terms
+        error = error + self.__beta__ * self.__final_regularization__
+
+        self.__loss__ = tf.reduce_mean(error, name="loss")
+        self.__optimizer__ = tf.train.GradientDescentOptimizer(self.__learning_rate__)
+        self.__train_step__ = self.__optimizer__.minimize(self.__loss__)
+
     def initialize(self):
         """Initialize the global variables of the graph"""
         self.sess.run(tf.global_variables_initializer())
@@ -234,16 +263,36 @@ class LearnerModel:
         """
         Predict the result of some observations
         Args:
-            batch (np.array): a tensor of shape (batch_size, 1024)
+            batch (np.array): a tensor of shape (batch_size, frames, channels)
         Returns:
             list: a list representing the predicted results.
         """
-        if not self.__use_sigmoid__:
-            return self.sess.run(tf.nn.softmax(self.__final_logits__, name="predict_logits_softmax"),
-                                 feed_dict={self.input: batch})
-        else:
-            return self.sess.run(tf.nn.sigmoid(self.__final_logits__, name="predict_logits_sigmoid"),
-                                 feed_dict={self.input: batch})
+        if not self.__graph_built__:
+            self.build_graph()
+        return self.sess.run(self.__prediction__, feed_dict={self.input: batch})
+
+    def predict_batches(self, observations: Iterable[np.ndarray], batch_size: int = 128) -> Iterator[np.ndarray]:
+        """
+        Predict the results of a stream of observations by packing them into batches of a fixed size.
+        The last batch is padded with zeros so every run of the graph has the same shape.
+        Args:
+            observations (Iterable[np.ndarray]): observations of shape (frames, channels)
+            batch_size (int): the number of observations to run through the graph at once
+
+        Returns:
+            Iterator[np.ndarray]: the predicted results of shape (categories,) in the order given
+        """
+        buffer = np.zeros((batch_size, self.__frames__, self.__channels__), dtype=np.float32)
+        filled = 0
+        for observation in observations:
+            buffer[filled] = observation
+            filled += 1
+            if filled == batch_size:
+                yield from self.predict(buffer)
+                filled = 0
+        if filled > 0:
+            buffer[filled:] = 0
+            yield from self.predict(buffer)[:filled]
 
     def close(self):
         self.sess.close()
@@ -0,0 +1 @@
+"""Initialization module for finding similar tracks"""
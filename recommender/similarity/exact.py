@@ -0,0 +1,149 @@
+"""A module for finding the exactly most similar tracks by scoring every track."""
+from recommender.similarity.lsh import METRICS
+from typing import Iterable, List, Tuple
+import numpy as np
+import logging
+
+
+class ExactSearch:
+    """
+    Scores queries against every track with blocked matrix products. The catalog is read one block of rows at a
+    time, so the catalog can be a memory-mapped array such as MemoryMappedSaver.results and the memory used is
+    bounded by the queries times the block size. Queries are scored together, keeping the best k tracks of each
+    with argpartition as the blocks go by. It is the ground truth an approximate index is measured against.
+    """
+
+    def __init__(self, ids: List[str], vectors: np.ndarray, logger: logging.Logger, metric: str = "cosine",
+                 block_size: int = 16384, query_block_size: int = 256) -> None:
+        """
+        Create a search over the vectors of tracks. The vectors are not copied.
+        Args:
+            ids (List[str]): the ids of the tracks
+            vectors (np.ndarray): the results of the tracks with one row per track
+            logger (logging.Logger): the logger to track the searches
+            metric (str): either cosine or dot
+            block_size (int): the number of tracks scored at once
+            query_block_size (int): the number of queries scored at once. The scores of a block take
+                4 * query_block_size * block_size bytes and the positions partitioned from them twice that, so the
+                defaults peak at about 50 MB
+        """
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric}, expected one of {', '.join(METRICS)}")
+        assert len(ids) == len(vectors)
+        self.__ids__ = list(ids)
+        self.__rows__ = {tid: row for row, tid in enumerate(self.__ids__)}
+        self.__vectors__ = vectors
+        self.__logger__ = logger
+        self.__metric__ = metric
+        self.__block_size__ = block_size
+        self.__query_block_size__ = query_block_size
+
+    def __block__(self, start: int) -> np.ndarray:
+        block = np.asarray(self.__vectors__[start:start + self.__block_size__], dtype=np.float32)
+        if self.__metric__ == "cosine":
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            block = block / np.where(norms == 0, 1, norms)
+        return block
+
+    def search(self, queries: np.ndarray, k: int = 10, exclude: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the most similar tracks of many vectors.
+        Args:
+            queries (np.ndarray): the vectors to compare to with one row per query
+            k (int): the number of tracks to find per query
+            exclude (np.ndarray): the row of a track to leave out for every query, or -1 to keep every track
+
+        Returns:
+            (np.ndarray, np.ndarray): the rows of the tracks and their scores from the most similar, both of shape
+                (queries, k). Queries with fewer than k tracks are padded with -1 and -inf
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.__vectors__.shape[1])
+        if self.__metric__ == "cosine":
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(norms == 0, 1, norms)
+        if exclude is None:
+            exclude = np.full(len(queries), -1, dtype=np.int64)
+
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for start in range(0, len(self.__ids__), self.__block_size__):
+            block = self.__block__(start)
+            for first in range(0, len(queries), self.__query_block_size__):
+                last = first + self.__query_block_size__
+                block_scores = queries[first:last] @ block.T
+                excluded = exclude[first:last] - start
+                inside = (excluded >= 0) & (excluded < len(block))
+                block_scores[np.nonzero(inside)[0], excluded[inside]] = -np.inf
+                # keep the best k of the block, then the best k of those and the best found so far. The best are
+                # partitioned to the end, so the scores are not negated into a copy of the block, and they are
+                # copied out so the positions of the whole block are freed before the next block is scored
+                if block_scores.shape[1] > k:
+                    top = np.argpartition(block_scores, -k, axis=1)[:, -k:].copy()
+                    block_scores = np.take_along_axis(block_scores, top, axis=1)
+                else:
+                    top = np.broadcast_to(np.arange(block_scores.shape[1]), block_scores.shape)
+                merged_rows = np.concatenate([rows[first:last], top + start], axis=1)
+                merged_scores = np.concatenate([scores[first:last], block_scores], axis=1)
+                best = np.argpartition(merged_scores, -k, axis=1)[:, -k:]
+                rows[first:last] = np.take_along_axis(merged_rows, best, axis=1)
+                scores[first:last] = np.take_along_axis(merged_scores, best, axis=1)
+
+        order = np.argsort(-scores, axis=1, kind="stable")
+        rows = np.take_along_axis(rows, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        rows[np.isneginf(scores)] = -1
+        self.__logger__.debug(f"searched {len(queries)} queries over {len(self.__ids__)} tracks")
+        return rows, scores
+
+    def query_many(self, track_ids: List[str], k: int = 10) -> List[List[Tuple[str, float]]]:
+        """
+        Find the most similar tracks of many tracks at once.
+        Args:
+            track_ids (List[str]): the ids of the tracks
+            k (int): the number of tracks to find per track, leaving out the track itself
+
+        Returns:
+            List[List[Tuple[str, float]]]: for every track, the ids of the similar tracks and their scores from the
+                most similar
+        """
+        queried = np.array([self.__rows__[tid] for tid in track_ids], dtype=np.int64)
+        rows, scores = self.search(self.__vectors__[queried], k, exclude=queried)
+        return [[(self.__ids__[row], float(score)) for row, score in zip(found, found_scores) if row >= 0]
+                for found, found_scores in zip(rows, scores)]
+
+    def query(self, track_id: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Find the most similar tracks of a track.
+        Args:
+            track_id (str): the id of the track
+            k (int): the number of tracks to find, leaving out the track itself
+
+        Returns:
+            List[Tuple[str, float]]: the ids of the tracks and their scores from the most similar
+        """
+        return self.query_many([track_id], k)[0]
+
+    def __len__(self) -> int:
+        return len(self.__ids__)
+
+
+def recall(approximate, exact: ExactSearch, track_ids: Iterable[str], k: int = 10) -> float:
+    """
+    Measure how many of the most similar tracks an approximate index finds.
+    Args:
+        approximate: an index with a query(track_id, k) method, such as LSHIndex
+        exact (ExactSearch): the exact search over the same tracks
+        track_ids (Iterable[str]): the tracks to query
+        k (int): the number of tracks to find per query
+
+    Returns:
+        float: the mean part of the exact k most similar tracks found by the approximate index
+    """
+    track_ids = list(track_ids)
+    found = 0
+    expected = 0
+    for track_id, truth in zip(track_ids, exact.query_many(track_ids, k)):
+        truth = {tid for tid, _ in truth}
+        found += len(truth.intersection(tid for tid, _ in approximate.query(track_id, k)))
+        expected += len(truth)
+    return found / expected if expected else 1.0
@@ -0,0 +1,270 @@
+"""A module for finding tracks whose results are similar with locality sensitive hashing."""
+from typing import BinaryIO, Callable, Dict, List, Tuple
+import numpy as np
+import logging
+import json
+import os
+
+METRICS = ("cosine", "dot")
+
+
+class LSHIndex:
+    """
+    An approximate nearest neighbour index over the result vectors of tracks. Every table hashes a vector to the
+    signs of its projections on random hyperplanes, so vectors pointing in similar directions share codes. The codes
+    of each table are kept sorted, so the tracks of a code are found with a binary search. A query looks up its own
+    code and every code one bit away in every table, then scores only the candidates found exactly.
+    Tracks added after the tables were sorted are kept in a pending list that is scanned until it is merged.
+    """
+
+    def __init__(self, dim: int, logger: logging.Logger, bits: int = 16, tables: int = 8, metric: str = "cosine",
+                 seed: int = None, probes: int = 1) -> None:
+        """
+        Create an empty index.
+        Args:
+            dim (int): the length of the vectors
+            logger (logging.Logger): the logger to track the index
+            bits (int): the number of hyperplanes of every table. More bits make smaller buckets
+            tables (int): the number of tables. More tables find more of the true neighbours
+            metric (str): either cosine or dot, the score the candidates are ranked by
+            seed (int): the seed of the hyperplanes
+            probes (int): 1 to also look up the codes one bit away from the code of the query, 0 to only look up
+                the code itself
+        """
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric}, expected one of {', '.join(METRICS)}")
+        if not 0 < bits < 64:
+            raise ValueError(f"the number of bits must be between 1 and 63, not {bits}")
+        self.__logger__ = logger
+        self.__dim__ = dim
+        self.__bits__ = bits
+        self.__metric__ = metric
+        self.__probes__ = probes
+        self.__planes__ = np.random.RandomState(seed).standard_normal((tables, bits, dim)).astype(np.float32)
+        self.__weights__ = np.left_shift(np.uint64(1), np.arange(bits, dtype=np.uint64))
+        self.__clear__()
+
+    def __clear__(self) -> None:
+        self.__ids__: List[str] = []
+        self.__rows__: Dict[str, int] = {}
+        self.__vectors__ = np.zeros((0, self.__dim__), dtype=np.float32)
+        self.__codes__ = np.zeros((len(self.__planes__), 0), dtype=np.uint64)
+        # the codes of the first __merged__ rows sorted per table and the rows in that order
+        self.__sorted__ = np.zeros((len(self.__planes__), 0), dtype=np.uint64)
+        self.__order__ = np.zeros((len(self.__planes__), 0), dtype=np.int64)
+        self.__merged__ = 0
+        # rows of the merged part whose vectors were replaced since the merge
+        self.__updated__: List[int] = []
+
+    def __prepare__(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.__dim__)
+        if self.__metric__ == "cosine":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def __encode__(self, vectors: np.ndarray) -> np.ndarray:
+        """Get the codes of the vectors in every table as an array of shape (tables, vectors)."""
+        signs = np.einsum("tbd,nd->tnb", self.__planes__, vectors) > 0
+        return (signs.astype(np.uint64) * self.__weights__).sum(axis=2, dtype=np.uint64)
+
+    def __reserve__(self, rows: int) -> None:
+        """Grow the arrays geometrically to hold rows vectors."""
+        capacity = len(self.__vectors__)
+        if rows <= capacity and self.__vectors__.flags.writeable:
+            return
+        capacity = max(rows, 2 * capacity, 1024)
+        vectors = np.zeros((capacity, self.__dim__), dtype=np.float32)
+        vectors[:len(self.__ids__)] = self.__vectors__[:len(self.__ids__)]
+        codes = np.zeros((len(self.__planes__), capacity), dtype=np.uint64)
+        codes[:, :len(self.__ids__)] = self.__codes__[:, :len(self.__ids__)]
+        self.__vectors__ = vectors
+        self.__codes__ = codes
+
+    def build(self, ids: List[str], vectors: np.ndarray) -> None:
+        """
+        Replace the content of the index with the vectors of tracks.
+        Args:
+            ids (List[str]): the ids of the tracks
+            vectors (np.ndarray): the results of the tracks with one row per track, such as Saver.load_results or
+                MemoryMappedSaver.results
+        """
+        self.__clear__()
+        self.add(ids, vectors)
+        self.merge()
+
+    def add(self, ids: List[str], vectors: np.ndarray) -> None:
+        """
+        Add the vectors of tracks, replacing the vectors of tracks already indexed.
+        Args:
+            ids (List[str]): the ids of the tracks
+            vectors (np.ndarray): the results of the tracks with one row per track
+        """
+        vectors = self.__prepare__(vectors)
+        assert len(ids) == len(vectors)
+        self.__reserve__(len(self.__ids__) + len(ids))
+        rows = np.empty(len(ids), dtype=np.int64)
+        for i, tid in enumerate(ids):
+            row = self.__rows__.get(tid)
+            if row is None:
+                row = len(self.__ids__)
+                self.__rows__[tid] = row
+                self.__ids__.append(tid)
+            elif row < self.__merged__:
+                self.__updated__.append(row)
+            rows[i] = row
+        # the hash of a chunk is (tables, chunk, bits) booleans, so large additions are hashed in parts
+        for start in range(0, len(ids), 65536):
+            part = rows[start:start + 65536]
+            self.__vectors__[part] = vectors[start:start + 65536]
+            self.__codes__[:, part] = self.__encode__(vectors[start:start + 65536])
+        if self.__pending__() > max(1024, self.__merged__ // 8):
+            self.merge()
+        self.__logger__.debug(f"added {len(ids)} vectors, {len(self.__ids__)} indexed")
+
+    def __pending__(self) -> int:
+        return len(self.__ids__) - self.__merged__ + len(self.__updated__)
+
+    def merge(self) -> None:
+        """Sort the codes of every track, so no track is looked up by a scan."""
+        n = len(self.__ids__)
+        codes = self.__codes__[:, :n]
+        self.__order__ = np.argsort(codes, axis=1, kind="stable")
+        self.__sorted__ = np.take_along_axis(codes, self.__order__, axis=1)
+        self.__merged__ = n
+        self.__updated__ = []
+
+    def __candidates__(self, codes: np.ndarray) -> np.ndarray:
+        """Get the rows of the buckets of the codes of a query and of the codes one bit away."""
+        probes = codes[:, None]
+        if self.__probes__:
+            flips = np.concatenate([[np.uint64(0)], self.__weights__])
+            probes = np.bitwise_xor(probes, flips[None, :])
+        found = []
+        for table in range(len(probes)):
+            left = np.searchsorted(self.__sorted__[table], probes[table], side="left")
+            right = np.searchsorted(self.__sorted__[table], probes[table], side="right")
+            found.extend(self.__order__[table, start:end] for start, end in zip(left, right) if end > start)
+        pending = np.concatenate([np.arange(self.__merged__, len(self.__ids__)),
+                                  np.asarray(self.__updated__, dtype=np.int64)])
+        if len(pending):
+            for table in range(len(probes)):
+                found.append(pending[np.isin(self.__codes__[table, pending], probes[table])])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def query_vector(self, vector: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Find the tracks most similar to a vector.
+        Args:
+            vector (np.ndarray): the vector to compare to
+            k (int): the number of tracks to find
+
+        Returns:
+            List[Tuple[str, float]]: the ids of the tracks and their scores from the most similar
+        """
+        vector = self.__prepare__(vector)
+        rows = self.__candidates__(self.__encode__(vector)[:, 0])
+        if not len(rows):
+            return []
+        scores = self.__vectors__[rows] @ vector[0]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k)[:k]
+            rows, scores = rows[top], scores[top]
+        best = np.argsort(-scores, kind="stable")
+        return [(self.__ids__[rows[i]], float(scores[i])) for i in best]
+
+    def query(self, track_id: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Find the tracks most similar to an indexed track.
+        Args:
+            track_id (str): the id of the track
+            k (int): the number of tracks to find, leaving out the track itself
+
+        Returns:
+            List[Tuple[str, float]]: the ids of the tracks and their scores from the most similar
+        """
+        row = self.__rows__[track_id]
+        similar = self.query_vector(self.__vectors__[row], k + 1)
+        return [(tid, score) for tid, score in similar if tid != track_id][:k]
+
+    def vector(self, track_id: str) -> np.ndarray:
+        """Get the indexed vector of a track, normalized if the metric is cosine."""
+        return self.__vectors__[self.__rows__[track_id]]
+
+    def track_ids(self) -> List[str]:
+        """Get the ids of the indexed tracks in the order they were added."""
+        return list(self.__ids__)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self.__rows__
+
+    def __len__(self) -> int:
+        return len(self.__ids__)
+
+    def save(self, directory: str) -> None:
+        """
+        Write the index to a directory, merging the pending tracks first. The arrays are stored as .npy files and
+        the ids as a file with one id per line in the order of the rows.
+        Args:
+            directory (str): the directory to write to. Files of an index saved there before are replaced
+        """
+        if self.__pending__():
+            self.merge()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        n = len(self.__ids__)
+        # every file is written next to the one it replaces, as the arrays may be mapped from the files of this
+        # directory. The mapped files stay readable once replaced
+        for name, array in (("planes", self.__planes__), ("vectors", self.__vectors__[:n]),
+                            ("codes", self.__codes__[:, :n]), ("sorted", self.__sorted__),
+                            ("order", self.__order__)):
+            self.__replace__(os.path.join(directory, f"{name}.npy"), lambda file: np.save(file, array))
+        self.__replace__(os.path.join(directory, "ids.txt"),
+                         lambda file: file.write("".join(f"{tid}\n" for tid in self.__ids__).encode("utf-8")))
+        config = {"dim": self.__dim__, "bits": self.__bits__, "tables": len(self.__planes__),
+                  "metric": self.__metric__, "probes": self.__probes__}
+        self.__replace__(os.path.join(directory, "index.json"),
+                         lambda file: file.write(json.dumps(config).encode("utf-8")))
+        self.__logger__.info(f"saved {n} vectors to {directory}")
+
+    @staticmethod
+    def __replace__(path: str, write: Callable[[BinaryIO], None]) -> None:
+        """Write a file to a temporary name and move it over the path."""
+        temp = f"{path}.tmp"
+        with open(temp, "wb") as file:
+            write(file)
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, directory: str, logger: logging.Logger, mmap: bool = True) -> "LSHIndex":
+        """
+        Read an index written by save.
+        Args:
+            directory (str): the directory the index was saved to
+            logger (logging.Logger): the logger to track the index
+            mmap (bool): map the arrays read-only instead of reading them, so only the pages queried are loaded.
+                The arrays are copied into memory when tracks are added
+
+        Returns:
+            LSHIndex: the index
+        """
+        with open(os.path.join(directory, "index.json"), "r") as file:
+            config = json.load(file)
+        index = cls(config["dim"], logger, bits=config["bits"], tables=config["tables"], metric=config["metric"],
+                    probes=config["probes"])
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+                  for name in ("planes", "vectors", "codes", "sorted", "order")}
+        with open(os.path.join(directory, "ids.txt"), "r") as file:
+            index.__ids__ = [line.rstrip("\n") for line in file]
+        index.__rows__ = {tid: row for row, tid in enumerate(index.__ids__)}
+        index.__planes__ = np.array(arrays["planes"])
+        index.__vectors__ = arrays["vectors"]
+        index.__codes__ = arrays["codes"]
+        index.__sorted__ = arrays["sorted"]
+        index.__order__ = arrays["order"]
+        index.__merged__ = len(index.__ids__)
+        logger.info(f"loaded {len(index.__ids__)} vectors from {directory}")
+        return index
@@ -3,23 +3,36 @@ from recommender import Configuration
 from recommender.learner.model import LearnerModel
 from recommender.collector.music import Track
 from recommender.collector.batch_manager import BatchManager, DatabaseBatchManager
-from recommender.collector.saver import Saver, FileSaver
-from recommender.collector.tools import create_batch
+from recommender.collector.saver import Saver, FileSaver, MemoryMappedSaver, DatabaseSaver
+from recommender.collector.feature_cache import FeatureCache
+from recommender.collector.extractor import FeatureExtractor
+from recommender.collector.tools import AudioBuffer
+from recommender.collector.downloader import AsyncDownloader
 from recommender.collector.music_manager import RelationalDatabase, Database
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from typing import List, Tuple
+from sqlalchemy.orm.session import Session
+from collections import deque
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 import configparser
 import threading
 import argparse
 import logging
+import queue
 import os
-import time
 
-IS_RUNNING = False
-URL_DOWNLOADS: List[Track] = []
-FILE_DELETES: List[str] = []
-COMPLETED: List[List[Tuple[Track, str]]] = []
+# the sentinel passed through the queues of the pipeline to shut down the stages
+STOP = object()
+
+
+def remove_files(files: Iterable[str]) -> None:
+    """Remove downloaded samples, ignoring the samples that were already removed."""
+    for file in files:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
 
 
 class TrainingConfiguration(Configuration):
@@ -28,10 +41,12 @@ class TrainingConfiguration(Configuration):
                  batch_size: int,
                  tempdir: str,
                  mfcc: int,
-                 batch_id: str):
+                 batch_id: str,
+                 workers: int = None):
         self.batch_size = batch_size
         self.noise = noise
         self.mfcc = mfcc
+        self.workers = workers
         self.tempdir = tempdir
         self.batch_id = batch_id
 
@@ -44,107 +59,289 @@ class DownloadConfiguration(Configuration):
         self.batch_size = batch_size
 
 
-class Downloader(threading.Thread):
+class PipelineConfiguration(Configuration):
     def __init__(self,
-                 collector: Collector,
-                 config: DownloadConfiguration):
-        super(Downloader, self).__init__()
-        self.collector = collector
+                 queue_size: int = 4,
+                 download_workers: int = 2,
+                 cleanup_workers: int = 1,
+                 in_memory: bool = False):
+        self.queue_size = queue_size
+        self.download_workers = download_workers
+        self.cleanup_workers = cleanup_workers
+        self.in_memory = in_memory
+
+
+class Stage:
+    """
+    A stage of the training pipeline. Each worker thread takes items from the inbox, processes them and puts
+    the results into the outbox. Once every worker has received STOP, the stage sends one STOP for every worker
+    of the next stage.
+    """
+
+    def __init__(self, name: str, inbox: queue.Queue, outbox: Optional[queue.Queue], workers: int = 1,
+                 logger: logging.Logger = None):
+        self.name = name
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        # the number of workers of the next stage to send STOP to
+        self.downstream = 1
+        self.logger = logger or logging.getLogger("operation")
+        self.__remaining__ = workers
+        self.__lock__ = threading.Lock()
+        self.__threads__ = [threading.Thread(target=self.__work__, name=f"{name}-{i}", daemon=True)
+                            for i in range(workers)]
+
+    def process(self, item) -> Iterable:
+        """
+        Process an item from the inbox.
+        Args:
+            item: an item put into the inbox by the previous stage
+
+        Returns:
+            Iterable: the items to put into the outbox
+        """
+        return []
+
+    def finish(self) -> None:
+        """Called once by the last worker to stop."""
+        pass
+
+    def incoming(self) -> Iterator:
+        """Iterate over the inbox until STOP is received."""
+        while True:
+            item = self.inbox.get()
+            if item is STOP:
+                return
+            yield item
+
+    def work(self) -> None:
+        """The loop run by every worker thread."""
+        for item in self.incoming():
+            try:
+                for result in self.process(item):
+                    self.outbox.put(result)
+            except Exception:
+                self.logger.exception(f"{self.name} failed to process an item")
+
+    def __work__(self) -> None:
+        try:
+            self.work()
+        finally:
+            with self.__lock__:
+                self.__remaining__ -= 1
+                last = self.__remaining__ == 0
+            if last:
+                try:
+                    self.finish()
+                finally:
+                    if self.outbox is not None:
+                        for _ in range(self.downstream):
+                            self.outbox.put(STOP)
+
+    def start(self) -> None:
+        for thread in self.__threads__:
+            thread.start()
+
+    def join(self, timeout: float = None) -> None:
+        for thread in self.__threads__:
+            thread.join(timeout)
+
+
+class BatchFetcher(Stage):
+    """Fetches the training batches of a session from the database. It is the source of the pipeline."""
+
+    def __init__(self, batches: BatchManager, config: TrainingConfiguration, outbox: queue.Queue,
+                 stopped: threading.Event):
+        super(BatchFetcher, self).__init__("fetcher", None, outbox)
+        self.batches = batches
         self.config = config
+        self.stopped = stopped
 
-    def run(self):
-        global IS_RUNNING
-        while IS_RUNNING:
-            tracks = []
-            i = 0
-            while i < self.config.batch_size and len(URL_DOWNLOADS) > 0:
-                tracks.append(URL_DOWNLOADS.pop())
-            COMPLETED.append(self.collector.fetch_track_sample(self.config.tempdir, tracks))
+    def work(self) -> None:
+        for track_targets_pair in self.batches.iterate_training_batches(self.config.batch_id,
+                                                                       self.config.batch_size):
+            if self.stopped.is_set():
+                return
+            self.outbox.put(track_targets_pair)
+        self.logger.info("all training batches were fetched")
 
-    def stop(self):
-        self.join(1000)
 
+class Downloader(Stage):
+    """
+    Downloads the samples of a batch of tracks into the temporary directory. In memory, the samples are kept
+    in buffers instead and never touch the disk. Tracks whose features the extractor has cached are not downloaded;
+    they are passed on as buffers without data.
+    """
 
-class DeleteRunner(threading.Thread):
-    def __init__(self, directory: str):
-        super(DeleteRunner, self).__init__()
-        self.directory = directory
+    def __init__(self, collector: Collector, config: DownloadConfiguration, inbox: queue.Queue,
+                 outbox: queue.Queue, workers: int = 1, in_memory: bool = False, extractor: FeatureExtractor = None):
+        super(Downloader, self).__init__("downloader", inbox, outbox, workers)
+        self.collector = collector
+        self.config = config
+        self.in_memory = in_memory
+        self.extractor = extractor
+
+    def process(self, item: List[Tuple[Track, List[str]]]) \
+            -> Iterable[List[Tuple[List[str], Union[str, AudioBuffer]]]]:
+        samples = {track.track_id: AudioBuffer(track.track_id, None) for track, _ in item
+                   if self.extractor is not None and self.extractor.cached(track.track_id)}
+        tracks = [track for track, _ in item if track.track_id not in samples]
+        if tracks and self.in_memory:
+            samples.update((track.track_id, AudioBuffer(track.track_id, data))
+                           for track, data in self.collector.fetch_track_data(tracks))
+        elif tracks:
+            samples.update((track.track_id, file)
+                           for track, file in self.collector.fetch_track_sample(self.config.tempdir, tracks))
+        # tracks that failed to download are left out
+        return [[(target, samples[track.track_id]) for track, target in item if track.track_id in samples]]
+
+
+class Extractor(Stage):
+    """
+    Converts the downloaded samples into batches using a pool of processes. The files of every batch are queued in
+    the order the batches are taken, so they stay paired with the batches extracted. Tracks that fail to extract are
+    left out of their batch by the extractor, and a batch left empty is not trained. When the extractor itself
+    fails, the batch is dropped along with the batches being prefetched. The samples of dropped batches are removed
+    here, as they never reach the DeleteRunner.
+    """
 
-    def run(self):
-        global IS_RUNNING
-        while IS_RUNNING:
+    def __init__(self, extractor: FeatureExtractor, inbox: queue.Queue, outbox: queue.Queue):
+        super(Extractor, self).__init__("extractor", inbox, outbox)
+        self.extractor = extractor
+        self.__files__ = deque()
+        self.__received_stop__ = False
+
+    def __batches__(self) -> Iterator[List[Tuple[List[str], str]]]:
+        for target_file_pairs in self.incoming():
+            self.__files__.append([file for _, file in target_file_pairs if isinstance(file, str)])
+            yield target_file_pairs
+        self.__received_stop__ = True
+
+    def work(self) -> None:
+        while not self.__received_stop__:
             try:
-                track = FILE_DELETES.pop()
+                for batch, target in self.extractor.extract(self.__batches__()):
+                    files = self.__files__.popleft()
+                    if len(batch) == 0:
+                        remove_files(files)
+                        continue
+                    self.outbox.put((batch, target, files))
+            except Exception:
+                # the batches being prefetched are dropped along with the failed batch
+                self.logger.exception(f"{self.name} failed to process a batch")
+                while self.__files__:
+                    remove_files(self.__files__.popleft())
+
+    def finish(self) -> None:
+        self.extractor.close()
+
+
+class Trainer(Stage):
+    """
+    Trains the learner model over the extracted batches. The model is saved once the pipeline stops.
+    """
+
+    def __init__(self, model: LearnerModel, model_file: str, inbox: queue.Queue, outbox: Optional[queue.Queue]):
+        super(Trainer, self).__init__("trainer", inbox, outbox)
+        self.model = model
+        self.model_file = model_file
+
+    def process(self, item: Tuple[np.ndarray, np.ndarray, List[str]]) -> Iterable[List[str]]:
+        batch, target, files = item
+        loss = self.model.train(batch, target)
+        self.logger.debug(f"trained batch of {len(batch)} with loss {loss}")
+        return [files] if self.outbox is not None else []
+
+    def finish(self) -> None:
+        self.model.save(file=self.model_file)
+
 
-                path = os.path.join(self.directory, track)
-                os.remove(path)
+class DeleteRunner(Stage):
+    """Removes the samples that were trained over."""
 
-            except IndexError:
-                time.sleep(2)
-                continue
+    def __init__(self, inbox: queue.Queue, workers: int = 1):
+        super(DeleteRunner, self).__init__("deleter", inbox, None, workers)
 
-    def stop(self):
-        self.join(1000)
+    def process(self, item: List[str]) -> Iterable:
+        remove_files(item)
+        return []
 
 
-class Trainer(threading.Thread):
+class TrainingPipeline:
     """
-    A multi-threaded trainer with the learner model.
+    Connects the stages of training with bounded queues: fetching the batch ids, downloading the samples,
+    extracting the features, training the model and removing the samples. A full queue blocks the previous stage
+    so no stage runs further ahead than the size of the queues. In memory, the samples are never written to disk
+    so there is nothing to remove.
     """
 
     def __init__(self,
                  config: TrainingConfiguration,
+                 pipeline_config: PipelineConfiguration,
                  model: LearnerModel,
                  batches: BatchManager,
-                 source: Collector,
-                 saver: Saver,
-                 database: Database,
+                 collector: Collector,
+                 extractor: FeatureExtractor,
                  model_file: str):
-        super(Trainer, self).__init__()
-        self.config = config
-        self.model = model
-        self.batches = batches
-        self.saver = saver
-        self.source = source
-        self.database = database
-        self.model_file = model_file
+        self.stopped = threading.Event()
+        queues = [queue.Queue(maxsize=pipeline_config.queue_size) for _ in range(4)]
+        in_memory = pipeline_config.in_memory
+        self.stages: List[Stage] = [
+            BatchFetcher(batches, config, queues[0], self.stopped),
+            Downloader(collector, DownloadConfiguration(config.tempdir, config.batch_size),
+                       queues[0], queues[1], pipeline_config.download_workers, in_memory, extractor),
+            Extractor(extractor, queues[1], queues[2]),
+            Trainer(model, model_file, queues[2], None if in_memory else queues[3])
+        ]
+        if not in_memory:
+            self.stages.append(DeleteRunner(queues[3], pipeline_config.cleanup_workers))
+        for stage, following in zip(self.stages, self.stages[1:]):
+            stage.downstream = following.workers
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self) -> None:
+        """Stop fetching new batches. The batches already fetched are drained through the pipeline."""
+        self.stopped.set()
+
+    def join(self) -> None:
+        for stage in self.stages:
+            stage.join()
+
+
+def __create_saver__(configuration: configparser.ConfigParser, sess: Session) -> Saver:
+    """
+    Create the storage of the results of the model chosen by the multipoints section of the configuration.
+    Args:
+        configuration (configparser.ConfigParser): the configuration of the recommender
+        sess (Session): the session of the database, used when the results are stored in it
 
-    def run(self):
-        global IS_RUNNING
-        mapping = self.database.get_all_genre()
-        mapping.extend(self.database.get_all_category())
-        mapping.sort()
-
-        while IS_RUNNING:
-            if len(URL_DOWNLOADS) < self.config.batch_size * 3:
-                track_targets_pair = self.batches.get_training_batches(self.config.batch_id, 10)
-                if len(track_targets_pair) == 0:
-                    IS_RUNNING = False
-                    return
-                URL_DOWNLOADS.extend([track for track, _ in track_targets_pair])
-            if len(COMPLETED) > 0:
-                tracks_file_pairs = COMPLETED.pop()
-                target_file_pairs: List[Tuple[List[str], str]] = []
-                for t, f in tracks_file_pairs:
-                    total = [category for category in t.categories]
-                    total.extend([genre for genre in t.genres])
-                    target_file_pairs.append(
-                        (total, f))
-                batch, target = create_batch(target_file_pairs, mapping, False)
-                self.model.train(batch, target)
-                FILE_DELETES.extend([file for _, file in tracks_file_pairs])
-
-    def start(self):
-        super(Trainer, self).start()
-
-    def stop(self):
-        super(Trainer, self).join(10000)
-        self.model.save(file=self.model_file)
+    Returns:
+        Saver: the storage of the results
+    """
+    storage = configuration.get("multipoints", "storage", fallback="memmap")
+    # the rows of a memmap store would overwrite a text file, so the two do not share a default file
+    default = "results/default.map" if storage == "file" else "results/default.rows"
+    filename = configuration.get("multipoints", "file", fallback=default)
+    if storage == "file":
+        return FileSaver(filename, logging.getLogger("file_saver"))
+    if storage == "memmap":
+        return MemoryMappedSaver(filename, logging.getLogger("memmap_saver"))
+    if storage == "database":
+        return DatabaseSaver(sess, logging.getLogger("database_saver"))
+    raise ValueError(f"unknown storage for the results: {storage}")
 
 
-def train(flags: argparse.Namespace, configuration: configparser.ConfigParser):
-    global IS_RUNNING
+def __wait_for_enter__(pipeline: TrainingPipeline) -> None:
+    """Stop the pipeline once the user presses enter."""
+    input()
+    pipeline.stop()
+
 
+def train(flags: argparse.Namespace, configuration: configparser.ConfigParser):
     operation_logger = logging.getLogger("operations")
 
     driver = configuration.get("rmdb", "engine")
@@ -160,17 +357,20 @@ def train(flags: argparse.Namespace, configuration: configparser.ConfigParser):
     sess = session()
 
     database = RelationalDatabase(sess=sess, logger=logging.getLogger("database"))
-    database.get_all_category()
+    # the registry indexes the sorted names of every genre and category
+    mapping = database.labels.indexes()
 
     model = LearnerModel(
-        categories=database.genre_size() + database.category_size(),
+        categories=len(mapping),
         logger=logging.getLogger("learner_model")
     )
+    model.build_graph()
+    model.initialize()
 
     session_file = configuration.get("recommender", "session_file")
 
     session_configuration = configparser.ConfigParser()
-    session_configuration.read_file(session_file)
+    session_configuration.read(session_file)
 
     if session_configuration.get("session", "id"):
         batch_manager = DatabaseBatchManager(sess, logging.getLogger("manager"))
@@ -178,9 +378,16 @@ def train(flags: argparse.Namespace, configuration: configparser.ConfigParser):
         operation_logger.error("error with getting the session id. create id with batch operation")
         return
 
-    saver = FileSaver("results/default.map", logging.getLogger("file_saver"))
+    saver = __create_saver__(configuration, sess)
 
-    collector = SpotifyCollector(configuration.get("spotify", "id"), configuration.get("spotify", "secret"))
+    downloader = AsyncDownloader(logging.getLogger("downloader"),
+                                 concurrency=configuration.getint("pipeline", "download_concurrency", fallback=16),
+                                 connections_per_host=configuration.getint("pipeline", "connections_per_host",
+                                                                           fallback=4),
+                                 retries=configuration.getint("pipeline", "download_retries", fallback=3),
+                                 timeout=configuration.getfloat("pipeline", "download_timeout", fallback=10.0))
+    collector = SpotifyCollector(configuration.get("spotify", "id"), configuration.get("spotify", "secret"),
+                                 downloader)
 
     if configuration.get("recommender", "cache_directory") and not os.path.exists(
             configuration.get("recommender", "cache_directory")):
@@ -189,35 +396,42 @@ def train(flags: argparse.Namespace, configuration: configparser.ConfigParser):
     tempdir = configuration.get("recommender", "cache_directory") if configuration.get("recommender",
                                                                                        "cache_directory") else ""
 
+    cache = FeatureCache(os.path.join(tempdir, "features"),
+                         logging.getLogger("feature_cache"),
+                         configuration.getint("recommender", "feature_cache_size", fallback=1 << 30))
+
+    workers = configuration.get("recommender", "extraction_workers", fallback="")
     training_config = TrainingConfiguration(
         False,
         flags.batch_size,
         tempdir,
         32,
-        session_configuration.get("session", "id")
+        session_configuration.get("session", "id"),
+        int(workers) if workers else None
     )
-    download_config = DownloadConfiguration(
-        tempdir,
-        flags.batch_size
+    pipeline_config = PipelineConfiguration(
+        configuration.getint("pipeline", "queue_size", fallback=4),
+        configuration.getint("pipeline", "download_workers", fallback=2),
+        configuration.getint("pipeline", "cleanup_workers", fallback=1),
+        configuration.getboolean("pipeline", "in_memory", fallback=False)
     )
-    trainer = Trainer(training_config,
-                      model,
-                      batch_manager,
-                      collector,
-                      saver,
-                      database,
-                      configuration.get("recommender", "session_file"))
-
-    downloader = Downloader(collector,
-                            download_config)
-
-    deleter = DeleteRunner(tempdir)
-
-    downloader.run()
-    deleter.run()
-    trainer.run()
+    extractor = FeatureExtractor(mapping,
+                                 logging.getLogger("extractor"),
+                                 workers=training_config.workers,
+                                 prefetch=pipeline_config.queue_size,
+                                 cache=cache,
+                                 n_mfcc=training_config.mfcc)
+    pipeline = TrainingPipeline(training_config,
+                                pipeline_config,
+                                model,
+                                batch_manager,
+                                collector,
+                                extractor,
+                                configuration.get("recommender", "session_file"))
+    pipeline.start()
 
     print("Press [Enter] to save the model at the snapshot.")
-    while IS_RUNNING:
-        input()
-        IS_RUNNING = False
+    threading.Thread(target=__wait_for_enter__, args=(pipeline,), daemon=True).start()
+    pipeline.join()
+    downloader.close()
+    saver.close()
@@ -0,0 +1,59 @@
+from recommender.collector.artist_cache import ArtistGenreCache
+import logging
+import os
+import shutil
+import unittest
+
+
+class ArtistGenreCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.file_name = "tmp/artist_cache/artists.json"
+
+    def fetch(self, ids):
+        self.requests.append(ids)
+        return [{"id": artist_id, "genres": [f"genre of {artist_id}"]} for artist_id in ids if artist_id != "missing"]
+
+    def test_resolve(self):
+        cache = ArtistGenreCache(logging.getLogger("artists"))
+        ids = [f"artist{i}" for i in range(60)]
+        genres = cache.resolve(ids + ids[:5] + ["missing"], self.fetch)
+        self.assertListEqual([len(request) for request in self.requests], [50, 11])
+        self.assertEqual(len(genres), 61)
+        self.assertListEqual(genres["artist3"], ["genre of artist3"])
+        self.assertListEqual(genres["missing"], [])
+
+        self.requests = []
+        self.assertDictEqual(cache.resolve(ids[10:20], self.fetch), {i: genres[i] for i in ids[10:20]})
+        # the missing artist is cached as well, so it is not requested again
+        self.assertDictEqual(cache.resolve(["missing"], self.fetch), {"missing": []})
+        self.assertListEqual(self.requests, [])
+
+    def test_evict(self):
+        cache = ArtistGenreCache(logging.getLogger("artists"), max_size=2)
+        cache.put("a", ["rock"])
+        cache.put("b", ["pop"])
+        cache.get("a")
+        cache.put("c", ["jazz"])
+        self.assertIsNone(cache.get("b"))
+        self.assertListEqual(cache.get("a"), ["rock"])
+        self.assertEqual(len(cache), 2)
+
+    def test_persist(self):
+        cache = ArtistGenreCache(logging.getLogger("artists"), file_name=self.file_name)
+        cache.resolve(["a", "b", "c"], self.fetch)
+        cache.get("a")
+        cache.save()
+
+        loaded = ArtistGenreCache(logging.getLogger("artists"), max_size=2, file_name=self.file_name)
+        self.assertEqual(len(loaded), 2)
+        self.assertIsNone(loaded.get("b"))
+        self.assertListEqual(loaded.get("a"), ["genre of a"])
+
+    def tearDown(self):
+        if os.path.exists("tmp/artist_cache"):
+            shutil.rmtree("tmp/artist_cache")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+from recommender.collector import initialize_database
+from recommender.collector.batch_manager import DatabaseBatchManager
+from recommender.collector.music import Track, Category, Genre, TRACK_CATEGORY_ASSOCIATION
+import recommender.collector.observation as obs
+from sqlalchemy import create_engine, event, BigInteger
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+import logging
+import unittest
+
+
+class DatabaseBatchManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        initialize_database(self.engine)
+        self.sess = sessionmaker(bind=self.engine)()
+        categories = [Category(cid=f"c{i}", category_id=f"category{i}", category=f"category {i}") for i in range(3)]
+        genres = [Genre(gid=f"g{i}", genre_id=f"genre{i}", genre=f"genre {i}") for i in range(3)]
+        self.sess.add_all(categories + genres)
+        for i in range(50):
+            track = Track(internal_id=f"internal{i:03}", track_id=f"track{i:03}", url=f"url{i}", title=f"{i}")
+            track.categories.append(categories[i % 3])
+            track.genres.append(genres[i % 2])
+            self.sess.add(track)
+            self.sess.add(obs.TrainingObservation(id=f"session:track{i:03}", track_id=f"track{i:03}",
+                                                  session="session"))
+        self.sess.commit()
+        self.manager = DatabaseBatchManager(self.sess, logging.getLogger("manager"))
+
+    def test_iterate(self):
+        pages = list(self.manager.iterate_training_batches("session", 15))
+        self.assertListEqual([len(page) for page in pages], [15, 15, 15, 5])
+        tracks = [track.track_id for page in pages for track, _ in page]
+        self.assertListEqual(tracks, [f"track{i:03}" for i in range(50)])
+
+    def test_after(self):
+        page = self.manager.get_training_batches("session", 5, after="session:track009")
+        self.assertListEqual([track.track_id for track, _ in page], [f"track{i:03}" for i in range(10, 15)])
+        self.assertListEqual(page[0][1], ["category 1", "genre 0"])
+
+    def test_skip(self):
+        page = self.manager.get_training_batches("session", 5, skip=45)
+        self.assertListEqual([track.track_id for track, _ in page], [f"track{i:03}" for i in range(45, 50)])
+
+    def test_constant_statements(self):
+        self.sess.execute(Track.__table__.insert(), [
+            {"internal_id": f"internal{i:04}", "track_id": f"track{i:04}", "url": f"url{i}"}
+            for i in range(50, 1000)])
+        self.sess.execute(TRACK_CATEGORY_ASSOCIATION.insert(), [
+            {"track_id": f"track{i:04}", "category_id": f"c{i % 3}"} for i in range(50, 1000)])
+        self.sess.execute(obs.TrainingObservation.__table__.insert(), [
+            {"id": f"session:track{i:04}", "track_id": f"track{i:04}", "session": "session"}
+            for i in range(50, 1000)])
+        self.sess.commit()
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        self.sess.expunge_all()
+        small = self.manager.get_training_batches("session", 2)
+        small_count = len(statements)
+        self.sess.expunge_all()
+        del statements[:]
+        large = self.manager.get_training_batches("session", 1000)
+        self.assertEqual(len(large), 1000)
+        self.assertEqual(len(statements), small_count)
+        self.assertLessEqual(small_count, 3)
+        self.assertListEqual(large[1][1], ["category 1", "genre 1"])
+        self.sess.expunge_all()
+        del statements[:]
+        pages = list(self.manager.iterate_training_batches("session", 250))
+        self.assertEqual(len(pages), 4)
+        # every keyset page issues the same statements, plus one query finding the page after the last empty
+        self.assertEqual(len(statements), len(pages) * small_count + 1)
+
+    def test_seeded_order_types(self):
+        for stratify in (None, "category"):
+            compiled = DatabaseBatchManager.__ordered_tracks__(seed=7, stratify=stratify) \
+                .compile(dialect=postgresql.dialect())
+            # the affine map of the keys overflows 32 bit integers, which Postgres would reject
+            self.assertIn("CAST(tracks.sample_key AS BIGINT)", str(compiled))
+            self.assertTrue(compiled.binds)
+            for bind in compiled.binds.values():
+                self.assertIsInstance(bind.type, BigInteger)
+
+    def test_create_batches(self):
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        batch_id = self.manager.create_batches(20, 5, 5, skip=10)
+        self.assertLessEqual(len(statements), 6)
+        self.assertIn(batch_id, self.manager.list_sessions())
+        training = [track.track_id for page in self.manager.iterate_training_batches(batch_id, 100)
+                    for track, _ in page]
+        self.assertListEqual(training, [f"track{i:03}" for i in range(10, 30)])
+        test = [track.track_id for track, _ in self.manager.get_test_batches(batch_id, 100)]
+        self.assertListEqual(test, [f"track{i:03}" for i in range(30, 35)])
+        cross_test = [track.track_id for track, _ in self.manager.get_cross_test_batches(batch_id, 100)]
+        self.assertListEqual(cross_test, [f"track{i:03}" for i in range(35, 40)])
+
+        self.manager.extend_batches(batch_id, 5, 0, 0, skip=10)
+        training = [track.track_id for track, _ in self.manager.get_training_batches(batch_id, 100)]
+        self.assertListEqual(training[20:], [f"track{i:03}" for i in range(40, 45)])
+
+    def test_extend_after_new_tracks(self):
+        for seed, stratify in ((None, None), (7, None), (3, "category")):
+            batch_id = self.manager.create_batches(10, 5, 5, seed=seed, stratify=stratify)
+            for i in range(50, 60):
+                # the new tracks sort before the others, so they shift the order of the tracks
+                self.sess.add(Track(internal_id=f"new{seed}{i:03}", track_id=f"new{seed}{i:03}", url=f"url{i}",
+                                    title=f"{i}"))
+            self.sess.commit()
+            self.manager.extend_batches(batch_id, 10, 5, 5)
+
+            splits = [[track.track_id for track, _ in get(batch_id, 100)]
+                      for get in (self.manager.get_training_batches,
+                                  self.manager.get_test_batches,
+                                  self.manager.get_cross_test_batches)]
+            self.assertListEqual([len(split) for split in splits], [20, 10, 10])
+            # no track is assigned twice, so no test track leaks into training
+            self.assertEqual(len(set(splits[0] + splits[1] + splits[2])), 40)
+
+    def test_create_batches_too_large(self):
+        with self.assertRaises(BufferError):
+            self.manager.create_batches(40, 10, 10)
+        self.assertListEqual(self.manager.list_sessions(), [])
+
+    def test_session_summary(self):
+        batch_id = self.manager.create_batches(20, 5, 5)
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        summary = self.manager.get_session_summary(batch_id)
+        self.assertEqual(len(statements), 1)
+        self.assertTupleEqual((summary.training_count, summary.test_count, summary.cross_test_count), (20, 5, 5))
+        self.assertEqual(summary.labels["category 0"], 10)
+        self.assertEqual(summary.labels["genre 0"], 15)
+        self.assertIsNone(summary.last_trained)
+
+        self.assertTupleEqual(self.manager.get_session(batch_id), (20, 5, 5))
+        self.assertEqual(len(statements), 1)
+        self.manager.extend_batches(batch_id, 5, 0, 0)
+        self.assertTupleEqual(self.manager.get_session(batch_id), (25, 5, 5))
+        with self.assertRaises(ValueError):
+            self.manager.get_session("missing")
+
+    def test_seeded_split(self):
+        first = self.manager.create_batches(20, 5, 5, seed=7)
+        second = self.manager.create_batches(20, 5, 5, seed=7)
+        other = self.manager.create_batches(20, 5, 5, seed=8)
+
+        def tracks(batch_id):
+            return [sorted(track.track_id for track, _ in get(batch_id, 100))
+                    for get in (self.manager.get_training_batches,
+                                self.manager.get_test_batches,
+                                self.manager.get_cross_test_batches)]
+
+        self.assertListEqual(tracks(first), tracks(second))
+        self.assertNotEqual(tracks(first), tracks(other))
+        splits = tracks(first)
+        self.assertEqual(len(set(splits[0] + splits[1] + splits[2])), 30)
+        self.assertNotEqual(splits[0], [f"track{i:03}" for i in range(20)])
+
+    def test_stratified_split(self):
+        batch_id = self.manager.create_batches(30, 12, 6, seed=3, stratify="category")
+        for get, count in ((self.manager.get_training_batches, 10),
+                           (self.manager.get_test_batches, 4),
+                           (self.manager.get_cross_test_batches, 2)):
+            labels = [targets[0] for _, targets in get(batch_id, 100)]
+            for i in range(3):
+                self.assertLessEqual(abs(labels.count(f"category {i}") - count), 1)
+
+    def tearDown(self):
+        self.sess.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+from recommender.collector.crawler import SpotifyApi, SpotifyCrawler, TokenBucket
+from recommender.collector import initialize_database
+from recommender.collector.checkpoint_manager import CheckpointManager
+from recommender.collector.music import Category, Track
+from recommender.collector.music_manager import RelationalDatabase
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import urllib.parse
+import threading
+import logging
+import json
+import time
+import unittest
+
+# two playlists per category, each with 120 tracks by 6 artists. Every fifth track has no preview
+PLAYLISTS = {f"{category}-{i}": [f"{category}-{i}-track{j}" for j in range(120)]
+             for category in ("party", "chill") for i in range(2)}
+SNAPSHOTS = {}
+ARTISTS = {f"artist{i}": [["indie rock"], ["dance pop"], ["ambient"], [], ["rock"], ["deep house"]][i]
+           for i in range(6)}
+
+
+class SpotifyServer(ThreadingHTTPServer):
+    """A server recording the requests it receives. The first request for a second page of a playlist is
+    rate limited, unless throttle is False"""
+
+    def __init__(self, throttle: bool = True):
+        super().__init__(("127.0.0.1", 0), SpotifyHandler)
+        self.requests = []
+        self.limited = set()
+        self.throttle = throttle
+        self.lock = threading.Lock()
+
+
+class SpotifyHandler(BaseHTTPRequestHandler):
+    """A stand-in for the Spotify Web API"""
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, body, status=200, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_json({"access_token": "token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")[1:]
+        server = self.server
+        with server.lock:
+            server.requests.append((url.path, time.monotonic()))
+            # rate limit the first request for the second page of a playlist
+            limited = server.throttle and parts[0] == "playlists" and query.get("offset") == "50" \
+                and not server.limited
+            if limited:
+                server.limited.add(url.path)
+        if self.headers.get("Authorization") != "Bearer token":
+            self.send_json({}, 401)
+        elif limited:
+            self.send_json({}, 429, {"Retry-After": "1"})
+        elif parts[:2] == ["browse", "categories"]:
+            ids = sorted(playlist for playlist in PLAYLISTS if playlist.startswith(parts[2]))
+            offset, limit = int(query["offset"]), int(query["limit"])
+            self.send_json({"playlists": {"items": [{"id": playlist, "owner": {"id": "spotify"},
+                                                     "snapshot_id": SNAPSHOTS.get(playlist, "v1")}
+                                                    for playlist in ids[offset:offset + limit]],
+                                          "total": len(ids)}})
+        elif parts[0] == "playlists":
+            tracks = PLAYLISTS[parts[1]]
+            offset, limit = int(query["offset"]), int(query["limit"])
+            self.send_json({"items": [{"track": {"id": track, "name": track,
+                                                 "preview_url": None if j % 5 == 0 else f"http://preview/{track}",
+                                                 "artists": [{"id": f"artist{j % 6}", "name": f"artist {j % 6}"}]}}
+                                      for j, track in enumerate(tracks[offset:offset + limit], offset)],
+                            "total": len(tracks)})
+        elif parts[0] == "artists":
+            self.send_json({"artists": [{"id": artist, "genres": ARTISTS[artist]}
+                                        for artist in query["ids"].split(",")]})
+        elif parts[0] == "recommendations":
+            self.send_json({"genres": ["rock", "pop", "house", "ambient"]})
+        else:
+            self.send_json({}, 404)
+
+    def log_message(self, *args):
+        pass
+
+
+class SpotifyCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        SNAPSHOTS.clear()
+        self.start()
+
+    def start(self, throttle: bool = True):
+        self.server = SpotifyServer(throttle)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.api = SpotifyApi("id", "secret", logging.getLogger("spotify"), TokenBucket(1000, 1000),
+                              base_url=f"{url}/v1", token_url=f"{url}/token", backoff=0.01)
+        self.crawler = SpotifyCrawler(self.api, logging.getLogger("crawler"), concurrency=4,
+                                      playlist_page_size=1, track_page_size=50)
+        self.categories = [Category(cid="c0", category_id="party"), Category(cid="c1", category_id="chill")]
+
+    def test_crawl(self):
+        known = {"party-0-track1", "chill-1-track2"}
+        checked = []
+
+        def added(ids):
+            checked.append(len(ids))
+            return known.intersection(ids)
+
+        tracks = list(self.crawler.crawl(self.categories, added))
+        self.assertEqual(len(tracks), 4 * 96 - 2)
+        self.assertEqual(len({track.track_id for track in tracks}), len(tracks))
+        self.assertFalse(known.intersection(track.track_id for track in tracks))
+        # the tracks of a page are checked at once
+        self.assertEqual(len(checked), 4 * 3)
+
+        by_id = {track.track_id: track for track in tracks}
+        self.assertListEqual(by_id["party-0-track6"].genre_list, ["rock"])
+        self.assertListEqual(by_id["party-0-track7"].genre_list, ["pop"])
+        self.assertListEqual(by_id["chill-1-track3"].genre_list, [])
+        self.assertListEqual(by_id["chill-1-track3"].category_list, ["chill"])
+        # the six artists are cached after the first pages
+        artist_requests = [path for path, _ in self.server.requests if path.endswith("/artists")]
+        self.assertLessEqual(len(artist_requests), 4)
+
+    def test_retry_after(self):
+        start = time.monotonic()
+        list(self.crawler.crawl(self.categories, lambda ids: set()))
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        limited, = self.server.limited
+        limited_at = next(at for path, at in self.server.requests if path == limited)
+        # no request is sent while the bucket is paused
+        self.assertFalse([path for path, at in self.server.requests if limited_at + 0.1 < at < limited_at + 0.9])
+
+    def test_count(self):
+        tracks = list(self.crawler.crawl(self.categories, lambda ids: set(), count=30))
+        self.assertEqual(sum(track.category_list == ["party"] for track in tracks), 30)
+        self.assertEqual(sum(track.category_list == ["chill"] for track in tracks), 30)
+
+    def test_checkpoints(self):
+        # a retried request would be counted by whichever crawl it lands in, so nothing is rate limited
+        self.tearDown()
+        self.start(throttle=False)
+        engine = create_engine("sqlite://")
+        initialize_database(engine)
+        sess = sessionmaker(bind=engine)()
+        sess.add_all([Category(cid="c0", category_id="party", category="Party"),
+                      Category(cid="c1", category_id="chill", category="Chill")])
+        sess.commit()
+        database = RelationalDatabase(sess, logging.getLogger("database"))
+
+        def crawl(crash_after=None):
+            checkpoints = CheckpointManager(sess, logging.getLogger("checkpoints"))
+            self.server.requests = []
+            tracks = self.crawler.crawl(self.categories, database.existing_ids, checkpoints=checkpoints)
+
+            def crashing():
+                for i, track in enumerate(tracks):
+                    if i == crash_after:
+                        raise KeyboardInterrupt()
+                    yield track
+
+            try:
+                database.save_tracks(crashing(), chunk_size=40)
+                checkpoints.commit()
+            except KeyboardInterrupt:
+                sess.rollback()
+            return [path for path, _ in self.server.requests if "/playlists/" in path]
+
+        first = crawl(crash_after=150)
+        self.assertEqual(sess.query(Track).count(), 120)
+        second = crawl()
+        self.assertEqual(sess.query(Track).count(), 4 * 96)
+        self.assertLess(len(second), 4 * 3)
+        # nothing changed, so no page of tracks is fetched
+        self.assertListEqual(crawl(), [])
+        SNAPSHOTS["chill-1"] = "v2"
+        self.assertSetEqual(set(crawl()), {"/v1/playlists/chill-1/tracks"})
+        self.assertGreaterEqual(len(first) + len(second), 4 * 3)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, 5)
+        start = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
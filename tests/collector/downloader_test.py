@@ -0,0 +1,123 @@
+from recommender.collector.downloader import AsyncDownloader
+from recommender.collector.music import Track
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import shutil
+import threading
+import time
+import unittest
+
+SAMPLE = b"ID3" + bytes(range(256)) * 64
+
+
+class SampleHandler(BaseHTTPRequestHandler):
+    """A stand-in for the server hosting the previews"""
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    failures = {}
+    requests = []
+
+    def setup(self):
+        super(SampleHandler, self).setup()
+        SampleHandler.connections.add(self.client_address)
+
+    def do_GET(self):
+        SampleHandler.requests.append((self.path, time.monotonic()))
+        if self.path.startswith("/limited") and SampleHandler.failures.get(self.path, 0) < 1:
+            SampleHandler.failures[self.path] = SampleHandler.failures.get(self.path, 0) + 1
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/flaky") and SampleHandler.failures.get(self.path, 0) < 1:
+            SampleHandler.failures[self.path] = SampleHandler.failures.get(self.path, 0) + 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(SAMPLE)))
+        self.end_headers()
+        self.wfile.write(SAMPLE)
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncDownloaderTest(unittest.TestCase):
+    def setUp(self):
+        SampleHandler.connections = set()
+        SampleHandler.failures = {}
+        SampleHandler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SampleHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.downloader = AsyncDownloader(logging.getLogger("downloader"), concurrency=8,
+                                          connections_per_host=2, backoff=0.01, timeout=5)
+
+    def test_download(self):
+        tracks = [Track(track_id=f"track{i}", url=f"{self.url}/preview/{i}") for i in range(20)]
+        samples = self.downloader.fetch("tmp/downloads", tracks)
+        self.assertListEqual([track for track, _ in samples], tracks)
+        for track, file in samples:
+            self.assertEqual(file, os.path.join("tmp/downloads", f"{track.track_id}.mp3"))
+            with open(file, "rb") as sample:
+                self.assertEqual(sample.read(), SAMPLE)
+        self.assertLessEqual(len(SampleHandler.connections), 2)
+
+    def test_connection_reuse(self):
+        self.downloader.fetch("tmp/downloads", [Track(track_id="first", url=f"{self.url}/preview/first")])
+        self.downloader.fetch("tmp/downloads", [Track(track_id="second", url=f"{self.url}/preview/second".encode())])
+        self.assertEqual(len(SampleHandler.connections), 1)
+
+    def test_retry(self):
+        samples = self.downloader.fetch("tmp/downloads", [Track(track_id="flaky", url=f"{self.url}/flaky")])
+        self.assertEqual(len(samples), 1)
+
+    def test_retry_after(self):
+        downloader = AsyncDownloader(logging.getLogger("downloader"), concurrency=1, backoff=0.01, timeout=5)
+        try:
+            tracks = [Track(track_id="limited", url=f"{self.url}/limited"),
+                      Track(track_id="other", url=f"{self.url}/preview/other")]
+            samples = downloader.fetch_bytes(tracks)
+        finally:
+            downloader.close()
+        self.assertListEqual([track.track_id for track, _ in samples], ["limited", "other"])
+        limited = [at for path, at in SampleHandler.requests if path == "/limited"]
+        other = [at for path, at in SampleHandler.requests if path == "/preview/other"]
+        # the retry waits as long as the server asked instead of the backoff
+        self.assertGreaterEqual(limited[1] - limited[0], 0.9)
+        # the only slot is released while waiting, so the other track is downloaded in the meantime
+        self.assertLess(other[0], limited[1])
+
+    def test_download_bytes(self):
+        tracks = [Track(track_id=f"track{i}", url=f"{self.url}/preview/{i}") for i in range(5)]
+        samples = self.downloader.fetch_bytes(tracks)
+        self.assertListEqual([track for track, _ in samples], tracks)
+        self.assertTrue(all(data == SAMPLE for _, data in samples))
+        self.assertFalse(os.path.exists("tmp/downloads"))
+
+    def test_missing(self):
+        tracks = [Track(track_id="missing", url=f"{self.url}/missing"),
+                  Track(track_id="found", url=f"{self.url}/preview/found")]
+        samples = self.downloader.fetch("tmp/downloads", tracks)
+        self.assertListEqual([track.track_id for track, _ in samples], ["found"])
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree("tmp/downloads", ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+from recommender.collector.extractor import FeatureExtractor
+from recommender.collector.feature_cache import FeatureCache
+from recommender.collector.tools import AudioBuffer
+import numpy as np
+import logging
+import shutil
+import time
+import unittest
+
+
+def constant_features(file_name, sample_rate, duration, n_mfcc):
+    """Features filled with the number in the name of the file. Lower numbers take longer to extract."""
+    value = float(file_name.split("/")[-1].split(".")[0])
+    time.sleep(0.02 / (1 + value))
+    return np.full((8, n_mfcc), value, dtype=np.float32)
+
+
+class FeatureExtractorTest(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree("tmp/extractor", ignore_errors=True)
+        self.cache = FeatureCache("tmp/extractor", logging.getLogger("feature_cache"))
+        self.extractor = FeatureExtractor(["pop", "rock"], logging.getLogger("extractor"), workers=2, prefetch=2,
+                                          cache=self.cache, frames=16, n_mfcc=4, features=constant_features)
+
+    def test_order(self):
+        batches = [[(["rock"], f"samples/{i * 3 + j}.mp3") for j in range(3)] for i in range(5)]
+        results = list(self.extractor.extract(batches))
+        self.assertEqual(len(results), 5)
+        for i, (inputs, targets) in enumerate(results):
+            self.assertTupleEqual(inputs.shape, (3, 16, 4))
+            np.testing.assert_array_equal(inputs[:, 0, 0], [i * 3, i * 3 + 1, i * 3 + 2])
+            # the features are padded to the number of frames
+            np.testing.assert_array_equal(inputs[:, 8:], 0)
+            np.testing.assert_array_equal(targets, [[0, 1]] * 3)
+
+    def test_prefetch(self):
+        pulled = []
+
+        def batches():
+            for i in range(6):
+                pulled.append(i)
+                yield [(["pop"], f"samples/{i}.mp3")]
+
+        for consumed, (inputs, _) in enumerate(self.extractor.extract(batches())):
+            self.assertEqual(inputs[0, 0, 0], consumed)
+            # the batch consumed and at most prefetch batches after it were submitted
+            self.assertLessEqual(len(pulled), consumed + 1 + 2)
+
+    def test_cache(self):
+        self.cache.put("1", np.full((8, 4), 5, dtype=np.float32), 22050, 30, 4)
+        inputs, _ = self.extractor.create_batch([(["pop"], "samples/1.mp3"), (["pop"], "samples/2.mp3")])
+        # the cached features are used instead of extracting them again
+        np.testing.assert_array_equal(inputs[:, 0, 0], [5, 2])
+        self.assertEqual(self.cache.hits, 1)
+        np.testing.assert_array_equal(self.cache.get("2", 22050, 30, 4), np.full((8, 4), 2))
+
+    def test_failed_track(self):
+        inputs, targets = self.extractor.create_batch([(["pop"], "samples/1.mp3"), (["rock"], "samples/corrupt.mp3"),
+                                                       (["rock"], "samples/3.mp3")])
+        # only the track that failed is left out, with its target
+        np.testing.assert_array_equal(inputs[:, 0, 0], [1, 3])
+        np.testing.assert_array_equal(targets, [[1, 0], [0, 1]])
+
+    def test_cached_without_data(self):
+        self.cache.put("4", np.full((8, 4), 4, dtype=np.float32), 22050, 30, 4)
+        self.assertTrue(self.extractor.cached("4"))
+        self.assertFalse(self.extractor.cached("5"))
+        # a track that was not downloaded is read from the cache, or left out if it was evicted since
+        inputs, _ = self.extractor.create_batch([(["pop"], AudioBuffer("4", None)), (["pop"], AudioBuffer("5", None))])
+        np.testing.assert_array_equal(inputs[:, 0, 0], [4])
+
+    def test_close(self):
+        self.extractor.close()
+        with self.assertRaises(RuntimeError):
+            self.extractor.create_batch([(["pop"], "samples/3.mp3")])
+
+    def tearDown(self):
+        self.extractor.close()
+        shutil.rmtree("tmp/extractor", ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
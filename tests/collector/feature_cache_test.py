@@ -0,0 +1,44 @@
+from recommender.collector.feature_cache import FeatureCache
+import logging
+import shutil
+import unittest
+import numpy as np
+
+
+class FeatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = "tmp/feature_cache"
+        self.cache = FeatureCache(self.directory, logging.getLogger("feature_cache"))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("track"))
+        self.cache.put("track", np.ones((2048, 32)))
+        features = self.cache.get("track")
+        self.assertTupleEqual(features.shape, (2048, 32))
+        self.assertEqual(features.dtype, np.float32)
+        self.assertIsNone(self.cache.get("track", n_mfcc=20))
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_persistent(self):
+        self.cache.put("track", np.ones((10, 32)))
+        cache = FeatureCache(self.directory, logging.getLogger("feature_cache"))
+        self.assertIsNotNone(cache.get("track"))
+
+    def test_eviction(self):
+        self.cache.put("first", np.ones((100, 32)))
+        size = self.cache.size()
+        cache = FeatureCache(self.directory, logging.getLogger("feature_cache"), max_size=size * 2)
+        cache.put("second", np.ones((100, 32)))
+        cache.get("first")
+        cache.put("third", np.ones((100, 32)))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+from recommender.collector import initialize_database
+from recommender.collector.music import Category, Genre
+from recommender.collector.music_manager import RelationalDatabase
+from recommender.collector.tools import map_target, target_indexes
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import logging
+import unittest
+
+
+class LabelRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        initialize_database(self.engine)
+        self.sess = sessionmaker(bind=self.engine)()
+        self.sess.add_all([Category(cid="c0", category_id="party", category="Party"),
+                           Category(cid="c1", category_id="chill", category="Chill"),
+                           Genre(gid="g0", genre_id="rock", genre="rock")])
+        self.sess.commit()
+        self.database = RelationalDatabase(self.sess, logging.getLogger("database"))
+
+    def test_resolve(self):
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        self.assertEqual(self.database.labels.category("party"), "c0")
+        self.assertEqual(self.database.labels.category("Chill"), "c1")
+        self.assertEqual(self.database.labels.genre("rock"), "g0")
+        self.assertIsNone(self.database.labels.genre("jazz"))
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(self.database.get_category("Party").cid, "c0")
+
+    def test_indexes(self):
+        self.assertListEqual(self.database.labels.names(), ["Chill", "Party", "rock"])
+        self.assertDictEqual(target_indexes(self.database.labels.indexes()),
+                             target_indexes(["rock", "Party", "Chill"]))
+        self.assertListEqual(list(map_target(["rock"], self.database.labels.indexes())), [0, 0, 1])
+
+    def test_invalidate(self):
+        self.assertEqual(len(self.database.labels), 3)
+        self.database.add_genre("jazz", "jazz")
+        self.database.add_category("focus", "Focus")
+        self.assertIsNotNone(self.database.labels.genre("jazz"))
+        self.assertEqual(self.database.labels.indexes()["jazz"], 3)
+        self.database.remove_genre("rock")
+        self.assertIsNone(self.database.labels.genre("rock"))
+
+
+if __name__ == '__main__':
+    unittest.main()
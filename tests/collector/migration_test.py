@@ -0,0 +1,108 @@
+from recommender.collector import migrate_database
+from recommender.collector.music import TRACK_CATEGORY_ASSOCIATION, Track, sample_key
+from recommender.collector.observation import BatchSessions
+from sqlalchemy import create_engine, inspect, select, func
+from sqlalchemy.orm import sessionmaker
+import logging
+import unittest
+
+# the schema as it was before the indexes, the sample keys and the seeds of sessions were declared
+BASELINE = [
+    """CREATE TABLE batch_sessions (
+        batch_id VARCHAR NOT NULL,
+        count INTEGER,
+        PRIMARY KEY (batch_id))""",
+    """CREATE TABLE categories (
+        cid VARCHAR NOT NULL,
+        category_id VARCHAR,
+        category VARCHAR,
+        location VARCHAR,
+        PRIMARY KEY (cid))""",
+    """CREATE TABLE genres (
+        gid VARCHAR NOT NULL,
+        genre_id VARCHAR,
+        genre VARCHAR,
+        PRIMARY KEY (gid))""",
+    """CREATE TABLE tracks (
+        internal_id VARCHAR NOT NULL,
+        internal_count INTEGER,
+        track_id VARCHAR,
+        url VARCHAR,
+        title VARCHAR,
+        artist VARCHAR,
+        last_trained DATETIME,
+        PRIMARY KEY (internal_id))""",
+    "CREATE INDEX ix_tracks_internal_count ON tracks (internal_count)",
+    """CREATE TABLE cross_test_observation (
+        id VARCHAR NOT NULL,
+        session VARCHAR,
+        track_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(track_id) REFERENCES tracks (track_id))""",
+    """CREATE TABLE test_observations (
+        id VARCHAR NOT NULL,
+        session VARCHAR,
+        track_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(track_id) REFERENCES tracks (track_id))""",
+    """CREATE TABLE track_category_association (
+        track_id VARCHAR,
+        category_id VARCHAR,
+        FOREIGN KEY(track_id) REFERENCES tracks (track_id),
+        FOREIGN KEY(category_id) REFERENCES categories (cid))""",
+    """CREATE TABLE track_genre_association (
+        track_id VARCHAR,
+        genre_id VARCHAR,
+        FOREIGN KEY(track_id) REFERENCES tracks (track_id),
+        FOREIGN KEY(genre_id) REFERENCES genres (gid))""",
+    """CREATE TABLE training_observations (
+        id VARCHAR NOT NULL,
+        session VARCHAR,
+        track_id VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(track_id) REFERENCES tracks (track_id))""",
+]
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        with self.engine.begin() as connection:
+            for statement in BASELINE:
+                connection.execute(statement)
+            connection.execute("INSERT INTO tracks (internal_id, track_id, url) VALUES "
+                               "('internal0', 'track0', 'url0'), ('internal1', 'track1', 'url1')")
+            connection.execute("INSERT INTO batch_sessions (batch_id, count) VALUES ('session', 2)")
+            connection.execute(TRACK_CATEGORY_ASSOCIATION.insert(), [
+                {"track_id": "track", "category_id": "c0"},
+                {"track_id": "track", "category_id": "c0"},
+                {"track_id": "track", "category_id": "c1"}])
+
+    def test_migrate(self):
+        created = migrate_database(self.engine, logging.getLogger("migration"))
+        inspector = inspect(self.engine)
+        indexes = {index["name"]: index for index in inspector.get_indexes("track_category_association")}
+        self.assertTrue(indexes["ix_track_category_association_track_category"]["unique"])
+        self.assertIn("ix_training_observations_session_id", created)
+        self.assertIn("ix_tracks_track_id", created)
+        self.assertIn("ix_tracks_sample_key", created)
+        with self.engine.connect() as connection:
+            count = connection.execute(select([func.count()]).select_from(TRACK_CATEGORY_ASSOCIATION)).scalar()
+        self.assertEqual(count, 2)
+        self.assertListEqual(migrate_database(self.engine, logging.getLogger("migration")), [])
+
+    def test_columns(self):
+        migrate_database(self.engine, logging.getLogger("migration"))
+        self.assertTrue({"seed", "stratify"}.issubset(
+            column["name"] for column in inspect(self.engine).get_columns("batch_sessions")))
+        # the models can be queried once the columns exist and the tracks saved before have their sample keys
+        sess = sessionmaker(bind=self.engine)()
+        self.assertDictEqual({track.track_id: track.sample_key for track in sess.query(Track)},
+                             {"track0": sample_key("track0"), "track1": sample_key("track1")})
+        session = sess.query(BatchSessions).one()
+        self.assertIsNone(session.seed)
+        sess.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from recommender.collector import initialize_database
+from recommender.collector.music import Track, Category, Genre, sample_key
+from recommender.collector.music_manager import RelationalDatabase
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import logging
+import unittest
+
+
+def crawled_track(i: int, title: str = None) -> Track:
+    track = Track(track_id=f"track{i:04}", title=title or f"{i}", url=f"url{i}", artist="artist")
+    track.category_list = [f"category{i % 3}"]
+    track.genre_list = [f"genre {i % 2}", "unknown"]
+    return track
+
+
+class SaveTracksTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        initialize_database(self.engine)
+        self.sess = sessionmaker(bind=self.engine)()
+        self.sess.add_all([Category(cid=f"c{i}", category_id=f"category{i}", category=f"category {i}")
+                           for i in range(3)])
+        self.sess.add_all([Genre(gid=f"g{i}", genre_id=f"genre{i}", genre=f"genre {i}") for i in range(2)])
+        self.sess.commit()
+        self.database = RelationalDatabase(self.sess, logging.getLogger("database"))
+
+    def test_save_tracks(self):
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        saved = self.database.save_tracks((crawled_track(i) for i in range(250)), chunk_size=100)
+        self.assertEqual(saved, 250)
+        # the two label maps, then a lookup and three inserts per chunk
+        self.assertEqual(len(statements), 2 + 3 * 4)
+
+        track = self.sess.query(Track).filter(Track.track_id == "track0004").one()
+        self.assertEqual(track.sample_key, sample_key("track0004"))
+        self.assertListEqual([category.cid for category in track.categories], ["c1"])
+        self.assertListEqual([genre.gid for genre in track.genres], ["g0"])
+
+    def test_update_tracks(self):
+        self.database.save_tracks([crawled_track(i) for i in range(10)])
+        update = crawled_track(3, title="renamed")
+        update.category_list = ["category0", "category 2"]
+        self.assertEqual(self.database.save_tracks([update, update]), 1)
+
+        self.assertEqual(self.sess.query(Track).count(), 10)
+        track = self.sess.query(Track).filter(Track.track_id == "track0003").one()
+        self.assertEqual(track.title, "renamed")
+        self.assertListEqual(sorted(category.cid for category in track.categories), ["c0", "c2"])
+        self.assertEqual(len(track.genres), 1)
+
+    def test_existing_ids(self):
+        self.database.save_tracks([crawled_track(i) for i in range(10)])
+        self.assertSetEqual(self.database.existing_ids(["track0001", "track0020"]), {"track0001"})
+        self.assertTrue(self.database.exists_track("track0002"))
+
+        self.assertEqual(self.database.warm_track_ids(chunk_size=3), 10)
+        statements = []
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        self.assertSetEqual(self.database.existing_ids(["track0001", "track0020"]), {"track0001"})
+        self.assertListEqual(statements, [])
+        self.database.save_tracks([crawled_track(20)])
+        self.database.remove_track("track0001")
+        self.assertSetEqual(self.database.existing_ids(["track0001", "track0020"]), {"track0020"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,15 @@
-from recommender.collector.saver import FileSaver
+from recommender.collector.saver import FileSaver, MemoryMappedSaver, DatabaseSaver
+import recommender.collector.saver as saver_module
+from recommender.collector import initialize_database
+from recommender.collector.result import TrackResult
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from sqlalchemy.orm import sessionmaker
 import logging
+import shutil
+import threading
+import glob
+import os
 import unittest
 import numpy as np
 
@@ -23,5 +33,217 @@ class FileSaverTests(unittest.TestCase):
         self.saver.close()
 
 
+class SegmentLogTests(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree("tmp/log", ignore_errors=True)
+        self.saver = self.open()
+
+    def open(self):
+        return FileSaver("tmp/log/results.save", logging.getLogger("file_saver"), segment_size=200, max_segments=3)
+
+    def test_overwrite(self):
+        self.saver.append_results(["a", "b"], np.arange(6).reshape(2, 3) / 7)
+        self.saver.save_results(["a"], np.ones((1, 3)))
+        self.assertEqual(len(self.saver), 2)
+        np.testing.assert_array_equal(self.saver.load_results(["a", "b"]), [[1, 1, 1], np.arange(3, 6) / 7])
+
+    def test_compaction(self):
+        for i in range(40):
+            self.saver.append_results([f"track{i % 5}"], np.full((1, 4), i))
+        self.saver.condense_file()
+        self.assertListEqual(glob.glob("tmp/log/results.save.*"), [])
+        with open("tmp/log/results.save") as file:
+            self.assertEqual(len(file.readlines()), 6)
+        np.testing.assert_array_equal(self.saver.load_results([f"track{i}" for i in range(5)])[:, 0], range(35, 40))
+
+        self.saver.close()
+        self.saver = self.open()
+        self.assertEqual(len(self.saver), 5)
+        np.testing.assert_array_equal(self.saver.load_results(["track2"]), [[37] * 4])
+
+    def test_background(self):
+        def append(thread):
+            for i in range(200):
+                self.saver.append_results([f"{thread}-{i % 20}"], np.full((1, 4), i))
+
+        threads = [threading.Thread(target=append, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.saver.condense_file()
+        ids = [f"{thread}-{i}" for thread in range(4) for i in range(20)]
+        np.testing.assert_array_equal(self.saver.load_results(ids)[:, 0], [180 + i for _ in range(4) for i in range(20)])
+        # the segments were merged while appending, so only the compacted file is left
+        self.assertListEqual(glob.glob("tmp/log/results.save.*"), [])
+
+    def test_batched_compaction(self):
+        batch_size = saver_module.COMPACTION_BATCH
+        saver_module.COMPACTION_BATCH = 3
+        try:
+            for i in range(30):
+                self.saver.append_results([f"track{i % 10}"], np.full((1, 2), i))
+            self.saver.condense_file()
+        finally:
+            saver_module.COMPACTION_BATCH = batch_size
+        np.testing.assert_array_equal(self.saver.load_results([f"track{i}" for i in range(10)])[:, 0],
+                                      range(20, 30))
+        self.assertFalse(os.path.exists("tmp/log/results.save.compact"))
+
+    def test_failed_compaction(self):
+        for i in range(30):
+            self.saver.append_results([f"track{i % 10}"], np.full((1, 2), i))
+        repoint = self.saver.__repoint__
+        calls = []
+
+        def failing(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise OSError(28, "No space left on device")
+            return repoint(*args)
+
+        batch_size = saver_module.COMPACTION_BATCH
+        saver_module.COMPACTION_BATCH = 3
+        self.saver.__repoint__ = failing
+        try:
+            self.saver.condense_file()
+        finally:
+            saver_module.COMPACTION_BATCH = batch_size
+            del self.saver.__repoint__
+        # the tracks pointed to the failed file before the failure are read from the segments again
+        np.testing.assert_array_equal(self.saver.load_results([f"track{i}" for i in range(10)])[:, 0],
+                                      range(20, 30))
+        self.assertFalse(os.path.exists("tmp/log/results.save.compact"))
+
+        self.saver.condense_file()
+        np.testing.assert_array_equal(self.saver.load_results([f"track{i}" for i in range(10)])[:, 0],
+                                      range(20, 30))
+        self.saver.close()
+        self.saver = self.open()
+        np.testing.assert_array_equal(self.saver.load_results([f"track{i}" for i in range(10)])[:, 0],
+                                      range(20, 30))
+
+    def test_torn_line(self):
+        self.saver.append_results(["a", "b"], np.ones((2, 2)))
+        self.saver.close()
+        # the process stopped while appending the last line
+        with open("tmp/log/results.save.1", "a") as file:
+            file.write("c:[1. ")
+        self.saver = self.open()
+        self.assertListEqual(sorted(self.saver.track_ids()), ["a", "b"])
+        self.saver.append_results(["c"], np.zeros((1, 2)))
+        self.saver.condense_file()
+        np.testing.assert_array_equal(self.saver.load_results(["a", "c"]), [[1, 1], [0, 0]])
+
+    def test_interrupted_compaction(self):
+        self.saver.append_results(["a"], np.zeros((1, 2)))
+        self.saver.condense_file()
+        self.saver.append_results(["a"], np.ones((1, 2)))
+        self.saver.close()
+        # a merged segment left behind by a compaction that stopped before removing it is skipped
+        with open("tmp/log/results.save.1", "w") as file:
+            file.write("a:[5. 5.]\n")
+        self.saver = self.open()
+        np.testing.assert_array_equal(self.saver.load_results(["a"]), [[1, 1]])
+        self.assertFalse(os.path.exists("tmp/log/results.save.1"))
+
+    def tearDown(self):
+        self.saver.close()
+
+
+class MemoryMappedSaverTests(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree("tmp/memmap", ignore_errors=True)
+        self.saver = MemoryMappedSaver("tmp/memmap/results.map", logging.getLogger("memmap_saver"), capacity=2)
+
+    def test_append(self):
+        self.saver.append_results(["a", "b"], np.arange(8).reshape(2, 4))
+        self.saver.append_results(["c", "d", "e"], np.ones((3, 4)))
+        self.assertEqual(len(self.saver), 5)
+        np.testing.assert_array_equal(self.saver.load_results(["b", "e"]), [[4, 5, 6, 7], [1, 1, 1, 1]])
+        self.assertEqual(self.saver.results().dtype, np.float32)
+        self.assertEqual(self.saver.results().shape, (5, 4))
+
+    def test_update(self):
+        self.saver.append_results(["a", "b"], np.zeros((2, 4)))
+        view = self.saver.results()
+        self.saver.save_results(["b"], np.full((1, 4), 2))
+        self.assertEqual(len(self.saver), 2)
+        self.assertEqual(self.saver.row("b"), 1)
+        # the results are updated in place, so views see the update
+        np.testing.assert_array_equal(view[1], [2, 2, 2, 2])
+
+    def test_reopen(self):
+        self.saver.append_results(["a", "b", "c"], np.arange(12).reshape(3, 4))
+        self.saver.condense_file()
+        self.saver.close()
+        with open("tmp/memmap/results.map.index") as index:
+            self.assertListEqual(index.read().split(), ["4", "a", "b", "c"])
+        self.saver = MemoryMappedSaver("tmp/memmap/results.map", logging.getLogger("memmap_saver"))
+        np.testing.assert_array_equal(self.saver.load_results(["c", "a"]), [[8, 9, 10, 11], [0, 1, 2, 3]])
+        self.saver.append_results(["d"], np.ones((1, 4)))
+        self.assertEqual(self.saver.row("d"), 3)
+        with self.assertRaises(ValueError):
+            self.saver.append_results(["e"], np.ones((1, 3)))
+
+    def test_foreign_file(self):
+        with open("tmp/memmap/results.txt", "w") as file:
+            file.write("a 1.0 2.0\n")
+        # the results of a text saver are kept instead of being overwritten by rows
+        with self.assertRaises(ValueError):
+            MemoryMappedSaver("tmp/memmap/results.txt", logging.getLogger("memmap_saver"))
+        with open("tmp/memmap/results.txt") as file:
+            self.assertEqual(file.read(), "a 1.0 2.0\n")
+        self.assertFalse(os.path.exists("tmp/memmap/results.txt.index"))
+
+    def tearDown(self):
+        self.saver.close()
+
+
+class DatabaseSaverTests(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        initialize_database(engine)
+        self.sess = sessionmaker(bind=engine)()
+        self.saver = DatabaseSaver(self.sess, logging.getLogger("database_saver"))
+
+    def test_append(self):
+        self.saver.append_results(["a", "b"], np.arange(8).reshape(2, 4))
+        self.saver.append_results(["b", "c"], np.ones((2, 4)))
+        self.assertEqual(self.sess.query(TrackResult).count(), 3)
+        results = self.saver.load_results(["b", "a", "c"])
+        self.assertEqual(results.dtype, np.float32)
+        np.testing.assert_array_equal(results, [[1, 1, 1, 1], [0, 1, 2, 3], [1, 1, 1, 1]])
+
+    def test_bulk(self):
+        tids = [f"track{i}" for i in range(1000)]
+        self.saver.save_results(tids, np.random.rand(1000, 8))
+        self.saver.save_results(tids[:10] + tids[:10], np.zeros((20, 8)))
+        self.assertEqual(self.sess.query(TrackResult).count(), 1000)
+        np.testing.assert_array_equal(self.saver.load_results(tids[:10]), np.zeros((10, 8)))
+
+    def test_upsert(self):
+        rows = [{"track_id": "a", "width": 1, "result": b"", "updated": None}]
+        for dialect, clause in ((postgresql, "ON CONFLICT (track_id) DO UPDATE"),
+                                (sqlite, "ON CONFLICT (track_id) DO UPDATE"),
+                                (mysql, "ON DUPLICATE KEY UPDATE")):
+            statement = self.saver.__upsert__(rows, dialect.dialect.name)
+            self.assertIn(clause, str(statement.compile(dialect=dialect.dialect())))
+        self.assertIsNone(self.saver.__upsert__(rows, "mssql"))
+
+    def test_single_statement(self):
+        statements = []
+        event.listen(self.sess.bind, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        tids = [f"track{i}" for i in range(300)]
+        self.saver.save_results(tids, np.zeros((300, 8)))
+        # sqlite binds at most 999 parameters, so the batch is split, and every part is a single upsert
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all("ON CONFLICT" in statement for statement in statements))
+
+    def tearDown(self):
+        self.saver.close()
+        self.sess.close()
+
+
 if __name__ == "__main__":
     unittest.main()
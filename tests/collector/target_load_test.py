@@ -1,6 +1,10 @@
-from recommender.collector.tools import create_batch
+from recommender.collector.tools import create_batch, fit_features, map_target
+from recommender.collector.feature_cache import FeatureCache
 from . import ROOT_DIR
+import logging
+import shutil
 import unittest
+import numpy as np
 
 
 class TargetLoadTest(unittest.TestCase):
@@ -15,5 +19,44 @@ class TargetLoadTest(unittest.TestCase):
         print(target)
 
 
+class BatchShapeTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = FeatureCache("tmp/shape_cache", logging.getLogger("feature_cache"))
+        self.cache.put("short", np.ones((100, 32)))
+        self.cache.put("long", np.ones((3000, 32)))
+
+    def test_create_batch_shape(self):
+        data = [(["hello"], "tmp/short.mp3"), (["hi", "hola"], "tmp/long.mp3")]
+        batch, target = create_batch(data, ["hello", "bonjour", "hi", "hola"], cache=self.cache)
+        self.assertTupleEqual(batch.shape, (2, 2048, 32))
+        self.assertTupleEqual(target.shape, (2, 4))
+        self.assertEqual(batch.dtype, np.float32)
+        self.assertTrue(batch.flags["C_CONTIGUOUS"])
+        self.assertEqual(batch[0, :100].min(), 1)
+        self.assertEqual(batch[0, 100:].max(), 0)
+        self.assertEqual(batch[1].min(), 1)
+        np.testing.assert_array_equal(target, [[0, 1, 0, 0], [0, 0, 1, 1]])
+
+    def test_fit_features(self):
+        out = np.full((8, 4), -1, dtype=np.float32)
+        fit_features(np.ones((5, 4)), out)
+        np.testing.assert_array_equal(out[:5], 1)
+        np.testing.assert_array_equal(out[5:], 0)
+        fit_features(np.arange(40).reshape((10, 4)), out)
+        np.testing.assert_array_equal(out, np.arange(32).reshape((8, 4)))
+
+    def test_fit_features_channels(self):
+        with self.assertRaises(ValueError):
+            fit_features(np.ones((5, 20)), np.zeros((8, 32)))
+
+    def test_map_target(self):
+        out = np.ones(3, dtype=np.float32)
+        map_target(["b"], {"a": 0, "b": 1, "c": 2}, out=out)
+        np.testing.assert_array_equal(out, [0, 1, 0])
+
+    def tearDown(self):
+        shutil.rmtree("tmp/shape_cache", ignore_errors=True)
+
+
 if __name__ == "__main__":
     unittest.main()
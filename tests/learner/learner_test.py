@@ -32,6 +32,36 @@ class TestPredictor(unittest.TestCase):
         for _ in range(1, 20):
             self.model.train(np.zeros([1, 2048, 32]), np.zeros([1, 10]))
 
+    def test_train_graph_size(self):
+        """Test that training does not add operations to the graph"""
+        self.model.train(np.zeros([1, 2048, 32]), np.zeros([1, 10]))
+        operations = len(tf.get_default_graph().get_operations())
+        for _ in range(1, 20):
+            loss = self.model.train(np.zeros([1, 2048, 32]), np.zeros([1, 10]))
+        self.assertEqual(operations, len(tf.get_default_graph().get_operations()))
+        self.assertIsInstance(float(loss), float)
+
+    def test_predict_batches(self):
+        """Test that batched predictions keep their order and the graph does not grow"""
+        # dropout makes every run differ, so the predictions are compared without it
+        self.model.close()
+        tf.reset_default_graph()
+        self.model = LearnerModel(categories=10, logger=logging.getLogger("test"), dropout=False)
+        self.model.build_graph()
+        self.model.initialize()
+
+        random = np.random.RandomState(7)
+        observations = [random.standard_normal([2048, 32]).astype(np.float32) for _ in range(5)]
+        expected = self.model.predict(np.stack(observations))
+        operations = len(tf.get_default_graph().get_operations())
+        # two full batches and a last batch padded from one observation to two
+        results = list(self.model.predict_batches(observations, batch_size=2))
+        self.assertEqual(len(results), 5)
+        for result, prediction in zip(results, expected):
+            self.assertTupleEqual(result.shape, (10,))
+            np.testing.assert_allclose(result, prediction, rtol=1e-4, atol=1e-6)
+        self.assertEqual(operations, len(tf.get_default_graph().get_operations()))
+
     def test_flush(self):
         """Test whether the graph can be run with a zero array"""
         result = self.model.predict(np.zeros([1, 2048, 32]))
@@ -0,0 +1,50 @@
+from recommender.similarity.exact import ExactSearch, recall
+from recommender.similarity.lsh import LSHIndex
+import numpy as np
+import logging
+import unittest
+
+
+class ExactSearchTest(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(5)
+        centers = random.standard_normal((20, 16))
+        self.vectors = (np.repeat(centers, 25, axis=0) + 0.1 * random.standard_normal((500, 16))).astype(np.float32)
+        self.ids = [f"track{i}" for i in range(500)]
+        # blocks smaller than the catalog and the queries, so the results are merged across blocks
+        self.search = ExactSearch(self.ids, self.vectors, logging.getLogger("exact"), block_size=64,
+                                  query_block_size=7)
+
+    def test_search(self):
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        scores = normalized[:30] @ normalized.T
+        rows, found = self.search.search(self.vectors[:30], 10)
+        np.testing.assert_array_equal(rows, np.argsort(-scores, axis=1, kind="stable")[:, :10])
+        np.testing.assert_allclose(found, -np.sort(-scores, axis=1)[:, :10], rtol=1e-5)
+
+    def test_query(self):
+        similar = self.search.query_many(["track3", "track260"], 5)
+        self.assertEqual(len(similar), 2)
+        self.assertNotIn("track3", [tid for tid, _ in similar[0]])
+        self.assertTrue(all(0 <= int(tid[5:]) < 25 for tid, _ in similar[0]))
+        self.assertTrue(all(250 <= int(tid[5:]) < 275 for tid, _ in similar[1]))
+        self.assertListEqual([tid for tid, _ in self.search.query("track3", 5)], [tid for tid, _ in similar[0]])
+
+    def test_dot(self):
+        search = ExactSearch(self.ids, self.vectors, logging.getLogger("exact"), metric="dot", block_size=100)
+        rows, scores = search.search(self.vectors[:3], 4)
+        np.testing.assert_array_equal(rows, np.argsort(-(self.vectors[:3] @ self.vectors.T), axis=1)[:, :4])
+
+    def test_small_catalog(self):
+        search = ExactSearch(self.ids[:3], self.vectors[:3], logging.getLogger("exact"))
+        self.assertEqual(len(search.query("track0", 5)), 2)
+
+    def test_recall(self):
+        index = LSHIndex(16, logging.getLogger("lsh"), bits=8, tables=6, seed=2)
+        index.build(self.ids, self.vectors)
+        self.assertEqual(recall(self.search, self.search, self.ids[:50], 10), 1.0)
+        self.assertGreaterEqual(recall(index, self.search, self.ids[:50], 10), 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
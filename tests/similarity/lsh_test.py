@@ -0,0 +1,76 @@
+from recommender.similarity.lsh import LSHIndex
+import numpy as np
+import logging
+import shutil
+import unittest
+
+
+class LSHIndexTest(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(3)
+        # 40 clusters of 50 tracks each
+        centers = random.standard_normal((40, 32))
+        self.vectors = (np.repeat(centers, 50, axis=0) + 0.1 * random.standard_normal((2000, 32))).astype(np.float32)
+        self.ids = [f"track{i}" for i in range(2000)]
+        self.index = LSHIndex(32, logging.getLogger("lsh"), bits=12, tables=8, seed=1)
+        self.index.build(self.ids, self.vectors)
+
+    def exact(self, row, k):
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        scores = normalized @ normalized[row]
+        scores[row] = -np.inf
+        return {self.ids[i] for i in np.argsort(-scores)[:k]}
+
+    def test_query(self):
+        recall = []
+        for row in range(0, 2000, 97):
+            similar = self.index.query(self.ids[row], 10)
+            self.assertEqual(len(similar), 10)
+            self.assertNotIn(self.ids[row], [tid for tid, _ in similar])
+            scores = [score for _, score in similar]
+            self.assertListEqual(scores, sorted(scores, reverse=True))
+            recall.append(len(self.exact(row, 10).intersection(tid for tid, _ in similar)) / 10)
+        self.assertGreaterEqual(np.mean(recall), 0.9)
+
+    def test_add(self):
+        vector = self.vectors[5] + 0.01
+        self.index.add(["new"], vector[None])
+        # the new track is pending until the tables are merged again
+        self.assertEqual(self.index.query_vector(vector, 1)[0][0], "new")
+        self.assertIn("new", [tid for tid, _ in self.index.query("track5", 5)])
+
+        self.index.add(["new"], self.vectors[1500][None])
+        self.assertEqual(len(self.index), 2001)
+        self.assertIn("new", [tid for tid, _ in self.index.query("track1500", 5)])
+        self.assertNotIn("new", [tid for tid, _ in self.index.query("track5", 5)])
+
+    def test_persist(self):
+        shutil.rmtree("tmp/lsh", ignore_errors=True)
+        self.index.add(["new"], self.vectors[7][None])
+        self.index.save("tmp/lsh")
+        loaded = LSHIndex.load("tmp/lsh", logging.getLogger("lsh"))
+        self.assertIsInstance(loaded.vector("track3"), np.memmap)
+        self.assertListEqual(loaded.query("track3", 10), self.index.query("track3", 10))
+        loaded.add(["other"], self.vectors[9][None])
+        self.assertIn("other", [tid for tid, _ in loaded.query("track9", 5)])
+        shutil.rmtree("tmp/lsh", ignore_errors=True)
+
+    def test_save_loaded(self):
+        shutil.rmtree("tmp/lsh", ignore_errors=True)
+        self.index.save("tmp/lsh")
+        loaded = LSHIndex.load("tmp/lsh", logging.getLogger("lsh"))
+        self.assertNotIsInstance(loaded.__planes__, np.memmap)
+        # the arrays are mapped from the files they are saved over
+        loaded.save("tmp/lsh")
+        loaded.add(["new"], self.vectors[11][None])
+        loaded.save("tmp/lsh")
+        loaded.save("tmp/lsh")
+        reloaded = LSHIndex.load("tmp/lsh", logging.getLogger("lsh"))
+        self.assertEqual(len(reloaded), 2001)
+        self.assertIn("new", [tid for tid, _ in reloaded.query("track11", 5)])
+        self.assertListEqual(reloaded.query("track3", 10), self.index.query("track3", 10))
+        shutil.rmtree("tmp/lsh", ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+from recommender.train_ops import Stage, Downloader, Extractor, TrainingPipeline, TrainingConfiguration, \
+    PipelineConfiguration, DownloadConfiguration, STOP
+from recommender.collector.tools import AudioBuffer
+from collections import deque, namedtuple
+import numpy as np
+import threading
+import shutil
+import queue
+import time
+import os
+import unittest
+
+FakeTrack = namedtuple("FakeTrack", ["track_id"])
+
+
+class Source(Stage):
+    """Puts numbers into its outbox, counting the numbers produced."""
+
+    def __init__(self, outbox: queue.Queue, count: int):
+        super(Source, self).__init__("source", None, outbox)
+        self.count = count
+        self.produced = 0
+
+    def work(self) -> None:
+        for i in range(self.count):
+            self.produced += 1
+            self.outbox.put(i)
+
+
+class Worker(Stage):
+    """Records when it processes every item, waiting for the gate and failing on the items given."""
+
+    def __init__(self, name: str, inbox: queue.Queue, outbox, delay: float = 0, fail=(), gate: threading.Event = None):
+        super(Worker, self).__init__(name, inbox, outbox)
+        self.delay = delay
+        self.fail = set(fail)
+        self.gate = gate
+        self.processed = []
+        self.intervals = []
+        self.finished = False
+
+    def process(self, item):
+        if self.gate is not None:
+            self.gate.wait()
+        start = time.monotonic()
+        time.sleep(self.delay)
+        self.intervals.append((start, time.monotonic()))
+        if item in self.fail:
+            raise ValueError(f"failed on {item}")
+        self.processed.append(item)
+        return [item]
+
+    def finish(self) -> None:
+        self.finished = True
+
+
+class StageTest(unittest.TestCase):
+    def connect(self, *stages):
+        for stage, following in zip(stages, stages[1:]):
+            stage.downstream = following.workers
+        for stage in stages:
+            stage.start()
+
+    def test_overlap(self):
+        first, second = queue.Queue(maxsize=2), queue.Queue(maxsize=2)
+        source = Source(first, 6)
+        upstream = Worker("upstream", first, second, delay=0.05)
+        downstream = Worker("downstream", second, None, delay=0.05)
+        self.connect(source, upstream, downstream)
+        for stage in (source, upstream, downstream):
+            stage.join(5)
+        self.assertListEqual(downstream.processed, list(range(6)))
+        # the second stage works on an item while the first works on the next one
+        self.assertTrue(any(start < other_end and other_start < end
+                            for start, end in upstream.intervals[1:]
+                            for other_start, other_end in downstream.intervals))
+
+    def test_backpressure(self):
+        first = queue.Queue(maxsize=2)
+        gate = threading.Event()
+        source = Source(first, 100)
+        blocked = Worker("blocked", first, None, gate=gate)
+        self.connect(source, blocked)
+        time.sleep(0.2)
+        # the queue is full, the worker holds one item and the source is blocked putting the next one
+        self.assertLessEqual(source.produced, 2 + 1 + 1)
+        gate.set()
+        source.join(5)
+        blocked.join(5)
+        self.assertEqual(len(blocked.processed), 100)
+
+    def test_shutdown_after_error(self):
+        first, second = queue.Queue(maxsize=2), queue.Queue(maxsize=2)
+        source = Source(first, 10)
+        failing = Worker("failing", first, second, fail={3, 7})
+        last = Worker("last", second, None)
+        self.connect(source, failing, last)
+        for stage in (source, failing, last):
+            stage.join(5)
+        self.assertListEqual(last.processed, [0, 1, 2, 4, 5, 6, 8, 9])
+        self.assertTrue(failing.finished and last.finished)
+        self.assertFalse(any(thread.is_alive() for stage in (source, failing, last) for thread in stage.__threads__))
+
+
+class RecordingCollector:
+    def __init__(self):
+        self.fetched = []
+
+    def fetch_track_sample(self, directory, tracks):
+        self.fetched.extend(track.track_id for track in tracks)
+        return [(track, os.path.join(directory, f"{track.track_id}.mp3")) for track in tracks]
+
+
+class CachingExtractor:
+    def cached(self, track_id):
+        return track_id.startswith("cached")
+
+
+class DownloaderTest(unittest.TestCase):
+    def test_cached(self):
+        collector = RecordingCollector()
+        downloader = Downloader(collector, DownloadConfiguration("tmp", 3), None, None, extractor=CachingExtractor())
+        item = [(FakeTrack("cached-a"), ["pop"]), (FakeTrack("b"), ["rock"]), (FakeTrack("cached-c"), ["jazz"])]
+        [samples] = downloader.process(item)
+        # the tracks with cached features are passed on in order without being downloaded
+        self.assertListEqual(collector.fetched, ["b"])
+        self.assertListEqual([targets for targets, _ in samples], [["pop"], ["rock"], ["jazz"]])
+        self.assertEqual(samples[1][1], os.path.join("tmp", "b.mp3"))
+        for _, sample in (samples[0], samples[2]):
+            self.assertIsInstance(sample, AudioBuffer)
+            self.assertIsNone(sample.data)
+
+        [samples] = downloader.process(item[:1])
+        self.assertListEqual(collector.fetched, ["b"])
+        self.assertEqual(samples[0][1].track_id, "cached-a")
+
+
+class FailingExtractor:
+    """Extracts one batch ahead of the consumer like FeatureExtractor and fails on batches with a bad sample."""
+
+    def __init__(self):
+        self.closed = False
+
+    def extract(self, batches):
+        pending = deque()
+
+        def collect(data):
+            if any("bad" in file for _, file in data):
+                raise ValueError("bad sample")
+            return np.zeros((len(data), 4)), np.zeros((len(data), 2))
+
+        for data in batches:
+            pending.append(data)
+            if len(pending) > 1:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+
+    def close(self):
+        self.closed = True
+
+
+class ExtractorTest(unittest.TestCase):
+    def setUp(self):
+        shutil.rmtree("tmp/pipeline", ignore_errors=True)
+        os.makedirs("tmp/pipeline")
+
+    def sample(self, name):
+        file = os.path.join("tmp/pipeline", name)
+        open(file, "w").close()
+        return file
+
+    def test_dropped_batches(self):
+        inbox, outbox = queue.Queue(), queue.Queue()
+        batches = [[(["pop"], self.sample("a.mp3"))], [(["pop"], self.sample("bad.mp3"))],
+                   [(["pop"], self.sample("b.mp3"))]]
+        for batch in batches:
+            inbox.put(batch)
+        inbox.put(STOP)
+        extractor = FailingExtractor()
+        stage = Extractor(extractor, inbox, outbox)
+        stage.start()
+        stage.join(5)
+
+        _, _, files = outbox.get()
+        self.assertListEqual(files, ["tmp/pipeline/a.mp3"])
+        self.assertIs(outbox.get(), STOP)
+        # the failed batch and the batch prefetched with it are removed instead of leaking
+        self.assertListEqual(os.listdir("tmp/pipeline"), ["a.mp3"])
+        self.assertTrue(extractor.closed)
+
+    def test_empty_batch(self):
+        inbox, outbox = queue.Queue(), queue.Queue()
+        inbox.put([(["pop"], self.sample("a.mp3"))])
+        inbox.put(STOP)
+        # every track of the batch failed to extract
+        extractor = FakeExtractor(rows=0)
+        stage = Extractor(extractor, inbox, outbox)
+        stage.start()
+        stage.join(5)
+
+        self.assertIs(outbox.get(), STOP)
+        self.assertListEqual(os.listdir("tmp/pipeline"), [])
+
+    def tearDown(self):
+        shutil.rmtree("tmp/pipeline", ignore_errors=True)
+
+
+class EndlessBatches:
+    def __init__(self):
+        self.fetched = 0
+
+    def iterate_training_batches(self, batch_id, batch_size):
+        while True:
+            self.fetched += 1
+            yield [(FakeTrack(f"{self.fetched}-{i}"), ["pop"]) for i in range(batch_size)]
+
+
+class MemoryCollector:
+    def fetch_track_data(self, tracks):
+        return [(track, b"sample") for track in tracks]
+
+
+class FakeExtractor:
+    def __init__(self, rows: int = None):
+        self.rows = rows
+
+    def cached(self, track_id):
+        return False
+
+    def extract(self, batches):
+        for data in batches:
+            rows = len(data) if self.rows is None else self.rows
+            yield np.zeros((rows, 4)), np.zeros((rows, 2))
+
+    def close(self):
+        pass
+
+
+class FakeModel:
+    def __init__(self):
+        self.trained = 0
+        self.saved = False
+
+    def train(self, batch, target):
+        time.sleep(0.01)
+        self.trained += 1
+        return 0.0
+
+    def save(self, file):
+        self.saved = True
+
+
+class TrainingPipelineTest(unittest.TestCase):
+    def test_stop(self):
+        batches = EndlessBatches()
+        model = FakeModel()
+        pipeline = TrainingPipeline(TrainingConfiguration(False, 2, "tmp", 4, "session"),
+                                    PipelineConfiguration(queue_size=2, download_workers=2, in_memory=True),
+                                    model, batches, MemoryCollector(), FakeExtractor(), "model")
+        pipeline.start()
+        time.sleep(0.2)
+        pipeline.stop()
+        pipeline.join()
+        # the batches fetched before stopping are drained through every stage
+        self.assertTrue(model.saved)
+        self.assertGreater(model.trained, 0)
+        self.assertEqual(model.trained, batches.fetched - 1)
+        self.assertFalse(any(thread.is_alive() for stage in pipeline.stages for thread in stage.__threads__))
+
+
+if __name__ == '__main__':
+    unittest.main()